@@ -0,0 +1,114 @@
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import List
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import faiss
+import numpy as np
+from zhimi.index import ANN_TYPES, build_ann_index, resolve_index_dir, set_search_params
+
+INDEX_PATH = "memory/faiss_index"
+NPROBE_VALUES = [1, 4, 8, 16, 32, 64]
+EF_SEARCH_VALUES = [16, 32, 64, 128, 256]
+
+def sample_queries(flat_index: faiss.Index, count: int, noise: float, seed: int) -> np.ndarray:
+    """以库内向量加少量噪声作为查询向量（避免查询恰好等于某个库内向量）"""
+    rng = np.random.default_rng(seed)
+    ids = rng.choice(flat_index.ntotal, size=min(count, flat_index.ntotal), replace=False)
+    queries = np.vstack([flat_index.reconstruct(int(i)) for i in ids])
+    queries += rng.normal(scale=noise, size=queries.shape).astype(np.float32)
+    # 索引向量已归一化，查询向量同样归一化
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return queries.astype(np.float32)
+
+def timed_search(index: faiss.Index, queries: np.ndarray, k: int):
+    """逐条查询（与线上单条检索一致），返回结果和每条查询的耗时（毫秒）"""
+    results, latencies = [], []
+    for query in queries:
+        start_time = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - start_time) * 1000)
+        results.append(ids[0])
+    return np.array(results), np.array(latencies)
+
+def recall_at_k(results: np.ndarray, truth: np.ndarray) -> float:
+    """近似结果与精确结果前 k 个的平均重合比例"""
+    k = truth.shape[1]
+    return float(np.mean([len(set(r) & set(t)) / k for r, t in zip(results, truth)]))
+
+def index_bytes(index: faiss.Index) -> int:
+    """索引序列化后的大小"""
+    return len(faiss.serialize_index(index))
+
+def report(index_dir: str, ann_types: List[str], queries_count: int, k: int, noise: float, seed: int) -> List[dict]:
+    """对每种近似索引和查询参数评估召回率与延迟"""
+    index_dir = resolve_index_dir(index_dir)
+    flat_index = faiss.read_index(str(Path(index_dir) / "index.faiss"))
+    print(f"📂 索引: {index_dir}（{flat_index.ntotal} 个向量，{flat_index.d} 维）")
+    queries = sample_queries(flat_index, queries_count, noise, seed)
+    truth, flat_latencies = timed_search(flat_index, queries, k)
+    rows = [{
+        "type": "flat", "param": None, "recall": 1.0,
+        "p50_ms": float(np.percentile(flat_latencies, 50)),
+        "p95_ms": float(np.percentile(flat_latencies, 95)),
+        "bytes_per_vector": index_bytes(flat_index) / max(flat_index.ntotal, 1),
+        "build_seconds": 0.0,
+    }]
+
+    for ann_type in ann_types:
+        print(f"🧭 正在构建 {ann_type} 索引...")
+        start_time = time.time()
+        try:
+            index = build_ann_index(flat_index, ann_type)
+        except RuntimeError as e:
+            print(f"   ⚠️ 构建失败: {e}")
+            continue
+        build_seconds = time.time() - start_time
+        bytes_per_vector = index_bytes(index) / max(index.ntotal, 1)
+        param_name, values = ("efSearch", EF_SEARCH_VALUES) if ann_type == "hnsw" else ("nprobe", NPROBE_VALUES)
+        for value in values:
+            if param_name == "nprobe":
+                set_search_params(index, nprobe=value)
+            else:
+                set_search_params(index, ef_search=value)
+            results, latencies = timed_search(index, queries, k)
+            rows.append({
+                "type": ann_type, "param": f"{param_name}={value}", "recall": recall_at_k(results, truth),
+                "p50_ms": float(np.percentile(latencies, 50)),
+                "p95_ms": float(np.percentile(latencies, 95)),
+                "bytes_per_vector": bytes_per_vector,
+                "build_seconds": build_seconds,
+            })
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="评估近似最近邻索引相对精确检索的召回率与延迟")
+    parser.add_argument("--index", default=INDEX_PATH, help=f"索引目录（默认 {INDEX_PATH}）")
+    parser.add_argument("--types", default=",".join(t for t in ANN_TYPES if t != "flat"), help="逗号分隔的近似索引类型")
+    parser.add_argument("--queries", type=int, default=200, help="查询数量")
+    parser.add_argument("-k", type=int, default=10, help="评估 recall@k 的 k")
+    parser.add_argument("--noise", type=float, default=0.05, help="查询向量的噪声标准差")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--json", help="将结果另存为 JSON 文件")
+    args = parser.parse_args()
+
+    rows = report(args.index, args.types.split(","), args.queries, args.k, args.noise, args.seed)
+
+    print("\n" + "=" * 78)
+    print(f"{'类型':<10}{'查询参数':<16}{'recall@' + str(args.k):>10}{'p50(ms)':>10}{'p95(ms)':>10}{'字节/向量':>12}{'构建(秒)':>10}")
+    print("=" * 78)
+    for row in rows:
+        print(f"{row['type']:<12}{row['param'] or '-':<18}{row['recall']:>10.3f}{row['p50_ms']:>10.3f}"
+              f"{row['p95_ms']:>10.3f}{row['bytes_per_vector']:>12.1f}{row['build_seconds']:>10.1f}")
+    print("=" * 78)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+        print(f"💾 结果已保存到 {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -1,68 +1,177 @@
 import argparse
+import json
+import os
+import shutil
+import sys
 import time
+import uuid
+from functools import lru_cache
 from pathlib import Path
-from langchain_community.document_loaders import TextLoader, PyPDFLoader, UnstructuredMarkdownLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from typing import List, Optional, Tuple
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import faiss
+
 # 使用新的导入方式
 from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from zhimi.index import (
+    ANN_TYPES,
+    COLLECTIONS_PATH,
+    SUPPORTED_SUFFIXES,
+    BM25Index,
+    CachedEmbeddings,
+    ChunkStore,
+    FileManifest,
+    KeywordIndex,
+    MetadataIndex,
+    ann_factory_string,
+    build_ann_index,
+    build_manifest,
+    cached_embeddings,
+    default_tokenizer,
+    iter_file_chunks,
+    load_collection,
+    load_manifest,
+    new_version_dir,
+    publish_version,
+    resolve_index_dir,
+    save_ann_index,
+    save_collection,
+    save_manifest,
+    shard_dir,
+    shard_of,
+)
+from zhimi.index.file_manifest import FILE_MANIFEST_FILE
+from zhimi.index.manifest import MANIFEST_FILE
 
 INDEX_PATH = "memory/faiss_index"
 # 使用更轻量级的模型，减少加载时间和内存使用
+# 查询端通过索引清单读取该模型名称，二者始终一致
 EMBED_MODEL = "BAAI/bge-small-zh-v1.5"  # 约300MB，速度更快
+NORMALIZE_EMBEDDINGS = True
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 100
+SEPARATORS = ["\n\n", "\n", "。", "！", "？", "；", "，"]
+
+# 文档加载与分割的工作进程数（PDF/Markdown 解析为 CPU 密集型）
+LOAD_WORKERS = int(os.getenv("INDEX_LOAD_WORKERS", os.cpu_count() or 1))
+# 流式构建：每批向量化的片段数，以及每隔多少个片段保存一次检查点
+EMBED_BATCH_SIZE = int(os.getenv("INDEX_EMBED_BATCH_SIZE", 256))
+CHECKPOINT_EVERY = int(os.getenv("INDEX_CHECKPOINT_EVERY", 10000))
+# 全量构建的检查点目录（索引目录加后缀），构建中断后再次运行时从这里继续
+CHECKPOINT_SUFFIX = "_checkpoint"
+# 检查点由若干分段组成，每次只写入上次检查点之后新增的片段；checkpoint.json 记录已提交的分段
+CHECKPOINT_STATE_FILE = "checkpoint.json"
+CHECKPOINT_SEGMENTS_DIR = "segments"
+# 近似最近邻索引类型（flat 表示只保留精确的平面索引），由平面索引派生并另存为 ann.faiss
+ANN_TYPE = os.getenv("INDEX_ANN_TYPE", "flat")
+ANN_PARAMS = {
+    "nlist": int(os.getenv("INDEX_ANN_NLIST", 0)) or None,  # IVF 聚类中心数，默认约 4√N
+    "pq_m": int(os.getenv("INDEX_ANN_PQ_M", 0)) or None,  # PQ 子向量数，默认每向量 64 字节
+    "hnsw_m": int(os.getenv("INDEX_ANN_HNSW_M", 32)),
+    "ef_construction": int(os.getenv("INDEX_ANN_EF_CONSTRUCTION", 200)),
+}
+ANN_TRAIN_SAMPLE = int(os.getenv("INDEX_ANN_TRAIN_SAMPLE", 100000))
 
-def load_docs(data_dir: Path):
-    """加载指定目录下的文档"""
-    docs = []
+def scan_files(data_dir: Path) -> List[Path]:
+    """扫描指定目录下所有支持的文档文件（按路径排序，保证结果可复现）"""
     print("🔍 正在扫描文档...")
-    
-    # 获取所有支持的文件
-    supported_files = []
-    for p in data_dir.rglob("*"):
-        if p.suffix in [".txt", ".pdf", ".md", ".markdown"]:
-            supported_files.append(p)
-    
+    supported_files = sorted(p for p in data_dir.rglob("*") if p.suffix in SUPPORTED_SUFFIXES)
     print(f"📂 找到 {len(supported_files)} 个支持的文档文件")
-    
-    # 加载文档
-    for i, p in enumerate(supported_files, 1):
-        print(f"📄 正在加载 ({i}/{len(supported_files)}): {p.name}")
-        try:
-            if p.suffix == ".txt":
-                docs += TextLoader(str(p), encoding="utf-8").load()
-            elif p.suffix == ".pdf":
-                docs += PyPDFLoader(str(p)).load()
-            elif p.suffix in [".md", ".markdown"]:
-                docs += UnstructuredMarkdownLoader(str(p)).load()
-        except Exception as e:
-            print(f"  ⚠️  加载失败: {e}")
-    
-    print(f"✅ 成功加载 {len(docs)} 个文档")
-    return docs
+    return supported_files
 
-def main(data_dir: str):
-    """主函数：构建文档索引"""
-    print("=" * 50)
-    print("📚 开始构建文档向量索引")
-    print("=" * 50)
-    
-    # 1. 加载文档
-    raw_docs = load_docs(Path(data_dir))
-    if not raw_docs:
-        print("❌ 没有找到可处理的文档，请检查目录路径")
-        return
-    
-    # 2. 分割文档
-    print("\n✂️ 正在分割文档...")
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=500,
-        chunk_overlap=100,
-        separators=["\n\n", "\n", "。", "！", "？", "；", "，"]
-    )
-    docs = splitter.split_documents(raw_docs)
-    print(f"📝 文档分割完成: {len(raw_docs)} → {len(docs)} 个片段")
-    
-    # 3. 加载嵌入模型（使用新的 HuggingFaceEmbeddings）
+def embed_files(
+    vs: Optional[FAISS],
+    embeddings,
+    files: List[Path],
+    file_manifest: FileManifest,
+    workers: int,
+    checkpoint_dir: Optional[str] = None,
+    checkpoint_start: int = 0,
+) -> Optional[FAISS]:
+    """
+    流式加载、分割并向量化文件，按批次写入向量索引
+
+    片段逐个文件产出，凑满 EMBED_BATCH_SIZE 个即向量化并加入索引，加载、分割和向量化阶段只保留当前批次；
+    已写入的向量和片段仍保存在内存中的 FAISS 索引及其 docstore 里，构建过程的峰值内存随语料规模线性增长。
+    文件的全部片段写入索引后才登记到文件清单，因此检查点中的清单与向量始终一致。
+    加载失败的文件也登记到文件清单（片段为空），文件内容不变时增量模式不再重复尝试。
+
+    Args:
+        vs: 已有向量索引，为 None 时由第一批片段创建
+        embeddings: 嵌入模型
+        files: 待处理文件
+        file_manifest: 文件清单
+        workers: 文档加载与分割的工作进程数
+        checkpoint_dir: 检查点目录，为 None 时不保存检查点
+        checkpoint_start: 检查点中已保存的片段数，这些片段不再重复写入
+
+    Returns:
+        向量索引，没有任何片段时返回 None
+    """
+    print(f"📄 正在处理 {len(files)} 个文件（{workers} 个工作进程，每批 {EMBED_BATCH_SIZE} 个片段）...")
+    start_time = time.time()
+    batch: List[Document] = []
+    batch_files: List[Tuple[Path, List[str], int]] = []
+    errors = []
+    chunk_count = 0
+    since_checkpoint = 0
+
+    def flush():
+        nonlocal vs
+        for i in range(0, len(batch), EMBED_BATCH_SIZE):
+            docs = batch[i:i + EMBED_BATCH_SIZE]
+            texts = [doc.page_content for doc in docs]
+            text_embeddings = list(zip(texts, embeddings.embed_documents(texts)))
+            metadatas = [doc.metadata for doc in docs]
+            ids = [doc.id for doc in docs]
+            if vs is None:
+                vs = FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas, ids=ids)
+            else:
+                vs.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        for p, chunk_ids, doc_count in batch_files:
+            file_manifest.record(p, chunk_ids, doc_count)
+        batch.clear()
+        batch_files.clear()
+
+    for i, result in enumerate(iter_file_chunks(files, CHUNK_SIZE, CHUNK_OVERLAP, SEPARATORS, workers=workers), 1):
+        print(f"📄 已处理 ({i}/{len(files)}): {result.path.name}")
+        if result.error:
+            print(f"  ⚠️  加载失败: {result.error}")
+            errors.append((result.path, result.error))
+        for chunk in result.chunks:
+            chunk.id = str(uuid.uuid4())
+        batch += result.chunks
+        batch_files.append((result.path, [chunk.id for chunk in result.chunks], result.doc_count))
+        chunk_count += len(result.chunks)
+        since_checkpoint += len(result.chunks)
+
+        if len(batch) >= EMBED_BATCH_SIZE:
+            flush()
+            print(f"   🔧 已向量化 {chunk_count} 个片段")
+            if checkpoint_dir and since_checkpoint >= CHECKPOINT_EVERY:
+                checkpoint_start = save_checkpoint(vs, file_manifest, checkpoint_dir, checkpoint_start)
+                if isinstance(embeddings, CachedEmbeddings):
+                    embeddings.flush()
+                since_checkpoint = 0
+    flush()
+    if isinstance(embeddings, CachedEmbeddings):
+        embeddings.flush()
+
+    elapsed = max(time.time() - start_time, 1e-6)
+    print(f"✅ 处理完成: {chunk_count} 个片段，耗时: {elapsed:.1f}秒（{len(files) / elapsed:.1f} 文件/秒，{chunk_count / elapsed:.1f} 片段/秒）")
+    if errors:
+        print(f"⚠️ {len(errors)} 个文件加载失败:")
+        for p, error in errors:
+            print(f"   - {p}: {error}")
+    return vs
+
+@lru_cache(maxsize=None)
+def create_embeddings():
+    """加载嵌入模型（使用新的 HuggingFaceEmbeddings，构建多个分片时只加载一次）"""
     print("\n🤖 正在加载嵌入模型...")
     print("   ⏳ 首次使用需要下载模型，请耐心等待（约300MB）")
     start_time = time.time()
@@ -72,24 +181,372 @@ def main(data_dir: str):
         model_name=EMBED_MODEL,
         model_kwargs={"device": "cpu"},  # 使用CPU，如需GPU可改为 "cuda"
         encode_kwargs={
-            "normalize_embeddings": True,  # 归一化向量
-            "show_progress_bar": True      # 显示编码进度条
+            "normalize_embeddings": NORMALIZE_EMBEDDINGS,  # 归一化向量
+            "show_progress_bar": False     # 流式分批编码，由构建流程输出进度
         }
     )
     
     load_time = time.time() - start_time
     print(f"   ✅ 模型加载完成，耗时: {load_time:.1f}秒")
+    # 内容未变的片段直接复用缓存的向量，重建索引时无需重新编码
+    return cached_embeddings(embeddings, EMBED_MODEL, NORMALIZE_EMBEDDINGS, "documents")
+
+def index_manifest(vs: FAISS, file_manifest: FileManifest, ann: Optional[dict] = None, tokenizer: Optional[dict] = None) -> dict:
+    """生成当前构建参数对应的索引清单"""
+    return build_manifest(
+        embed_model=EMBED_MODEL,
+        dimension=vs.index.d,
+        normalize=NORMALIZE_EMBEDDINGS,
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        separators=SEPARATORS,
+        doc_count=file_manifest.doc_count,
+        chunk_count=len(vs.index_to_docstore_id),
+        ann=ann,
+        tokenizer=tokenizer,
+    )
+
+def checkpoint_segment(vs: FAISS, start: int) -> FAISS:
+    """取出向量索引中从第 start 个开始的片段（向量和 docstore），作为一个检查点分段"""
+    ids = [vs.index_to_docstore_id[i] for i in range(start, len(vs.index_to_docstore_id))]
+    index = faiss.IndexFlat(vs.index.d, vs.index.metric_type)
+    if ids:
+        index.add(vs.index.reconstruct_n(start, len(ids)))
+    docstore = InMemoryDocstore({doc_id: vs.docstore.search(doc_id) for doc_id in ids})
+    return FAISS(
+        vs.embedding_function,
+        index,
+        docstore,
+        dict(enumerate(ids)),
+        normalize_L2=vs._normalize_L2,
+        distance_strategy=vs.distance_strategy,
+    )
+
+def load_checkpoint_state(checkpoint_dir: str) -> Optional[dict]:
+    """读取已提交的检查点状态（分段列表和片段总数），不存在时返回 None"""
+    path = Path(checkpoint_dir) / CHECKPOINT_STATE_FILE
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_checkpoint(vs: FAISS, file_manifest: FileManifest, checkpoint_dir: str, start: int = 0) -> int:
+    """
+    保存全量构建的检查点
+
+    只把第 start 个之后的片段写成一个新分段（start 为 0 时写入全部片段并替换已有分段），
+    每次写入量与新增片段数成正比，不会随索引增大反复重写整个索引。
+    分段先写到临时目录再 os.replace 到位，最后原子替换 checkpoint.json 提交；
+    任何一步中断，上一个检查点都保持完整可用。文件清单和索引清单只保存在最新分段中。
+
+    Returns:
+        下次检查点的起始片段序号
+    """
+    state = load_checkpoint_state(checkpoint_dir) if start else None
+    segments = state["segments"] if state else []
+    segments_dir = Path(checkpoint_dir) / CHECKPOINT_SEGMENTS_DIR
+    name = f"{len(segments):05d}-{uuid.uuid4().hex[:8]}"
+    tmp_dir = segments_dir / f"{name}.tmp"
+    checkpoint_segment(vs, start).save_local(str(tmp_dir))
+    file_manifest.save(str(tmp_dir))
+    save_manifest(str(tmp_dir), index_manifest(vs, file_manifest))
+    os.replace(tmp_dir, segments_dir / name)
+
+    segments.append(name)
+    chunk_count = len(vs.index_to_docstore_id)
+    state_path = Path(checkpoint_dir) / CHECKPOINT_STATE_FILE
+    tmp_path = state_path.with_suffix(".json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"segments": segments, "chunks": chunk_count}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, state_path)
+
+    # 提交后删除被替换或中断遗留的分段，以及旧分段中已过时的清单
+    for path in segments_dir.iterdir():
+        if path.name not in segments:
+            shutil.rmtree(path, ignore_errors=True)
+        elif path.name != name:
+            (path / FILE_MANIFEST_FILE).unlink(missing_ok=True)
+            (path / MANIFEST_FILE).unlink(missing_ok=True)
+    print(f"   💾 已保存检查点: {len(file_manifest.entries)} 个文件，{chunk_count} 个片段（本次写入 {chunk_count - start} 个）")
+    return chunk_count
+
+def load_checkpoint(checkpoint_dir: str, embeddings, data_dir: Optional[Path] = None) -> Tuple[FAISS, FileManifest]:
+    """
+    加载检查点：按顺序合并各分段的向量索引，文件清单取自最新分段（以相对 data_dir 的路径为键）
+
+    Raises:
+        ValueError: 没有已提交的检查点、构建参数已变化或向量数与提交记录不一致
+    """
+    state = load_checkpoint_state(checkpoint_dir)
+    if not state or not state["segments"]:
+        raise ValueError("未找到已提交的检查点")
+    segment_dirs = [str(Path(checkpoint_dir) / CHECKPOINT_SEGMENTS_DIR / name) for name in state["segments"]]
+    reason = incremental_unavailable_reason(segment_dirs[-1])
+    if reason:
+        raise ValueError(reason)
+    vs = FAISS.load_local(segment_dirs[0], embeddings, allow_dangerous_deserialization=True)
+    for segment_dir in segment_dirs[1:]:
+        vs.merge_from(FAISS.load_local(segment_dir, embeddings, allow_dangerous_deserialization=True))
+    if not vs.index.ntotal == len(vs.index_to_docstore_id) == state["chunks"]:
+        raise ValueError(f"向量数 {vs.index.ntotal} 与提交记录 {state['chunks']} 不一致")
+    return vs, FileManifest.load(segment_dirs[-1], data_dir)
+
+def build_ann(vs: FAISS, ann_type: str):
+    """由平面索引构建近似索引，训练失败（如片段数太少）时退回精确检索"""
+    if ann_type == "flat":
+        return None, None
+    print(f"\n🧭 正在构建近似索引（{ann_type}）...")
+    ann_start_time = time.time()
+    try:
+        ann_index = build_ann_index(vs.index, ann_type, ANN_PARAMS, train_sample=ANN_TRAIN_SAMPLE)
+    except RuntimeError as e:
+        print(f"   ⚠️ 近似索引构建失败: {e}，查询将使用精确检索")
+        return None, None
+    print(f"   ✅ 近似索引构建完成，耗时: {time.time() - ann_start_time:.1f}秒")
+    n = len(vs.index_to_docstore_id)
+    return ann_index, {"type": ann_type, "factory": ann_factory_string(ann_type, vs.index.d, n, ANN_PARAMS)}
+
+def save_index(vs: FAISS, file_manifest: FileManifest, ann_type: str = ANN_TYPE, index_dir: str = INDEX_PATH):
+    """构建词法索引，将全部索引文件保存到新的版本目录并原子发布"""
+    # 构建关键词倒排索引（供 simple_keyword_search 使用）和 BM25 索引（供 hybrid_search 使用）
+    # 词法索引只依赖片段文本，增量模式下也从完整的 docstore 重新构建，无需重新向量化
+    print("\n🔤 正在构建关键词倒排索引和 BM25 索引...")
+    lexical_start_time = time.time()
+    docs = [vs.docstore.search(vs.index_to_docstore_id[i]) for i in range(len(vs.index_to_docstore_id))]
+    texts = [doc.page_content for doc in docs]
+    keyword_index = KeywordIndex.build(texts)
+    # 分词器（INDEX_TOKENIZER）记录在 BM25 索引中，查询时使用同一分词器
+    tokenizer = default_tokenizer()
+    bm25_index = BM25Index.build(texts, tokenizer)
+    # 元数据索引供检索工具按路径、文件类型、修改日期限定范围
+    metadata_index = MetadataIndex.build(docs, file_manifest.mtimes())
+    print(f"   ✅ 关键词索引 {len(keyword_index.terms)} 个词项，BM25 索引 {len(bm25_index.terms)} 个词项（{tokenizer.name} 分词），耗时: {time.time() - lexical_start_time:.1f}秒")
     
-    # 4. 构建向量索引
-    print("\n🔧 正在构建向量索引...")
-    index_start_time = time.time()
-    vs = FAISS.from_documents(docs, embeddings)
-    index_time = time.time() - index_start_time
-    print(f"   ✅ 索引构建完成，耗时: {index_time:.1f}秒")
+    ann_index, ann = build_ann(vs, ann_type)
     
-    # 5. 保存索引
     print("\n💾 正在保存索引...")
-    vs.save_local(INDEX_PATH)
+    # 写入新的版本目录，写完后才切换 CURRENT，运行中的检索服务不会读到写了一半的索引
+    version_dir = new_version_dir(index_dir)
+    # index.faiss / index.pkl 供增量更新使用；查询端以内存映射方式读取向量和片段存储
+    vs.save_local(version_dir)
+    ChunkStore.write(version_dir, docs)
+    keyword_index.save(version_dir)
+    bm25_index.save(version_dir)
+    metadata_index.save(version_dir)
+    save_ann_index(version_dir, ann_index)
+    file_manifest.save(version_dir)
+    # 清单最后写入：查询端据此加载与构建时完全相同的嵌入模型
+    save_manifest(version_dir, index_manifest(vs, file_manifest, ann, tokenizer.describe()))
+    publish_version(index_dir, version_dir)
+    print(f"   📌 已发布索引版本: {Path(version_dir).name}")
+
+def incremental_unavailable_reason(index_dir: str = INDEX_PATH) -> Optional[str]:
+    """检查现有索引（或检查点）能否增量更新，不能时返回原因"""
+    index_dir = resolve_index_dir(index_dir)
+    manifest = load_manifest(index_dir)
+    if manifest is None or not (Path(index_dir) / "index.faiss").exists():
+        return "未找到已有索引"
+    if not FileManifest.load(index_dir).entries:
+        return "已有索引缺少文件清单"
+    if manifest["embedding"]["model"] != EMBED_MODEL or manifest["embedding"]["normalize"] != NORMALIZE_EMBEDDINGS:
+        return "嵌入模型配置已变化"
+    if manifest["chunking"] != {"chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP, "separators": SEPARATORS}:
+        return "分块参数已变化"
+    return None
+
+def remove_stale(vs: FAISS, file_manifest: FileManifest, stale_keys: List[str]):
+    """删除变化和已移除文件的旧片段（向量、docstore 同步删除）"""
+    stale_ids = [chunk_id for key in stale_keys for chunk_id in file_manifest.chunk_ids(key)]
+    if stale_ids:
+        print(f"\n🗑️ 正在删除 {len(stale_ids)} 个旧片段...")
+        vs.delete(stale_ids)
+    for key in stale_keys:
+        file_manifest.remove(key)
+
+def build_full(
+    files: List[Path],
+    workers: int,
+    ann_type: str = ANN_TYPE,
+    resume: bool = True,
+    index_dir: str = INDEX_PATH,
+    data_dir: Optional[Path] = None,
+) -> Optional[dict]:
+    """全量构建索引（流式分批向量化，中断后可从检查点继续；文件清单以相对 data_dir 的路径为键）"""
+    checkpoint_dir = index_dir + CHECKPOINT_SUFFIX
+    # 1. 加载嵌入模型
+    embeddings = create_embeddings()
+    
+    # 2. 检查是否有可继续的检查点
+    vs = None
+    file_manifest = FileManifest(root=data_dir)
+    to_index = files
+    checkpoint_start = 0
+    if resume and Path(checkpoint_dir).exists():
+        try:
+            vs, file_manifest = load_checkpoint(checkpoint_dir, embeddings, data_dir)
+        except Exception as e:
+            print(f"⚠️ 检查点不可用（{e}），从头构建")
+            vs, file_manifest = None, FileManifest(root=data_dir)
+    if vs is not None:
+        saved_count = len(vs.index_to_docstore_id)
+        # 文件清单与向量不一致时（如检查点被手动修改），删除未登记到文件清单的片段
+        known_ids = {chunk_id for key in file_manifest.entries for chunk_id in file_manifest.chunk_ids(key)}
+        orphan_ids = [doc_id for doc_id in vs.index_to_docstore_id.values() if doc_id not in known_ids]
+        if orphan_ids:
+            vs.delete(orphan_ids)
+        added, changed, removed = file_manifest.diff(files)
+        remove_stale(vs, file_manifest, [file_manifest.key(p) for p in changed] + removed)
+        to_index = added + changed
+        # 删除过片段时向量序号已变化，下次检查点重写全部片段
+        if len(vs.index_to_docstore_id) == saved_count:
+            checkpoint_start = saved_count
+        print(f"⏯️ 从检查点继续: 已完成 {len(file_manifest.entries)} 个文件，剩余 {len(to_index)} 个文件")
+    else:
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    
+    # 3. 流式加载、分割、向量化并写入索引
+    print("\n🔧 正在构建向量索引...")
+    vs = embed_files(
+        vs, embeddings, to_index, file_manifest, workers, checkpoint_dir=checkpoint_dir, checkpoint_start=checkpoint_start
+    )
+    if vs is None or not vs.index_to_docstore_id:
+        print("❌ 没有找到可处理的文档，请检查目录路径")
+        return None
+    print(f"📝 文档分割完成: {file_manifest.doc_count} → {len(vs.index_to_docstore_id)} 个片段")
+    
+    # 4. 构建词法索引并保存，完成后删除检查点
+    save_index(vs, file_manifest, ann_type, index_dir)
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    return {"docs": file_manifest.doc_count, "chunks": len(vs.index_to_docstore_id)}
+
+def update_incremental(
+    files: List[Path],
+    workers: int,
+    ann_type: str = ANN_TYPE,
+    index_dir: str = INDEX_PATH,
+    data_dir: Optional[Path] = None,
+) -> Optional[dict]:
+    """增量更新索引：只向量化新增和变化的文件，删除已移除文件的向量，结果发布为新版本"""
+    current_dir = resolve_index_dir(index_dir)
+    # 旧版清单的键在加载时换算为相对 data_dir 的路径
+    file_manifest = FileManifest.load(current_dir, data_dir)
+    added, changed, removed = file_manifest.diff(files)
+    print(f"🔁 增量检测: 新增 {len(added)} 个，变化 {len(changed)} 个，删除 {len(removed)} 个文件")
+    
+    if not (added or changed or removed):
+        # 已发布的版本不可修改：仅被 touch 过的文件不回写修改时间，下次增量检测时重新计算哈希
+        print("✅ 文档没有变化，索引无需更新")
+        return {"docs": file_manifest.doc_count, "chunks": sum(len(e["chunk_ids"]) for e in file_manifest.entries.values())}
+    
+    # 1. 加载嵌入模型和已有索引
+    embeddings = create_embeddings()
+    vs = FAISS.load_local(current_dir, embeddings, allow_dangerous_deserialization=True)
+    
+    # 2. 删除变化和已移除文件的旧片段
+    remove_stale(vs, file_manifest, [file_manifest.key(p) for p in changed] + removed)
+    
+    # 3. 流式加载、分割并向量化新增和变化的文件
+    to_index = added + changed
+    if to_index:
+        print("\n🔧 正在向量化新增和变化的文件...")
+        vs = embed_files(vs, embeddings, to_index, file_manifest, workers)
+    
+    # 4. 重建词法索引和近似索引并保存
+    save_index(vs, file_manifest, ann_type, index_dir)
+    return {"docs": file_manifest.doc_count, "chunks": len(vs.index_to_docstore_id)}
+
+def shard_targets(
+    data_dir: Path, files: List[Path], collection: str, shards: Optional[int], shard: Optional[int]
+) -> Optional[List[Tuple[str, List[Path]]]]:
+    """
+    将文件按路径哈希划分到集合的各个分片
+
+    Args:
+        data_dir: 文档目录
+        files: 全部文件
+        collection: 集合名
+        shards: 分片数，为 None 时沿用集合已有的分片数（新集合为 1）
+        shard: 只重建该分片，为 None 时重建全部分片
+
+    Returns:
+        [(分片索引目录, 分配到该分片的文件)]，参数无效时返回 None
+    """
+    existing = load_collection(collection)
+    shard_count = shards or (existing["shards"] if existing else 1)
+    if shard_count < 1:
+        print("❌ 分片数必须大于 0")
+        return None
+    if shard is not None and not 0 <= shard < shard_count:
+        print(f"❌ 分片号 {shard} 超出范围（集合 {collection} 共 {shard_count} 个分片）")
+        return None
+    if existing and existing["shards"] != shard_count:
+        if shard is not None:
+            # 分片数变化后文件的归属全部改变，只重建一个分片会造成重复或遗漏
+            print(f"❌ 集合 {collection} 的分片数由 {existing['shards']} 变为 {shard_count}，需要重建全部分片")
+            return None
+        for i in range(shard_count, existing["shards"]):
+            shutil.rmtree(shard_dir(collection, i), ignore_errors=True)
+            shutil.rmtree(shard_dir(collection, i) + CHECKPOINT_SUFFIX, ignore_errors=True)
+    save_collection(collection, shard_count)
+
+    partitions: List[List[Path]] = [[] for _ in range(shard_count)]
+    for p in files:
+        partitions[shard_of(p.relative_to(data_dir).as_posix(), shard_count)].append(p)
+    selected = range(shard_count) if shard is None else [shard]
+    return [(shard_dir(collection, i), partitions[i]) for i in selected]
+
+def build_target(
+    files: List[Path], index_dir: str, incremental: bool, workers: int, resume: bool, ann_type: str, data_dir: Path
+) -> Optional[dict]:
+    """构建或增量更新一个索引目录（文件清单以相对 data_dir 的路径为键）"""
+    if incremental:
+        reason = incremental_unavailable_reason(index_dir)
+        if reason:
+            print(f"⚠️ {reason}，改为全量构建")
+            incremental = False
+    if incremental:
+        return update_incremental(files, workers, ann_type, index_dir, data_dir)
+    return build_full(files, workers, ann_type, resume=resume, index_dir=index_dir, data_dir=data_dir)
+
+def main(
+    data_dir: str,
+    incremental: bool = False,
+    workers: int = LOAD_WORKERS,
+    resume: bool = True,
+    ann_type: str = ANN_TYPE,
+    collection: Optional[str] = None,
+    shards: Optional[int] = None,
+    shard: Optional[int] = None,
+):
+    """主函数：构建文档索引（指定集合时按分片分别构建）"""
+    print("=" * 50)
+    print("📚 开始构建文档向量索引")
+    print("=" * 50)
+    start_time = time.time()
+    
+    files = scan_files(Path(data_dir))
+    
+    if collection is None:
+        targets = [(INDEX_PATH, files)]
+    else:
+        targets = shard_targets(Path(data_dir), files, collection, shards, shard)
+        if targets is None:
+            return
+    
+    stats = {"docs": 0, "chunks": 0}
+    for index_dir, target_files in targets:
+        if collection is not None:
+            print(f"\n🧩 分片 {index_dir}: {len(target_files)} 个文件")
+            if not target_files:
+                print("   ⚠️ 没有分配到文件，跳过（文档较少时可减少分片数）")
+                continue
+        target_stats = build_target(target_files, index_dir, incremental, workers, resume, ann_type, Path(data_dir))
+        if target_stats is None:
+            return
+        stats["docs"] += target_stats["docs"]
+        stats["chunks"] += target_stats["chunks"]
     
     # 统计信息
     total_time = time.time() - start_time
@@ -98,15 +555,37 @@ def main(data_dir: str):
     print("=" * 50)
     print(f"📊 统计信息:")
     print(f"   📂 文档目录: {data_dir}")
-    print(f"   📄 原始文档: {len(raw_docs)} 个")
-    print(f"   📝 文本片段: {len(docs)} 个")
+    print(f"   🔁 构建模式: {'增量' if incremental else '全量'}")
+    if collection is not None:
+        print(f"   🗂️  知识库集合: {collection}（构建 {len(targets)} 个分片）")
+    print(f"   📄 原始文档: {stats['docs']} 个")
+    print(f"   📝 文本片段: {stats['chunks']} 个")
     print(f"   🤖 嵌入模型: {EMBED_MODEL}")
-    print(f"   📁 索引路径: {INDEX_PATH}")
+    print(f"   🧭 近似索引: {ann_type}")
+    print(f"   📁 索引路径: {INDEX_PATH if collection is None else os.path.join(COLLECTIONS_PATH, collection)}")
     print(f"   ⏱️  总耗时: {total_time:.1f}秒")
     print("=" * 50)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="构建本地文档向量索引")
     parser.add_argument("--dir", required=True, help="包含文档的目录路径")
+    parser.add_argument("--incremental", action="store_true", help="增量更新：只重新向量化新增或变化的文件")
+    parser.add_argument("--workers", type=int, default=LOAD_WORKERS, help=f"文档加载与分割的工作进程数（默认 {LOAD_WORKERS}）")
+    parser.add_argument("--no-resume", action="store_true", help="忽略上次中断留下的检查点，从头全量构建")
+    parser.add_argument("--ann-type", choices=ANN_TYPES, default=ANN_TYPE, help=f"近似最近邻索引类型（默认 {ANN_TYPE}）")
+    parser.add_argument("--collection", help=f"构建到命名集合（{COLLECTIONS_PATH}/<集合名>），不指定时构建旧版单一索引")
+    parser.add_argument("--shards", type=int, help="集合的分片数（默认沿用集合已有的分片数，新集合为 1）")
+    parser.add_argument("--shard", type=int, help="只重建指定编号的分片")
     args = parser.parse_args()
-    main(args.dir)
\ No newline at end of file
+    if args.collection is None and (args.shards is not None or args.shard is not None):
+        parser.error("--shards / --shard 需要同时指定 --collection")
+    main(
+        args.dir,
+        incremental=args.incremental,
+        workers=args.workers,
+        resume=not args.no_resume,
+        ann_type=args.ann_type,
+        collection=args.collection,
+        shards=args.shards,
+        shard=args.shard,
+    )
@@ -0,0 +1,507 @@
+import argparse
+import hashlib
+import json
+import platform
+import re
+import sys
+import time
+import zlib
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from zhimi.index import (
+    ANN_TYPES,
+    DEFAULT_TOKENIZER,
+    BM25Index,
+    ChunkStore,
+    KeywordIndex,
+    MetadataIndex,
+    build_ann_index,
+    build_manifest,
+    default_tokenizer,
+    load_manifest,
+    new_version_dir,
+    publish_version,
+    resolve_index_dir,
+    save_ann_index,
+    save_manifest,
+)
+
+BENCHMARK_PATH = "memory/benchmark"
+# 生成合成语料用的常用汉字
+CHARS = (
+    "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所"
+    "民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那"
+    "社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通"
+    "并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区"
+    "强放决西被干做必战先回则任取据处理府研质信务器"
+)
+WORD_CHARS = 2  # 主题词和通用词的字数
+RARE_WORD_CHARS = 3  # 片段专属词的字数（组合数远大于片段数，基本不重复）
+TOPIC_COUNT = 200
+TOPIC_VOCAB = 60
+COMMON_VOCAB = 300
+CHUNKS_PER_DOC = 5
+BENCH_EMBED_DIM = 128
+
+
+class BenchQuery(NamedTuple):
+    """带标注的查询"""
+    query: str
+    relevant: List[str]  # 相关片段 id
+
+
+class BenchResult(NamedTuple):
+    """一种检索方式的评测结果"""
+    mode: str
+    queries: int
+    k: int
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    qps: float
+    recall_at_k: Optional[float]
+    mrr: Optional[float]
+
+
+class HashingEmbeddings(Embeddings):
+    """字符 bigram 哈希嵌入：每个 bigram 对应一个由哈希值确定的随机向量，文本向量为其和（归一化）
+
+    无需下载模型，词面重合越多的文本向量越接近，用于在任意规模上稳定地评测检索链路本身的开销。
+    """
+
+    def __init__(self, dimension: int = BENCH_EMBED_DIM):
+        self.dimension = dimension
+        self._vectors: Dict[str, np.ndarray] = {}
+
+    @property
+    def model_name(self) -> str:
+        return f"hash-bigram-{self.dimension}"
+
+    def _vector(self, gram: str) -> np.ndarray:
+        vector = self._vectors.get(gram)
+        if vector is None:
+            rng = np.random.default_rng(zlib.crc32(gram.encode("utf-8")))
+            vector = self._vectors[gram] = rng.standard_normal(self.dimension).astype(np.float32)
+        return vector
+
+    def _embed(self, text: str) -> List[float]:
+        # 按空白和标点切分后只取片段内部的 bigram，查询词之间不产生跨词的 bigram
+        segments = re.split(r"[\s，。]+", text)
+        grams = [segment[i:i + 2] for segment in segments for i in range(max(len(segment) - 1, 1)) if segment]
+        vector = np.sum([self._vector(gram) for gram in grams or [text]], axis=0)
+        return (vector / (np.linalg.norm(vector) or 1.0)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def make_words(rng: np.random.Generator, count: int, length: int) -> List[str]:
+    """生成 count 个互不相同的 length 字词"""
+    words = set()
+    while len(words) < count:
+        picks = rng.integers(0, len(CHARS), size=(count, length))
+        words.update("".join(CHARS[i] for i in row) for row in picks)
+    return sorted(words)[:count]
+
+
+def generate_corpus(chunk_count: int, query_count: int, seed: int = 0):
+    """
+    生成合成中文语料和带标注的查询集
+
+    每个片段属于一个主题，由主题词、通用词和 4 个片段专属词组成无空格的句子；
+    查询由目标片段的 2 个专属词和 1 个主题词组成（空格分隔），相关片段即目标片段。
+
+    Returns:
+        (片段列表, 查询列表)
+    """
+    rng = np.random.default_rng(seed)
+    common = make_words(rng, COMMON_VOCAB, WORD_CHARS)
+    topics = [make_words(rng, TOPIC_VOCAB, WORD_CHARS) for _ in range(TOPIC_COUNT)]
+    rare = make_words(rng, chunk_count * 4, RARE_WORD_CHARS)
+    rng.shuffle(rare)
+
+    docs, chunk_words = [], []
+    for i in range(chunk_count):
+        topic = i // CHUNKS_PER_DOC % TOPIC_COUNT
+        own = rare[i * 4:i * 4 + 4]
+        words = list(rng.choice(topics[topic], size=16)) + list(rng.choice(common, size=12)) + own
+        rng.shuffle(words)
+        sentences = ["".join(words[j:j + 8]) for j in range(0, len(words), 8)]
+        docs.append(Document(
+            id=f"bench-{i}",
+            page_content="，".join(sentences) + "。",
+            metadata={"source": f"synthetic/topic{topic:03d}/doc{i // CHUNKS_PER_DOC}.md"},
+        ))
+        chunk_words.append((own, topics[topic]))
+
+    queries = []
+    for i in rng.choice(chunk_count, size=min(query_count, chunk_count), replace=False):
+        own, topic_words = chunk_words[i]
+        words = list(rng.choice(own, size=2, replace=False)) + [rng.choice(topic_words)]
+        queries.append(BenchQuery(" ".join(words), [f"bench-{i}"]))
+    return docs, queries
+
+
+def load_jsonl(path: str) -> List[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_corpus(corpus_path: str, queries_path: str):
+    """
+    加载外部语料和查询集
+
+    语料每行 {"id", "text", "source"}，查询每行 {"query", "relevant": [片段 id]}
+    """
+    docs = [
+        Document(id=row["id"], page_content=row["text"], metadata={"source": row.get("source", row["id"])})
+        for row in load_jsonl(corpus_path)
+    ]
+    queries = [BenchQuery(row["query"], list(row["relevant"])) for row in load_jsonl(queries_path)]
+    return docs, queries
+
+
+def export_corpus(export_dir: str, docs: List[Document], queries: List[BenchQuery]) -> None:
+    """将语料和查询集保存为 load_corpus 可读取的 JSONL"""
+    Path(export_dir).mkdir(parents=True, exist_ok=True)
+    with open(Path(export_dir) / "corpus.jsonl", "w", encoding="utf-8") as f:
+        for doc in docs:
+            f.write(json.dumps({"id": doc.id, "text": doc.page_content, "source": doc.metadata["source"]}, ensure_ascii=False) + "\n")
+    with open(Path(export_dir) / "queries.jsonl", "w", encoding="utf-8") as f:
+        for query in queries:
+            f.write(json.dumps(query._asdict(), ensure_ascii=False) + "\n")
+
+
+def build_index(index_dir: str, docs: List[Document], embeddings: HashingEmbeddings, ann_type: str) -> dict:
+    """
+    按索引脚本的磁盘格式构建索引并发布为新版本
+
+    Returns:
+        构建统计（各阶段耗时、索引大小）
+    """
+    stats = {}
+    start_time = time.perf_counter()
+    index = faiss.IndexFlatL2(embeddings.dimension)
+    for start in range(0, len(docs), 4096):
+        batch = docs[start:start + 4096]
+        index.add(np.asarray(embeddings.embed_documents([doc.page_content for doc in batch]), dtype=np.float32))
+    stats["embed_seconds"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    texts = [doc.page_content for doc in docs]
+    keyword_index = KeywordIndex.build(texts)
+    tokenizer = default_tokenizer()
+    bm25_index = BM25Index.build(texts, tokenizer)
+    metadata_index = MetadataIndex.build(docs, {doc.metadata["source"]: 0.0 for doc in docs})
+    stats["lexical_seconds"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    ann_index = build_ann_index(index, ann_type) if ann_type != "flat" else None
+    stats["ann_seconds"] = time.perf_counter() - start_time
+
+    Path(index_dir).mkdir(parents=True, exist_ok=True)
+    version_dir = new_version_dir(index_dir)
+    faiss.write_index(index, str(Path(version_dir) / "index.faiss"))
+    ChunkStore.write(version_dir, docs)
+    keyword_index.save(version_dir)
+    bm25_index.save(version_dir)
+    metadata_index.save(version_dir)
+    save_ann_index(version_dir, ann_index)
+    save_manifest(version_dir, build_manifest(
+        embed_model=embeddings.model_name,
+        dimension=embeddings.dimension,
+        normalize=True,
+        chunk_size=0,
+        chunk_overlap=0,
+        separators=[],
+        doc_count=len({doc.metadata["source"] for doc in docs}),
+        chunk_count=len(docs),
+        ann={"type": ann_type} if ann_index is not None else None,
+        tokenizer=tokenizer.describe(),
+    ))
+    publish_version(index_dir, version_dir, keep=0)
+    stats["index_bytes"] = sum(p.stat().st_size for p in Path(version_dir).iterdir())
+    return stats
+
+
+def percentile_ms(latencies: List[float], q: float) -> float:
+    return float(np.percentile(latencies, q) * 1000) if latencies else 0.0
+
+
+def rank_metrics(ids: List[str], relevant: List[str], k: int):
+    """单个查询的 (recall@k, 倒数排名)"""
+    ids = ids[:k]
+    relevant = set(relevant)
+    reciprocal_rank = next((1 / rank for rank, chunk_id in enumerate(ids, 1) if chunk_id in relevant), 0.0)
+    return len(relevant & set(ids)) / len(relevant), reciprocal_rank
+
+
+def summarize(mode: str, query_count: int, k: int, latencies: List[float], total_seconds: float, metrics: list) -> BenchResult:
+    """汇总延迟分位数、吞吐和平均检索质量"""
+    return BenchResult(
+        mode=mode,
+        queries=query_count,
+        k=k,
+        p50_ms=percentile_ms(latencies, 50),
+        p95_ms=percentile_ms(latencies, 95),
+        p99_ms=percentile_ms(latencies, 99),
+        qps=query_count / total_seconds if total_seconds else 0.0,
+        recall_at_k=float(np.mean([recall for recall, _ in metrics])) if metrics else None,
+        mrr=float(np.mean([reciprocal_rank for _, reciprocal_rank in metrics])) if metrics else None,
+    )
+
+
+def evaluate(
+    mode: str,
+    retrieve: Callable[[str], Optional[List[str]]],
+    queries: List[BenchQuery],
+    k: int,
+    warmup: int,
+) -> BenchResult:
+    """
+    逐条查询评测一种检索方式
+
+    Args:
+        retrieve: 输入查询返回排序后的片段 id（只测延迟的工具函数返回 None）
+    """
+    for query in queries[:warmup]:
+        retrieve(query.query)
+    latencies, metrics = [], []
+    total_start = time.perf_counter()
+    for query in queries:
+        start_time = time.perf_counter()
+        ids = retrieve(query.query)
+        latencies.append(time.perf_counter() - start_time)
+        if ids is not None:
+            metrics.append(rank_metrics(ids, query.relevant, k))
+    return summarize(mode, len(queries), k, latencies, time.perf_counter() - total_start, metrics)
+
+
+def evaluate_batch(queries: List[BenchQuery], k: int, batch_size: int) -> BenchResult:
+    """评测批量混合检索（延迟按批次统计）"""
+    from zhimi.tools import search_tool
+    latencies, metrics = [], []
+    total_start = time.perf_counter()
+    for start in range(0, len(queries), batch_size):
+        batch = queries[start:start + batch_size]
+        start_time = time.perf_counter()
+        results = search_tool.hybrid_retrieve_batch([query.query for query in batch], k=k)
+        latencies.append(time.perf_counter() - start_time)
+        for query, chunks in zip(batch, results):
+            metrics.append(rank_metrics([chunk.document.id for chunk in chunks], query.relevant, k))
+    return summarize(f"hybrid_batch[{batch_size}]", len(queries), k, latencies, time.perf_counter() - total_start, metrics)
+
+
+def retrieval_modes(k: int) -> Dict[str, Callable[[str], Optional[List[str]]]]:
+    """待评测的检索方式：各检索分支、混合检索，以及两个工具函数的端到端调用（只测延迟）"""
+    from zhimi.tools import search_tool
+    registry = search_tool.registry
+
+    def ids(hits):
+        return [registry.get_document(key).id for key, _ in hits]
+
+    return {
+        "keyword": lambda q: [chunk.document.id for chunk in search_tool.keyword_retrieve(q, k=k)],
+        "vector": lambda q: ids(registry.vector_search(q, k)),
+        "bm25": lambda q: ids(registry.bm25_search(q, k)),
+        "hybrid": lambda q: [chunk.document.id for chunk in search_tool.hybrid_retrieve(q, k=k)],
+        "simple_keyword_search": lambda q: search_tool.simple_keyword_search(q) and None,
+        "hybrid_search": lambda q: search_tool.hybrid_search(q) and None,
+    }
+
+
+def run_benchmark(
+    workdir: str,
+    chunks: int = 10000,
+    queries: int = 200,
+    k: int = 10,
+    ann_type: str = "flat",
+    seed: int = 0,
+    warmup: int = 10,
+    batch_size: int = 32,
+    modes: Optional[List[str]] = None,
+    corpus_path: Optional[str] = None,
+    queries_path: Optional[str] = None,
+    use_cache: bool = False,
+    rebuild: bool = False,
+) -> dict:
+    """
+    构建（或复用）基准索引并评测各检索方式
+
+    Returns:
+        可序列化为 JSON 的结果：config、environment、build、results
+    """
+    from zhimi.tools import search_tool
+    from zhimi.tools.collection_registry import CollectionRegistry
+    from zhimi.tools.result_cache import ResultCache
+    from zhimi.tools.retriever_registry import register_embeddings
+
+    config = {
+        "chunks": chunks, "queries": queries, "k": k, "ann_type": ann_type, "seed": seed,
+        "corpus": corpus_path, "query_set": queries_path, "embedding": f"hash-bigram-{BENCH_EMBED_DIM}",
+        "tokenizer": DEFAULT_TOKENIZER,
+        "result_cache": use_cache, "rerank": search_tool.reranker is not None,
+    }
+    build_key = {key: config[key] for key in ("chunks", "ann_type", "seed", "corpus", "embedding", "tokenizer")}
+    index_dir = str(Path(workdir) / hashlib.sha256(json.dumps(build_key, sort_keys=True).encode("utf-8")).hexdigest()[:12])
+
+    print("🧪 正在准备语料和查询集...")
+    if corpus_path:
+        docs, query_set = load_corpus(corpus_path, queries_path)
+    else:
+        docs, query_set = generate_corpus(chunks, queries, seed)
+    config["chunks"] = len(docs)
+    print(f"   📝 {len(docs)} 个片段，{len(query_set)} 个查询")
+
+    embeddings = HashingEmbeddings()
+    register_embeddings(embeddings.model_name, True, embeddings)
+    build = {"reused": True}
+    if rebuild or load_manifest(resolve_index_dir(index_dir)) is None:
+        print(f"🔧 正在构建基准索引: {index_dir}")
+        build = {"reused": False, **build_index(index_dir, docs, embeddings, ann_type)}
+    else:
+        print(f"♻️ 复用已构建的基准索引: {index_dir}")
+
+    saved = search_tool.registry, search_tool.result_cache
+    search_tool.registry = CollectionRegistry(
+        root=str(Path(workdir) / "collections"), legacy_index_path=index_dir, reload_interval=0,
+        nprobe=search_tool.FAISS_NPROBE, ef_search=search_tool.FAISS_EF_SEARCH,
+    )
+    if not use_cache:
+        search_tool.result_cache = ResultCache(max_entries=0)
+    try:
+        search_tool.registry.warmup()
+        results = []
+        for mode, retrieve in retrieval_modes(k).items():
+            if modes and mode not in modes:
+                continue
+            print(f"⏱️ 正在评测 {mode}...")
+            results.append(evaluate(mode, retrieve, query_set, k, warmup))
+        if not modes or "hybrid_batch" in modes:
+            print("⏱️ 正在评测 hybrid_batch...")
+            results.append(evaluate_batch(query_set, k, batch_size))
+    finally:
+        search_tool.registry, search_tool.result_cache = saved
+
+    return {
+        "config": config,
+        "environment": {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "faiss": faiss.__version__,
+            "numpy": np.__version__,
+        },
+        "build": build,
+        "results": [result._asdict() for result in results],
+    }
+
+
+def compare(report: dict, baseline: dict, latency_tolerance: float, quality_tolerance: float) -> List[str]:
+    """
+    与基线结果比较，返回回归项说明
+
+    Args:
+        latency_tolerance: p95 延迟允许的相对增长（0.2 表示 20%）
+        quality_tolerance: recall@k、MRR 允许的绝对下降
+    """
+    baseline_rows = {row["mode"]: row for row in baseline["results"]}
+    regressions = []
+    for row in report["results"]:
+        base = baseline_rows.get(row["mode"])
+        if base is None:
+            continue
+        if base["p95_ms"] > 0 and row["p95_ms"] > base["p95_ms"] * (1 + latency_tolerance):
+            regressions.append(f"{row['mode']}: p95 {base['p95_ms']:.2f}ms → {row['p95_ms']:.2f}ms")
+        for metric in ("recall_at_k", "mrr"):
+            if base[metric] is not None and row[metric] is not None and row[metric] < base[metric] - quality_tolerance:
+                regressions.append(f"{row['mode']}: {metric} {base[metric]:.3f} → {row[metric]:.3f}")
+    return regressions
+
+
+def print_table(report: dict) -> None:
+    k = report["config"]["k"]
+    print("\n" + "=" * 92)
+    print(f"{'检索方式':<24}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'QPS':>10}{'recall@' + str(k):>12}{'MRR':>10}")
+    print("=" * 92)
+    for row in report["results"]:
+        recall = "-" if row["recall_at_k"] is None else f"{row['recall_at_k']:.3f}"
+        mrr = "-" if row["mrr"] is None else f"{row['mrr']:.3f}"
+        print(f"{row['mode']:<26}{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}"
+              f"{row['qps']:>10.1f}{recall:>12}{mrr:>10}")
+    print("=" * 92)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检索基准测试：评测各检索方式的延迟、吞吐、recall@k 和 MRR")
+    parser.add_argument("--chunks", type=int, default=10000, help="合成语料的片段数（默认 10000，可到 1000000）")
+    parser.add_argument("--queries", type=int, default=200, help="查询数量")
+    parser.add_argument("-k", type=int, default=10, help="评估 recall@k / MRR 的 k")
+    parser.add_argument("--ann-type", choices=ANN_TYPES, default="flat", help="基准索引的近似索引类型")
+    parser.add_argument("--modes", help="逗号分隔的检索方式（默认全部）")
+    parser.add_argument("--batch-size", type=int, default=32, help="批量混合检索的批大小")
+    parser.add_argument("--warmup", type=int, default=10, help="每种检索方式的预热查询数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--corpus", help="外部语料 JSONL（每行 id、text、source），需同时指定 --query-set")
+    parser.add_argument("--query-set", help="外部查询集 JSONL（每行 query、relevant）")
+    parser.add_argument("--export", help="将生成的语料和查询集保存到该目录")
+    parser.add_argument("--workdir", default=BENCHMARK_PATH, help=f"基准索引目录（默认 {BENCHMARK_PATH}，相同配置复用已构建的索引）")
+    parser.add_argument("--rebuild", action="store_true", help="忽略已构建的基准索引")
+    parser.add_argument("--cache", action="store_true", help="保留结果缓存（默认关闭，以测量实际检索开销）")
+    parser.add_argument("--json", help="将结果另存为 JSON 文件")
+    parser.add_argument("--baseline", help="基线结果 JSON，出现回归时以退出码 1 结束")
+    parser.add_argument("--latency-tolerance", type=float, default=0.2, help="p95 延迟允许的相对增长（默认 0.2）")
+    parser.add_argument("--quality-tolerance", type=float, default=0.02, help="recall@k、MRR 允许的绝对下降（默认 0.02）")
+    args = parser.parse_args()
+    if bool(args.corpus) != bool(args.query_set):
+        parser.error("--corpus 和 --query-set 需要同时指定")
+
+    if args.export:
+        docs, query_set = generate_corpus(args.chunks, args.queries, args.seed)
+        export_corpus(args.export, docs, query_set)
+        print(f"💾 语料和查询集已保存到 {args.export}")
+
+    report = run_benchmark(
+        args.workdir,
+        chunks=args.chunks,
+        queries=args.queries,
+        k=args.k,
+        ann_type=args.ann_type,
+        seed=args.seed,
+        warmup=args.warmup,
+        batch_size=args.batch_size,
+        modes=args.modes.split(",") if args.modes else None,
+        corpus_path=args.corpus,
+        queries_path=args.query_set,
+        use_cache=args.cache,
+        rebuild=args.rebuild,
+    )
+    print_table(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 结果已保存到 {args.json}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.latency_tolerance, args.quality_tolerance)
+        if regressions:
+            print(f"❌ 发现 {len(regressions)} 项性能回归:")
+            for regression in regressions:
+                print(f"   - {regression}")
+            sys.exit(1)
+        print("✅ 与基线相比没有性能回归")
+
+if __name__ == "__main__":
+    main()
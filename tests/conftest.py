@@ -1,6 +1,9 @@
 # tests/conftest.py
 """pytest配置文件，包含测试fixtures和配置"""
+import json
 import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 
 # 添加项目根目录到路径
@@ -26,3 +29,118 @@ def empty_history():
     """创建空的对话历史"""
     return InMemoryChatMessageHistory()
 
+TINY_TEXTS = [
+    "zhimi agent 支持 hybrid search",
+    "faiss vector index 向量检索",
+    "bm25 keyword ranking 关键词",
+    "memory 用户 记忆 提取",
+    "streamlit ui 界面",
+    "faiss bm25 hybrid fusion 融合",
+]
+
+def build_tiny_index(index_dir, texts, embeddings, start=0):
+    """在 index_dir 写入向量索引、片段存储和 BM25 索引（来源文件名从 doc{start}.txt 开始编号）"""
+    import faiss
+    import numpy as np
+    from langchain_core.documents import Document
+    from zhimi.index import BM25Index, ChunkStore
+
+    Path(index_dir).mkdir(parents=True, exist_ok=True)
+    index = faiss.IndexFlatL2(8)
+    index.add(np.asarray(embeddings.embed_documents(texts), dtype=np.float32))
+    faiss.write_index(index, str(Path(index_dir) / "index.faiss"))
+    ChunkStore.write(str(index_dir), [
+        Document(id=f"chunk-{start + i}", page_content=text, metadata={"source": f"doc{start + i}.txt"})
+        for i, text in enumerate(texts)
+    ])
+    BM25Index.build(texts).save(str(index_dir))
+
+@pytest.fixture
+def tiny_registry(tmp_path):
+    """在临时目录构建一个小型知识库索引（向量、片段存储、BM25），返回使用确定性假嵌入的注册表"""
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    from zhimi.tools.retriever_registry import RetrieverRegistry
+
+    embeddings = DeterministicFakeEmbedding(size=8)
+    build_tiny_index(tmp_path, TINY_TEXTS, embeddings)
+    registry = RetrieverRegistry(index_path=str(tmp_path))
+    registry._embeddings = embeddings
+    return registry
+
+@pytest.fixture
+def fake_embeddings(monkeypatch):
+    """确定性假嵌入，替换注册表加载的查询端嵌入模型"""
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    import zhimi.tools.retriever_registry as retriever_registry
+
+    embeddings = DeterministicFakeEmbedding(size=8)
+    monkeypatch.setattr(retriever_registry, "_load_embeddings", lambda model, normalize: embeddings)
+    return embeddings
+
+@pytest.fixture
+def sharded_registry(tmp_path, fake_embeddings):
+    """将小型知识库拆成 kb 集合的两个分片，另建一份旧版单一索引作为 default 集合，返回集合注册表"""
+    from zhimi.index.collections import save_collection, shard_dir
+    from zhimi.tools.collection_registry import CollectionRegistry
+
+    root = str(tmp_path / "collections")
+    build_tiny_index(shard_dir("kb", 0, root), TINY_TEXTS[:3], fake_embeddings)
+    build_tiny_index(shard_dir("kb", 1, root), TINY_TEXTS[3:], fake_embeddings, start=3)
+    save_collection("kb", 2, root)
+    build_tiny_index(tmp_path / "legacy", TINY_TEXTS, fake_embeddings)
+    return CollectionRegistry(root=root, legacy_index_path=str(tmp_path / "legacy"))
+
+@pytest.fixture
+def publish_tiny_index(fake_embeddings):
+    """返回发布函数：把给定文本构建成索引目录的一个新版本并原子发布"""
+    from zhimi.index import new_version_dir, publish_version
+
+    def publish(index_dir, texts, start=0):
+        Path(index_dir).mkdir(parents=True, exist_ok=True)
+        version_dir = new_version_dir(str(index_dir))
+        build_tiny_index(version_dir, texts, fake_embeddings, start=start)
+        publish_version(str(index_dir), version_dir)
+        return version_dir
+    return publish
+
+class ChatCompletionHandler(BaseHTTPRequestHandler):
+    """OpenAI 兼容的对话接口，固定回答“你好 知觅”（HTTP/1.1 长连接，支持流式）"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        base = {"id": "chatcmpl-test", "created": 0, "model": body["model"]}
+        if body.get("stream"):
+            deltas = [{"role": "assistant", "content": "你好"}, {"content": " 知觅"}, {}]
+            chunks = [
+                dict(base, object="chat.completion.chunk", choices=[
+                    {"index": 0, "delta": delta, "finish_reason": None if delta else "stop"}
+                ])
+                for delta in deltas
+            ]
+            data = "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks) + "data: [DONE]\n\n"
+            content_type = "text/event-stream"
+        else:
+            data = json.dumps(dict(base, object="chat.completion", choices=[
+                {"index": 0, "message": {"role": "assistant", "content": "你好 知觅"}, "finish_reason": "stop"}
+            ]))
+            content_type = "application/json"
+        payload = data.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+@pytest.fixture
+def chat_server():
+    """在本地端口启动 OpenAI 兼容的对话接口，返回接口地址"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ChatCompletionHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/v1"
+    server.shutdown()
+    server.server_close()
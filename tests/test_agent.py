@@ -1,8 +1,11 @@
 # tests/test_agent.py
 """知觅Agent自动化测试脚本"""
+import json
 import pytest
 from pathlib import Path
-from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import HumanMessage, AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGenerationChunk
 from langchain_core.chat_history import InMemoryChatMessageHistory
 
 # 延迟导入，避免导入错误影响其他测试
@@ -25,6 +28,7 @@ from zhimi.tools.search_tool import (
     build_simple_search_tool,
     build_search_tool
 )
+from zhimi.tools.retriever_registry import RetrieverRegistry
 
 
 @pytest.mark.skipif(not AGENT_IMPORT_OK, reason=f"无法导入agent模块: {AGENT_IMPORT_ERROR if not AGENT_IMPORT_OK else ''}")
@@ -119,35 +123,148 @@ class TestSearchTools:
         assert "混合检索" in tool.description
         assert "语义" in tool.description
     
-    def test_simple_keyword_search_without_index(self, monkeypatch):
+    def test_simple_keyword_search_without_index(self, monkeypatch, tmp_path):
         """测试无索引时简单关键词检索的防御式处理"""
-        # 临时设置faiss为None来模拟无索引情况
+        # 将注册表指向不存在的索引目录来模拟无索引情况
         import zhimi.tools.search_tool as search_tool_module
-        original_faiss = search_tool_module.faiss
-        search_tool_module.faiss = None
+        monkeypatch.setattr(
+            search_tool_module, "registry",
+            RetrieverRegistry(index_path=str(tmp_path / "missing_index"))
+        )
         
-        try:
-            result = simple_keyword_search("测试查询")
-            assert "本地知识库尚未构建" in result
-        finally:
-            # 恢复原始值
-            search_tool_module.faiss = original_faiss
+        result = simple_keyword_search("测试查询")
+        assert "本地知识库尚未构建" in result
     
-    def test_hybrid_search_without_index(self, monkeypatch):
+    def test_hybrid_search_without_index(self, monkeypatch, tmp_path):
         """测试无索引时混合检索的防御式处理"""
         import zhimi.tools.search_tool as search_tool_module
-        original_faiss = search_tool_module.faiss
-        original_bm25 = search_tool_module.bm25
-        search_tool_module.faiss = None
-        search_tool_module.bm25 = None
+        monkeypatch.setattr(
+            search_tool_module, "registry",
+            RetrieverRegistry(index_path=str(tmp_path / "missing_index"))
+        )
         
-        try:
-            result = hybrid_search("测试查询")
-            assert "本地知识库尚未构建" in result
-        finally:
-            # 恢复原始值
-            search_tool_module.faiss = original_faiss
-            search_tool_module.bm25 = original_bm25
+        result = hybrid_search("测试查询")
+        assert "本地知识库尚未构建" in result
+    
+    def test_warmup_without_index(self, tmp_path):
+        """测试无索引时预加载返回False且不加载嵌入模型"""
+        registry = RetrieverRegistry(index_path=str(tmp_path / "missing_index"))
+        
+        assert registry.warmup() is False
+        assert registry._embeddings is None
+    
+    def test_registry_uses_manifest_model(self, tmp_path):
+        """测试查询端使用索引清单中记录的嵌入模型"""
+        from zhimi.index import DEFAULT_EMBED_MODEL, build_manifest, save_manifest
+        
+        # 旧版索引没有清单时，使用索引脚本一直使用的默认模型
+        registry = RetrieverRegistry(index_path=str(tmp_path))
+        assert registry.get_manifest()["embedding"]["model"] == DEFAULT_EMBED_MODEL
+        
+        save_manifest(str(tmp_path), build_manifest(
+            embed_model="BAAI/bge-base-zh-v1.5", dimension=768, normalize=True,
+            chunk_size=500, chunk_overlap=100, separators=["\n"],
+            doc_count=1, chunk_count=1,
+        ))
+        registry = RetrieverRegistry(index_path=str(tmp_path))
+        assert registry.get_manifest()["embedding"]["model"] == "BAAI/bge-base-zh-v1.5"
+    
+    def test_registry_vector_search(self, tiny_registry):
+        """测试注册表直接从内存映射的向量和片段存储检索"""
+        hits = tiny_registry.vector_search("faiss vector index 向量检索", k=3)
+        assert len(hits) == 3
+        assert tiny_registry.doc_count() == 6
+        # 确定性假嵌入下，与片段完全相同的查询距离为 0
+        assert tiny_registry.get_document(hits[0][0]).id == "chunk-1"
+    
+    def test_hybrid_retrieve_fusion(self, monkeypatch, tiny_registry):
+        """测试混合检索按 RRF 融合、按片段 id 去重并返回分数"""
+        import zhimi.tools.search_tool as search_tool_module
+        monkeypatch.setattr(search_tool_module, "registry", tiny_registry)
+        
+        results = search_tool_module.hybrid_retrieve("faiss vector index 向量检索", k=3, candidate_k=6)
+        ids = [r.document.id for r in results]
+        assert ids[0] == "chunk-1"  # 两路检索均排第一
+        assert len(ids) == len(set(ids)) == 3
+        assert [r.score for r in results] == sorted((r.score for r in results), reverse=True)
+        assert "相关度" in search_tool_module.format_results(results)
+    
+    def test_hybrid_retrieve_batch(self, monkeypatch, tiny_registry):
+        """测试批量检索与逐条检索结果一致"""
+        import zhimi.tools.search_tool as search_tool_module
+        monkeypatch.setattr(search_tool_module, "registry", tiny_registry)
+        
+        queries = ["faiss vector index", "bm25 keyword ranking 关键词", "不存在的词"]
+        batch = search_tool_module.hybrid_retrieve_batch(queries, k=3, candidate_k=6)
+        single = [search_tool_module.hybrid_retrieve(q, k=3, candidate_k=6) for q in queries]
+        assert len(batch) == 3
+        assert [[(r.document.id, r.score) for r in results] for results in batch] == \
+            [[(r.document.id, r.score) for r in results] for results in single]
+    
+    def test_hybrid_retrieve_with_filter(self, monkeypatch, tiny_registry):
+        """测试按来源过滤时只返回范围内的片段，过滤条件无效时返回提示"""
+        import zhimi.tools.search_tool as search_tool_module
+        from zhimi.index import MetadataFilter
+        monkeypatch.setattr(search_tool_module, "registry", tiny_registry)
+        
+        metadata_filter = MetadataFilter.parse(path_prefix="doc3.txt")
+        results = search_tool_module.hybrid_retrieve("faiss vector index", k=3, metadata_filter=metadata_filter)
+        assert [r.document.id for r in results] == ["chunk-3"]
+        
+        tool = build_search_tool()
+        assert "来源: doc5.txt" in tool.invoke({"query": "faiss bm25 hybrid", "path_prefix": "doc5.txt"})
+        assert "过滤条件无效" in tool.invoke({"query": "faiss", "modified_after": "yesterday"})
+        assert "未找到" in build_simple_search_tool().invoke({"query": "faiss", "file_type": "pdf"})
+    
+    def test_hybrid_retrieve_branch_timeout(self, monkeypatch, tiny_registry):
+        """测试某一路检索超时时返回另一路的结果，而不是一直等待"""
+        import asyncio
+        import time
+        import zhimi.tools.search_tool as search_tool_module
+        monkeypatch.setattr(search_tool_module, "registry", tiny_registry)
+        monkeypatch.setattr(search_tool_module, "HYBRID_VECTOR_TIMEOUT", 0.2)
+        monkeypatch.setattr(search_tool_module, "_branch_slots", branch_slots())
+        
+        def slow_vector_branch(query, k, metadata_filter=None, vector=None):
+            time.sleep(1)
+            return []
+        monkeypatch.setattr(search_tool_module, "_vector_branch", slow_vector_branch)
+        
+        start_time = time.monotonic()
+        results = search_tool_module.hybrid_retrieve("bm25 keyword ranking", k=2)
+        assert time.monotonic() - start_time < 0.9
+        assert results[0].document.id == "chunk-2"
+        
+        results = asyncio.run(search_tool_module.ahybrid_retrieve("bm25 keyword ranking", k=2))
+        assert results[0].document.id == "chunk-2"
+
+    def test_saturated_branch_is_skipped(self, monkeypatch, tiny_registry):
+        """测试某一路超时后仍在执行的请求达到上限时，新请求直接跳过该路，不再占用线程池"""
+        import threading
+        import time
+        import zhimi.tools.search_tool as search_tool_module
+        monkeypatch.setattr(search_tool_module, "registry", tiny_registry)
+        monkeypatch.setattr(search_tool_module, "HYBRID_VECTOR_TIMEOUT", 0.1)
+        slots = branch_slots(1)
+        monkeypatch.setattr(search_tool_module, "_branch_slots", slots)
+        
+        calls = []
+        def slow_vector_branch(query, k, metadata_filter=None, vector=None):
+            calls.append(query)
+            time.sleep(0.5)
+            return []
+        monkeypatch.setattr(search_tool_module, "_vector_branch", slow_vector_branch)
+        
+        search_tool_module.hybrid_retrieve("bm25 keyword ranking", k=2)
+        start_time = time.monotonic()
+        results = search_tool_module.hybrid_retrieve("bm25 keyword ranking", k=2)
+        assert time.monotonic() - start_time < 0.1
+        assert results[0].document.id == "chunk-2"
+        assert len(calls) == 1
+        
+        # 超时的检索结束后归还名额
+        time.sleep(0.6)
+        assert slots["向量检索"].acquire(blocking=False)
     
     @pytest.mark.skipif(
         not Path("memory/faiss_index").exists(),
@@ -176,6 +293,493 @@ class TestSearchTools:
         assert len(result) > 0
 
 
+@pytest.mark.skipif(not AGENT_IMPORT_OK, reason=f"无法导入agent模块")
+class TestCollectionRegistry:
+    """测试多集合、多分片的并行检索"""
+    
+    def test_collections_discovered(self, sharded_registry):
+        """测试命名集合与旧版 default 集合都被发现"""
+        assert sharded_registry.collections() == ["default", "kb"]
+        assert sharded_registry.doc_count() == 12
+    
+    def test_fan_out_matches_single_index(self, sharded_registry):
+        """测试分片向量检索合并后的结果与单一索引一致"""
+        from zhimi.index import MetadataFilter
+        
+        kb = MetadataFilter.parse(collection="kb")
+        default = MetadataFilter.parse(collection="default")
+        sharded = sharded_registry.vector_search("faiss hybrid", 4, kb)
+        single = sharded_registry.vector_search("faiss hybrid", 4, default)
+        assert [sharded_registry.get_document(key).id for key, _ in sharded] == \
+            [sharded_registry.get_document(key).id for key, _ in single]
+        assert [distance for _, distance in sharded] == pytest.approx([distance for _, distance in single])
+    
+    def test_collection_selection(self, sharded_registry):
+        """测试按集合限定检索范围，片段键携带分片号"""
+        from zhimi.index import MetadataFilter
+        
+        hits = sharded_registry.bm25_search("bm25", 5, MetadataFilter.parse(collection="kb"))
+        assert [sharded_registry.get_document(key).id for key, _ in hits] == ["chunk-2", "chunk-5"]
+        assert len({key[0] for key, _ in hits}) == 2
+        assert sharded_registry.bm25_search("bm25", 5, MetadataFilter.parse(collection="missing")) == []
+    
+    def test_hybrid_retrieve_over_shards(self, sharded_registry, monkeypatch):
+        """测试混合检索可以直接使用集合注册表"""
+        import zhimi.tools.search_tool as search_tool_module
+        from zhimi.index import MetadataFilter
+        
+        monkeypatch.setattr(search_tool_module, "registry", sharded_registry)
+        monkeypatch.setattr(search_tool_module, "reranker", None)
+        results = search_tool_module.hybrid_retrieve(
+            "bm25 keyword ranking", k=2, metadata_filter=MetadataFilter.parse(collection="kb")
+        )
+        assert "chunk-2" in [result.document.id for result in results]
+
+
+    def test_hot_swap_new_version(self, tmp_path, publish_tiny_index):
+        """测试发布新版本后后台切换，切换前的检索结果仍从旧版本读取片段"""
+        import time
+        from zhimi.tools.collection_registry import CollectionRegistry
+        
+        index_dir = tmp_path / "index"
+        publish_tiny_index(index_dir, ["old faiss 旧版本"])
+        registry = CollectionRegistry(root=str(tmp_path / "none"), legacy_index_path=str(index_dir), reload_interval=0)
+        old_hits = registry.bm25_search("faiss", 1)
+        assert not registry.check_for_update()
+        
+        time.sleep(0.01)
+        publish_tiny_index(index_dir, ["new faiss 新版本", "second 片段"], start=10)
+        assert registry.check_for_update()
+        deadline = time.monotonic() + 5
+        while registry._reloading and time.monotonic() < deadline:
+            time.sleep(0.01)
+        
+        assert registry.doc_count() == 2
+        assert registry.get_document(registry.bm25_search("faiss", 1)[0][0]).id == "chunk-10"
+        assert registry.get_document(old_hits[0][0]).id == "chunk-0"
+
+
+@pytest.mark.skipif(not AGENT_IMPORT_OK, reason=f"无法导入agent模块")
+class TestRetrievalBenchmark:
+    """测试检索基准脚本（小规模语料）"""
+    
+    @pytest.fixture
+    def benchmark(self):
+        import importlib.util
+        path = Path(__file__).parent.parent / "scripts" / "retrieval_benchmark.py"
+        spec = importlib.util.spec_from_file_location("retrieval_benchmark", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    
+    def test_run_and_compare(self, benchmark, tmp_path):
+        """测试各检索方式都有结果、标注可命中，且基线比较能发现回归"""
+        import zhimi.tools.search_tool as search_tool_module
+        
+        registry = search_tool_module.registry
+        report = benchmark.run_benchmark(str(tmp_path), chunks=300, queries=20, k=5, warmup=2, batch_size=8)
+        assert search_tool_module.registry is registry
+        
+        rows = {row["mode"]: row for row in report["results"]}
+        assert {"keyword", "vector", "bm25", "hybrid", "simple_keyword_search", "hybrid_search", "hybrid_batch[8]"} <= set(rows)
+        assert rows["keyword"]["recall_at_k"] == 1.0
+        assert rows["hybrid_search"]["recall_at_k"] is None
+        assert rows["hybrid"]["p50_ms"] <= rows["hybrid"]["p99_ms"]
+        
+        baseline = {"results": [{**row, "mrr": 1.0, "p95_ms": row["p95_ms"] / 10} for row in report["results"]]}
+        regressions = benchmark.compare(report, baseline, latency_tolerance=0.2, quality_tolerance=0.02)
+        assert any("p95" in regression for regression in regressions)
+        assert benchmark.compare(report, report, latency_tolerance=0.2, quality_tolerance=0.02) == []
+
+
+@pytest.mark.skipif(not AGENT_IMPORT_OK, reason=f"无法导入agent模块")
+class TestFusion:
+    """测试倒数排名融合"""
+    
+    def test_reciprocal_rank_fusion(self):
+        """测试两路都靠前的条目排在最前，且同一路重复条目只计一次"""
+        from zhimi.tools.fusion import reciprocal_rank_fusion
+        
+        fused = reciprocal_rank_fusion([["a", "b", "c", "a"], ["b", "d"]], rrf_k=60)
+        assert [key for key, _ in fused] == ["b", "a", "d", "c"]
+        assert fused[0][1] == pytest.approx(1 / 62 + 1 / 61)
+    
+    def test_weighted_fusion(self):
+        """测试权重可改变各路检索的影响"""
+        from zhimi.tools.fusion import reciprocal_rank_fusion
+        
+        fused = reciprocal_rank_fusion([["a"], ["b"]], weights=[1.0, 2.0])
+        assert fused[0][0] == "b"
+
+
+@pytest.mark.skipif(not AGENT_IMPORT_OK, reason=f"无法导入agent模块")
+def branch_slots(limit=3):
+    """独立的各路检索名额（避免其他测试中仍在执行的慢检索占用全局名额）"""
+    import threading
+    return {name: threading.BoundedSemaphore(limit) for name in ("向量检索", "BM25 检索")}
+
+
+class FakeReranker:
+    """按文本长度打分的重排序器，ready 为 False 时模拟模型仍在加载"""
+
+    def __init__(self, ready=True):
+        self.ready = ready
+
+    def rerank(self, query, candidates):
+        return [float(len(text)) for _, text in candidates] if self.ready else None
+
+    def is_loading(self):
+        return not self.ready
+
+
+class TestResultCache:
+    """测试检索结果缓存"""
+    
+    def test_exact_and_semantic_match(self):
+        """测试规范化后精确匹配、相似向量命中、命名空间隔离"""
+        from zhimi.tools.result_cache import ResultCache
+        
+        cache = ResultCache(max_entries=10, ttl=60, similarity_threshold=0.9)
+        cache.put("hybrid_search", "知觅 支持哪些功能", "结果", version=1, vector=[1.0, 0.0])
+        assert cache.get("hybrid_search", " 知觅  支持哪些功能 ", version=1) == "结果"
+        assert cache.get("hybrid_search", "知觅有什么功能", version=1) is None
+        assert cache.get("hybrid_search", "知觅有什么功能", version=1, vector=[0.99, 0.1]) == "结果"
+        assert cache.get("hybrid_search", "别的问题", version=1, vector=[0.0, 1.0]) is None
+        assert cache.get("simple_keyword_search", "知觅有什么功能", version=1, vector=[1.0, 0.0]) is None
+    
+    def test_invalidation(self):
+        """测试过期、容量淘汰和索引版本变化"""
+        from zhimi.tools.result_cache import ResultCache
+        
+        cache = ResultCache(max_entries=2, ttl=60)
+        for query in ["a", "b", "c"]:
+            cache.put("tool", query, query, version=1)
+        assert cache.get("tool", "a", version=1) is None
+        assert cache.get("tool", "c", version=1) == "c"
+        assert cache.get("tool", "c", version=2) is None
+        assert len(cache) == 0
+        
+        cache.ttl = 0
+        cache.put("tool", "d", "d", version=2)
+        assert cache.get("tool", "d", version=2) is None
+    
+    def test_hybrid_search_uses_cache(self, monkeypatch, tiny_registry):
+        """测试重复问题直接返回缓存结果，不再检索"""
+        import zhimi.tools.search_tool as search_tool_module
+        from zhimi.tools.result_cache import ResultCache
+        
+        calls = []
+        original = search_tool_module._hybrid_retrieve
+        monkeypatch.setattr(search_tool_module, "registry", tiny_registry)
+        monkeypatch.setattr(search_tool_module, "result_cache", ResultCache(max_entries=10, ttl=60))
+        monkeypatch.setattr(search_tool_module, "_hybrid_retrieve", lambda query, **kwargs: calls.append(query) or original(query, **kwargs))
+        
+        first = search_tool_module.hybrid_search("faiss vector index")
+        assert search_tool_module.hybrid_search("faiss  vector index") == first
+        assert calls == ["faiss vector index"]
+    
+    def test_semantic_lookup_is_bounded(self, monkeypatch, tiny_registry):
+        """测试语义缓存的查询向量化受向量检索超时限制，且向量检索复用该向量，不重复向量化"""
+        import asyncio
+        import time
+        import zhimi.tools.search_tool as search_tool_module
+        from zhimi.tools.result_cache import ResultCache
+        
+        cache = ResultCache(max_entries=10, ttl=60, similarity_threshold=0.95)
+        monkeypatch.setattr(search_tool_module, "registry", tiny_registry)
+        monkeypatch.setattr(search_tool_module, "result_cache", cache)
+        monkeypatch.setattr(search_tool_module, "HYBRID_VECTOR_TIMEOUT", 0.2)
+        monkeypatch.setattr(search_tool_module, "_branch_slots", branch_slots())
+        
+        embeddings = tiny_registry._embeddings
+        embedded = []
+        class CountingEmbeddings:
+            def embed_query(self, text):
+                embedded.append(text)
+                return embeddings.embed_query(text)
+        monkeypatch.setattr(tiny_registry, "_embeddings", CountingEmbeddings())
+        assert "来源" in search_tool_module.hybrid_search("faiss vector index")
+        assert embedded == ["faiss vector index"]
+        assert len(cache) == 1
+        
+        def slow_embed_query(text):
+            time.sleep(1)
+            return embeddings.embed_query(text)
+        monkeypatch.setattr(search_tool_module, "_embed_query", slow_embed_query)
+        for run in (search_tool_module.hybrid_search, lambda q: asyncio.run(search_tool_module.ahybrid_search(q))):
+            start_time = time.monotonic()
+            assert "bm25" in run("bm25 keyword ranking").lower()
+            assert time.monotonic() - start_time < 0.9
+        # 向量化超时时只有 BM25 的结果，不写入缓存
+        assert len(cache) == 1
+
+    def test_degraded_results_not_cached(self, monkeypatch, tiny_registry):
+        """测试某一路检索超时或重排序未生效时，结果照常返回但不写入缓存（同步与异步版本一致）"""
+        import asyncio
+        import time
+        import zhimi.tools.search_tool as search_tool_module
+        from zhimi.tools.result_cache import ResultCache
+        
+        cache = ResultCache(max_entries=10, ttl=60, similarity_threshold=2)
+        monkeypatch.setattr(search_tool_module, "registry", tiny_registry)
+        monkeypatch.setattr(search_tool_module, "result_cache", cache)
+        monkeypatch.setattr(search_tool_module, "HYBRID_VECTOR_TIMEOUT", 0.1)
+        monkeypatch.setattr(search_tool_module, "_branch_slots", branch_slots())
+        
+        def slow_vector_branch(query, k, metadata_filter=None, vector=None):
+            time.sleep(0.3)
+            return []
+        monkeypatch.setattr(search_tool_module, "_vector_branch", slow_vector_branch)
+        assert "bm25" in search_tool_module.hybrid_search("bm25 keyword ranking").lower()
+        assert asyncio.run(search_tool_module.ahybrid_search("bm25 keyword ranking"))
+        assert len(cache) == 0
+        
+        monkeypatch.undo()
+        monkeypatch.setattr(search_tool_module, "registry", tiny_registry)
+        monkeypatch.setattr(search_tool_module, "result_cache", cache)
+        monkeypatch.setattr(search_tool_module, "_branch_slots", branch_slots())
+        # 重排序模型仍在加载（rerank 返回 None）时只用融合排序，同样不缓存
+        reranker = FakeReranker(ready=False)
+        monkeypatch.setattr(search_tool_module, "reranker", reranker)
+        search_tool_module.hybrid_search("bm25 keyword ranking")
+        assert len(cache) == 0
+        reranker.ready = True
+        search_tool_module.hybrid_search("bm25 keyword ranking")
+        assert len(cache) == 1
+    
+    def test_unusable_reranker_still_caches(self, monkeypatch, tiny_registry):
+        """测试重排序模型加载失败或超出延迟预算时，融合排序的结果照常缓存"""
+        import zhimi.tools.search_tool as search_tool_module
+        from zhimi.tools.reranker import CrossEncoderReranker
+        from zhimi.tools.result_cache import ResultCache
+        
+        cache = ResultCache(max_entries=10, ttl=60, similarity_threshold=2)
+        monkeypatch.setattr(search_tool_module, "registry", tiny_registry)
+        monkeypatch.setattr(search_tool_module, "result_cache", cache)
+        monkeypatch.setattr(search_tool_module, "_branch_slots", branch_slots())
+        reranker = CrossEncoderReranker("fake", budget_ms=1, probe_interval=60)
+        monkeypatch.setattr(search_tool_module, "reranker", reranker)
+        
+        reranker._failed = True
+        search_tool_module.hybrid_search("bm25 keyword ranking")
+        assert len(cache) == 1
+        
+        reranker._failed = False
+        reranker._model = FakeCrossEncoder()
+        reranker._seconds_per_pair = 1.0
+        reranker._last_measured = float("inf")
+        search_tool_module.hybrid_search("faiss vector index")
+        assert reranker._model.pairs == []
+        assert len(cache) == 2
+
+
+@pytest.fixture
+def char_tokenizer(monkeypatch):
+    """每个字符计为一个 token，使预算测试与实际安装的分词器无关"""
+    from zhimi.tools import context_packing
+    
+    monkeypatch.setattr(context_packing, "_tokenizer", len)
+    context_packing.count_tokens.cache_clear()
+    yield
+    context_packing.count_tokens.cache_clear()
+
+
+@pytest.mark.skipif(not AGENT_IMPORT_OK, reason=f"无法导入agent模块")
+class TestContextPacking:
+    """测试按 token 预算打包检索结果"""
+    
+    def test_tokenizer_load_is_bounded(self, monkeypatch):
+        """测试分词器加载超时或失败时不阻塞，退回按字符估算"""
+        import time
+        from zhimi.tools import context_packing
+        
+        def missing():
+            raise OSError("本地没有缓存")
+        
+        def slow_download():
+            time.sleep(2)
+            return len
+        monkeypatch.setattr(context_packing, "_load_hf_tokenizer", missing)
+        monkeypatch.setattr(context_packing, "_load_tiktoken", slow_download)
+        monkeypatch.setattr(context_packing, "CONTEXT_TOKENIZER_TIMEOUT", 0.1)
+        
+        start_time = time.monotonic()
+        assert context_packing._load_tokenizer() is context_packing._estimate_tokens
+        assert time.monotonic() - start_time < 1
+    
+    def test_tokenizer_repo_id(self):
+        """测试分词器默认使用 Hugging Face 仓库名，且检索模块不导入 LLM 客户端"""
+        import subprocess
+        import sys
+        from zhimi.tools.context_packing import _hf_repo_id
+        
+        assert _hf_repo_id("Qwen2.5-7B-Instruct") == "Qwen/Qwen2.5-7B-Instruct"
+        assert _hf_repo_id("Qwen/Qwen2.5-7B-Instruct") == "Qwen/Qwen2.5-7B-Instruct"
+        assert _hf_repo_id("deepseek-ai/DeepSeek-V3") == "deepseek-ai/DeepSeek-V3"
+        
+        code = "import sys, zhimi.tools.search_tool; print('zhimi.llm' in sys.modules)"
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                                cwd=Path(__file__).resolve().parent.parent)
+        assert result.stdout.strip().splitlines()[-1] == "False"
+    
+    def test_merge_adjacent_chunks(self, char_tokenizer):
+        """测试同一来源的相邻片段按起始偏移或文本重叠合并，不同来源不合并"""
+        from langchain_core.documents import Document
+        from zhimi.tools.context_packing import ScoredChunk, pack_chunks
+        
+        text = "".join(f"第{i}句。" for i in range(30))
+        chunks = [
+            ScoredChunk(Document(page_content=text[40:], metadata={"source": "a.txt", "start_index": 40}), 0.9),
+            ScoredChunk(Document(page_content="其他来源", metadata={"source": "b.txt"}), 0.8),
+            ScoredChunk(Document(page_content=text[:60], metadata={"source": "a.txt", "start_index": 0}), 0.5),
+        ]
+        packed = pack_chunks(chunks, token_budget=0)
+        assert [chunk.document.page_content for chunk in packed] == [text, "其他来源"]
+        assert packed[0].score == 0.9
+        
+        chunks = [
+            ScoredChunk(Document(page_content=text[:60], metadata={"source": "a.txt"}), 0.9),
+            ScoredChunk(Document(page_content=text[30:], metadata={"source": "a.txt"}), 0.5),
+        ]
+        assert [chunk.document.page_content for chunk in pack_chunks(chunks, token_budget=0)] == [text]
+    
+    def test_budget_truncation(self, char_tokenizer):
+        """测试按相关度放入预算，放不下的块截断，其后的块丢弃"""
+        from langchain_core.documents import Document
+        from zhimi.tools.context_packing import ScoredChunk, pack_chunks
+        
+        chunks = [
+            ScoredChunk(Document(page_content="甲" * 50, metadata={"source": "a.txt"}), 0.9),
+            ScoredChunk(Document(page_content="乙" * 100, metadata={"source": "b.txt"}), 0.8),
+            ScoredChunk(Document(page_content="丙" * 10, metadata={"source": "c.txt"}), 0.7),
+        ]
+        packed = pack_chunks(chunks, token_budget=100, overhead=lambda position, chunk: 5)
+        assert len(packed) == 2
+        assert packed[0].document.page_content == "甲" * 50
+        assert len(packed[1].document.page_content) == 40
+        assert packed[1].document.page_content.endswith("…")
+    
+    def test_format_results_within_budget(self, monkeypatch, tiny_registry, char_tokenizer):
+        """测试混合检索工具输出不超过 token 预算"""
+        import zhimi.tools.search_tool as search_tool_module
+        
+        monkeypatch.setattr(search_tool_module, "registry", tiny_registry)
+        results = search_tool_module.hybrid_retrieve("faiss bm25 hybrid", k=6, candidate_k=6)
+        assert len(search_tool_module.format_results(results, token_budget=80)) <= 80
+
+
+class FakeCrossEncoder:
+    """按片段中包含的查询词数打分的假交叉编码器，记录每次打分的 (查询, 片段)"""
+    
+    def __init__(self):
+        self.pairs = []
+    
+    def predict(self, pairs, batch_size=16):
+        self.pairs.extend(pairs)
+        return [sum(word in text for word in query.split()) for query, text in pairs]
+
+
+@pytest.mark.skipif(not AGENT_IMPORT_OK, reason=f"无法导入agent模块")
+class TestReranker:
+    """测试交叉编码器重排序"""
+    
+    def test_rerank_with_cache(self):
+        """测试按模型分数重排，且相同 (查询, 片段) 再次出现时命中缓存"""
+        from zhimi.tools.reranker import CrossEncoderReranker
+        
+        reranker = CrossEncoderReranker("fake", batch_size=2)
+        reranker._model = FakeCrossEncoder()
+        candidates = [("a", "streamlit ui"), ("b", "faiss bm25 hybrid"), ("c", "faiss index")]
+        
+        assert reranker.rerank("faiss hybrid", candidates) == [0, 2, 1]
+        assert len(reranker._model.pairs) == 3
+        # 空白差异视为同一查询
+        assert reranker.rerank("faiss  hybrid", candidates + [("d", "hybrid")]) == [0, 2, 1, 1]
+        assert len(reranker._model.pairs) == 4
+    
+    def test_cache_eviction(self):
+        """测试分数缓存按最近最少使用淘汰"""
+        from zhimi.tools.reranker import CrossEncoderReranker
+        
+        reranker = CrossEncoderReranker("fake", cache_size=2)
+        reranker._model = FakeCrossEncoder()
+        reranker.rerank("q", [("a", "x"), ("b", "y"), ("c", "z")])
+        assert len(reranker._cache) == 2
+        reranker.rerank("q", [("a", "x")])
+        assert len(reranker._model.pairs) == 4
+    
+    def test_skip_when_over_budget(self):
+        """测试模型未就绪或预计超出延迟预算时返回 None"""
+        from zhimi.tools.reranker import CrossEncoderReranker
+        
+        import time
+        reranker = CrossEncoderReranker("fake", budget_ms=100, probe_interval=60)
+        reranker._failed = True
+        assert reranker.rerank("q", [("a", "x")]) is None
+        
+        reranker._model = FakeCrossEncoder()
+        reranker._seconds_per_pair = 1.0
+        reranker._last_measured = time.monotonic()
+        assert reranker.rerank("q", [("a", "x")]) is None
+        assert reranker._model.pairs == []
+    
+    def test_recovers_after_slow_batch(self):
+        """测试偶发的慢批次使重排序暂停后，重新测量到正常耗时即恢复"""
+        from zhimi.tools.reranker import CrossEncoderReranker
+        
+        reranker = CrossEncoderReranker("fake", budget_ms=100, probe_interval=0)
+        reranker._model = FakeCrossEncoder()
+        reranker._predicted = True
+        reranker._seconds_per_pair = 1.0
+        candidates = [("a", "streamlit ui"), ("b", "faiss bm25 hybrid"), ("c", "faiss index")]
+        # 本次跳过，但对一个候选打分并重新测量
+        assert reranker.rerank("faiss hybrid", candidates) is None
+        assert len(reranker._model.pairs) == 1
+        assert reranker._seconds_per_pair < 0.1
+        assert reranker.rerank("faiss hybrid", candidates) == [0, 2, 1]
+        assert len(reranker._model.pairs) == 3
+    
+    def test_hybrid_retrieve_with_reranker(self, monkeypatch, tiny_registry):
+        """测试启用重排序后按重排分数返回前 k 个片段"""
+        import zhimi.tools.search_tool as search_tool_module
+        from zhimi.tools.reranker import CrossEncoderReranker
+        
+        reranker = CrossEncoderReranker("fake")
+        reranker._model = FakeCrossEncoder()
+        monkeypatch.setattr(search_tool_module, "registry", tiny_registry)
+        monkeypatch.setattr(search_tool_module, "reranker", reranker)
+        
+        results = search_tool_module.hybrid_retrieve("faiss bm25 hybrid fusion", k=2, candidate_k=6)
+        assert results[0].document.id == "chunk-5"
+        assert results[0].score == 4
+        assert len(reranker._model.pairs) >= 2
+
+
+class FakeToolChatModel(GenericFakeChatModel):
+    """按顺序返回预设消息的聊天模型：带工具调用的消息整条输出，普通消息按空格逐词流式输出"""
+
+    system_prompts: list = []
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        self.system_prompts.append(messages[0].content)
+        message = next(self.messages)
+        if message.tool_calls:
+            tool_call_chunks = [
+                {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": i}
+                for i, call in enumerate(message.tool_calls)
+            ]
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=tool_call_chunks))
+            return
+        for token in message.content.split(" "):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
 @pytest.mark.skipif(not AGENT_IMPORT_OK, reason=f"无法导入agent模块")
 class TestAgentIntegration:
     """测试Agent集成功能"""
@@ -194,6 +798,82 @@ class TestAgentIntegration:
         except Exception as e:
             # 如果因为API key等问题失败，跳过这个测试
             pytest.skip(f"Agent加载失败（可能需要API key）: {e}")
+
+    def test_stream_agent(self, monkeypatch):
+        """测试流式运行：先产出工具进度，再逐词产出最终回答，对话历史正常写入"""
+        import zhimi.agent as agent_module
+        import zhimi.memory.memory_extractor as memory_extractor
+
+        responses = iter([
+            AIMessage(content="", tool_calls=[{"name": "simple_keyword_search", "args": {"query": "知觅"}, "id": "call-1"}]),
+            AIMessage(content="知觅 是 本地 知识 助手"),
+        ])
+        monkeypatch.setattr(agent_module, "get_llm", lambda: FakeToolChatModel(messages=responses))
+        monkeypatch.setattr(memory_extractor, "get_llm", lambda: None)
+        session_id = "test_stream_agent"
+        SESSION_STORE.pop(session_id, None)
+
+        agent = agent_module.load_agent()
+        events = list(agent_module.stream_agent(agent, "知觅是什么", session_id))
+        kinds = [event.kind for event in events]
+        assert kinds[:2] == ["tool_start", "tool_end"]
+        assert events[0].name == "simple_keyword_search"
+        assert [event.content for event in events if event.kind == "token"] == ["知觅", "是", "本地", "知识", "助手"]
+        assert events[-1] == agent_module.AgentEvent("output", "知觅是本地知识助手")
+
+        history = SESSION_STORE.pop(session_id).messages
+        assert [message.content for message in history] == ["知觅是什么", "知觅是本地知识助手"]
+
+    def test_astream_agent_across_event_loops(self, monkeypatch, chat_server):
+        """测试在两次独立的 asyncio.run 中流式运行 Agent：共享的异步客户端不会复用已关闭事件循环上的连接"""
+        import asyncio
+        import zhimi.agent as agent_module
+        import zhimi.llm as llm_module
+        import zhimi.memory.memory_extractor as memory_extractor
+
+        monkeypatch.setenv("SILICONFLOW_API_KEY", "sk-test")
+        monkeypatch.setenv("LLM_BASE_URL", chat_server)
+        monkeypatch.setattr(llm_module, "_llm_clients", {})
+        monkeypatch.setattr(memory_extractor, "get_llm", lambda: None)
+        agent = agent_module.load_agent()
+
+        async def run(session_id):
+            events = [event async for event in agent_module.astream_agent(agent, "你好", session_id)]
+            # 非流式调用结束后连接留在连接池中，下一次 asyncio.run 会尝试复用
+            message = await llm_module.get_llm().ainvoke("你好")
+            return events[-1], message.content
+
+        for session_id in ("test_loop_1", "test_loop_2"):
+            assert asyncio.run(run(session_id)) == (agent_module.AgentEvent("output", "你好 知觅"), "你好 知觅")
+            SESSION_STORE.pop(session_id, None)
+
+    def test_memory_injected_per_invocation(self, monkeypatch, tmp_path):
+        """测试用户记忆在每次调用时注入：同一个 Agent 服务多个用户，记忆更新后无需重建"""
+        import zhimi.agent as agent_module
+        import zhimi.memory.memory_extractor as memory_extractor
+        from zhimi.memory import UserMemory
+
+        model = FakeToolChatModel(messages=iter([AIMessage(content=f"回答{i}") for i in range(3)]))
+        monkeypatch.setattr(agent_module, "get_llm", lambda: model)
+        monkeypatch.setattr(memory_extractor, "get_llm", lambda: None)
+        storage_path = str(tmp_path / "user_memory.json")
+        monkeypatch.setattr(agent_module, "_user_memory_store", {
+            user_id: UserMemory(user_id, storage_path) for user_id in ("alice", "bob")
+        })
+        agent_module.get_user_memory("alice").update_memory({"background": {"profession": "数据工程师"}})
+
+        agent = agent_module.load_agent()
+        for user_id in ("alice", "bob"):
+            agent.invoke({"input": "你好"}, config={"configurable": {"session_id": f"test_{user_id}", "user_id": user_id}})
+        agent_module.get_user_memory("bob").update_memory({"background": {"profession": "产品经理"}})
+        agent.invoke({"input": "你好"}, config={"configurable": {"session_id": "test_bob", "user_id": "bob"}})
+        for user_id in ("alice", "bob"):
+            SESSION_STORE.pop(f"test_{user_id}", None)
+
+        alice_prompt, bob_prompt, bob_updated_prompt = model.system_prompts
+        assert "数据工程师" in alice_prompt and "用户记忆使用规则" in alice_prompt
+        assert "用户记忆" not in bob_prompt
+        assert "产品经理" in bob_updated_prompt
     
     def test_tool_descriptions(self):
         """测试工具描述是否正确"""
@@ -208,6 +888,126 @@ class TestAgentIntegration:
         assert "语义" in hybrid_tool.description or "上下文" in hybrid_tool.description
 
 
+class TestLLMRegistry:
+    """测试 LLM 客户端注册表"""
+
+    def test_shared_clients(self, monkeypatch):
+        """测试相同参数返回同一实例，不同参数的实例共用 HTTP 连接池"""
+        import httpx
+        import zhimi.llm as llm_module
+
+        monkeypatch.setenv("SILICONFLOW_API_KEY", "sk-test")
+        monkeypatch.setattr(llm_module, "_llm_clients", {})
+        llm = llm_module.get_llm("Qwen/Qwen2.5-7B-Instruct")
+        assert llm_module.get_llm("Qwen/Qwen2.5-7B-Instruct") is llm
+
+        extractor_llm = llm_module.get_llm("Qwen/Qwen2.5-7B-Instruct", temperature=0)
+        assert extractor_llm is not llm
+        assert extractor_llm.http_client is llm.http_client is llm_module.get_http_client()
+        assert extractor_llm.http_async_client is llm.http_async_client is llm_module.get_async_http_client()
+        # 异步客户端按事件循环转发请求，自身不建立连接池
+        assert not isinstance(llm_module.get_async_http_client()._transport, httpx.AsyncHTTPTransport)
+
+    def test_missing_api_key(self, monkeypatch):
+        """测试未配置 API key 时抛出 ValueError"""
+        import zhimi.llm as llm_module
+
+        monkeypatch.delenv("SILICONFLOW_API_KEY", raising=False)
+        with pytest.raises(ValueError):
+            llm_module.get_llm()
+
+
+class FakeUserMemory:
+    """记录每次提取收到的对话"""
+
+    def __init__(self, calls):
+        self.calls = calls
+
+    def update_from_messages(self, messages):
+        self.calls.append([message.content for message in messages])
+        return True
+
+
+class TestUserMemoryCache:
+    """测试用户记忆缓存与后台提取线程的并发"""
+
+    def test_invalidate_during_read_is_not_lost(self, tmp_path, monkeypatch):
+        """测试读取期间缓存被失效时，不会把过期的记忆和摘要写回缓存"""
+        import zhimi.memory.memory_extractor as memory_extractor
+        from zhimi.memory import UserMemory
+
+        monkeypatch.setattr(memory_extractor, "get_llm", lambda: None)
+        memory = UserMemory("alice", str(tmp_path / "user_memory.json"))
+        load_memory = memory.storage.load_memory
+
+        def racing_load(user_id):
+            old = load_memory(user_id)
+            # 读到旧记忆后、写回缓存前，后台提取写入新记忆并使缓存失效
+            monkeypatch.setattr(memory.storage, "load_memory", load_memory)
+            memory.storage.update_memory(user_id, {"background": {"profession": "数据工程师"}})
+            memory.invalidate()
+            return old
+
+        monkeypatch.setattr(memory.storage, "load_memory", racing_load)
+        assert memory.get_memory_summary() == ""
+        assert "数据工程师" in memory.get_memory_summary()
+        assert memory.get_background()["profession"] == "数据工程师"
+
+    def test_get_user_memory_single_instance(self, monkeypatch):
+        """测试多个线程同时获取同一用户时只创建一个实例"""
+        from concurrent.futures import ThreadPoolExecutor
+        import zhimi.agent as agent_module
+        import zhimi.memory.memory_extractor as memory_extractor
+
+        monkeypatch.setattr(memory_extractor, "get_llm", lambda: None)
+        monkeypatch.setattr(agent_module, "_user_memory_store", {})
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            instances = list(executor.map(agent_module.get_user_memory, ["alice"] * 32))
+        assert all(instance is instances[0] for instance in instances)
+
+
+class TestMemoryExtractionWorker:
+    """测试记忆后台提取"""
+
+    def test_coalesce_and_rate_limit(self):
+        """测试同一用户的请求合并为最新一份，且两次提取之间至少间隔 interval 秒"""
+        import time
+        from zhimi.memory import MemoryExtractionWorker
+
+        calls = {"alice": [], "bob": []}
+        worker = MemoryExtractionWorker(lambda user_id: FakeUserMemory(calls[user_id]), interval=0.3)
+        worker.submit("alice", [HumanMessage(content="第1轮")])
+        assert worker.wait_idle(timeout=2)
+
+        start_time = time.monotonic()
+        for i in range(2, 5):
+            worker.submit("alice", [HumanMessage(content=f"第{i}轮")])
+        worker.submit("bob", [HumanMessage(content="你好")])
+        assert worker.wait_idle(timeout=2)
+
+        assert calls["alice"] == [["第1轮"], ["第4轮"]]
+        assert calls["bob"] == [["你好"]]
+        assert time.monotonic() - start_time >= 0.25
+
+    def test_failure_does_not_stop_worker(self):
+        """测试单次提取失败后后台线程继续处理后续请求"""
+        from zhimi.memory import MemoryExtractionWorker
+
+        calls = []
+
+        def get_memory(user_id):
+            if user_id == "broken":
+                raise RuntimeError("LLM 不可用")
+            return FakeUserMemory(calls)
+
+        worker = MemoryExtractionWorker(get_memory, interval=0)
+        worker.submit("broken", [HumanMessage(content="你好")])
+        worker.submit("alice", [HumanMessage(content="我是数据工程师")])
+        assert worker.wait_idle(timeout=2)
+        assert calls == [["我是数据工程师"]]
+        assert worker.pending() == []
+
+
 class TestToolSelection:
     """测试工具选择机制（需要mock LLM）"""
     
@@ -0,0 +1,722 @@
+# tests/test_index.py
+"""知识库索引模块测试"""
+import json
+import os
+import pytest
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from zhimi.index import (
+    BM25Index,
+    CachedEmbeddings,
+    ChunkStore,
+    EmbeddingCache,
+    FileManifest,
+    KeywordIndex,
+    MetadataFilter,
+    MetadataIndex,
+    build_ann_index,
+    filtered_search_params,
+    build_manifest,
+    iter_file_chunks,
+    load_ann_index,
+    load_manifest,
+    read_index_mmap,
+    save_ann_index,
+    save_manifest,
+    set_search_params,
+)
+
+
+@pytest.fixture
+def sample_texts():
+    """创建示例文档片段"""
+    return [
+        "知觅是一个本地知识问答 Agent。",
+        "支持 TXT、PDF 和 Markdown 文档。",
+        "知觅使用 FAISS 向量检索和 BM25 关键词检索。",
+        "配置文件位于项目根目录的 .env 文件。",
+    ]
+
+
+class TestKeywordIndex:
+    """测试关键词倒排索引"""
+
+    def _search(self, index, texts, query, k=3):
+        """按 simple_keyword_search 的规则切分查询词后检索"""
+        query_lower = query.lower()
+        terms = [t for t in query_lower.split() if len(t) > 1] or [query_lower]
+        return [ordinal for ordinal, _ in index.search(terms, lambda o: texts[o], k=k)]
+
+    def test_chinese_substring_match(self, sample_texts):
+        """测试无空格中文查询按子串命中"""
+        index = KeywordIndex.build(sample_texts)
+
+        assert self._search(index, sample_texts, "知觅") == [0, 2]
+        assert self._search(index, sample_texts, "向量检索") == [2]
+        assert self._search(index, sample_texts, "不存在的词") == []
+
+    def test_ranking_by_match_count(self, sample_texts):
+        """测试按命中关键词数量排序，数量相同按文档顺序"""
+        index = KeywordIndex.build(sample_texts)
+
+        # "faiss" 和 "bm25" 同时命中第3个片段，"pdf" 只命中第2个片段
+        assert self._search(index, sample_texts, "pdf FAISS bm25") == [2, 1]
+        assert self._search(index, sample_texts, "知觅 文件", k=2) == [0, 2]
+
+    def test_save_and_load(self, sample_texts, tmp_path):
+        """测试保存后加载的索引检索结果一致"""
+        index = KeywordIndex.build(sample_texts)
+        index.save(str(tmp_path))
+
+        loaded = KeywordIndex.load(str(tmp_path))
+        assert loaded.doc_count == len(sample_texts)
+        assert self._search(loaded, sample_texts, "检索") == self._search(index, sample_texts, "检索")
+
+    def test_load_missing_index(self, tmp_path):
+        """测试索引文件不存在时返回 None"""
+        assert KeywordIndex.load(str(tmp_path)) is None
+
+
+class TestBM25Index:
+    """测试持久化 BM25 索引"""
+
+    def test_search_ranking(self):
+        """测试词频越高、文档越短的片段排名越靠前"""
+        texts = ["faiss 向量 检索", "bm25 关键词 检索", "bm25 bm25 检索", "无关 内容", "知觅 本地", "其他 片段"]
+        index = BM25Index.build(texts)
+
+        results = index.search("bm25", k=2)
+        assert [ordinal for ordinal, _ in results] == [2, 1]
+        assert results[0][1] > results[1][1] > 0
+        assert index.search("不存在", k=2) == []
+
+    def test_save_and_load(self, tmp_path):
+        """测试保存后加载（内存映射）的检索分数一致"""
+        texts = ["faiss 向量 检索", "bm25 关键词 检索", "知觅 本地 知识库"]
+        index = BM25Index.build(texts)
+        index.save(str(tmp_path))
+
+        loaded = BM25Index.load(str(tmp_path))
+        assert loaded.doc_count == 3
+        assert loaded.search("检索 bm25", k=3) == index.search("检索 bm25", k=3)
+
+    def test_chinese_text_without_spaces(self):
+        """测试无空格的中文文本可以按词检索，加载后沿用构建时的分词器"""
+        from zhimi.index import get_tokenizer
+
+        texts = ["本地知识库支持向量检索", "用户记忆的提取与存储", "混合检索融合关键词和向量"]
+        index = BM25Index.build(texts, get_tokenizer("bigram"))
+        assert [ordinal for ordinal, _ in index.search("怎么做向量检索", k=3)][:2] == [0, 2]
+        assert index.search("记忆提取", k=1)[0][0] == 1
+
+    def test_legacy_index_uses_whitespace(self, tmp_path):
+        """测试未记录分词器的旧版索引按空白切分查询"""
+        from zhimi.index import get_tokenizer
+
+        index = BM25Index.build(["faiss 向量 检索", "bm25 关键词"], get_tokenizer("whitespace"))
+        index.save(str(tmp_path))
+        vocab_path = tmp_path / "bm25_vocab.json"
+        meta = json.loads(vocab_path.read_text(encoding="utf-8"))
+        del meta["tokenizer"], meta["stopwords"]
+        vocab_path.write_text(json.dumps(meta), encoding="utf-8")
+
+        loaded = BM25Index.load(str(tmp_path))
+        assert loaded.tokenizer.name == "whitespace"
+        assert loaded.search("向量", k=1)[0][0] == 0
+
+
+class TestTokenizer:
+    """测试中文分词与停用词"""
+
+    def test_bigram_segmentation(self):
+        """测试中文按停用字切段取二字组合，英文按词并小写，停用词被去除"""
+        from zhimi.index import get_tokenizer
+
+        tokenizer = get_tokenizer("bigram")
+        assert tokenizer("知识的检索") == ["知识", "检索"]
+        assert tokenizer("向量检索 FAISS index") == ["向量", "量检", "检索", "faiss", "index"]
+        assert tokenizer("the 一个 吗") == []
+        assert tokenizer.tokenize("本地知识库") == tokenizer("本地知识库")
+
+    def test_whitespace_matches_legacy(self):
+        """测试 whitespace 分词与旧版 BM25Retriever 的空白切分一致"""
+        from zhimi.index import get_tokenizer
+
+        assert get_tokenizer("whitespace")("Faiss 的 检索") == ["Faiss", "的", "检索"]
+
+    def test_jieba(self):
+        """测试 jieba 分词（未安装时跳过）"""
+        pytest.importorskip("jieba")
+        from zhimi.index import get_tokenizer
+
+        tokens = get_tokenizer("jieba")("本地知识库的检索")
+        assert "检索" in tokens and "的" not in tokens
+
+
+class TestIndexManifest:
+    """测试索引清单"""
+
+    def test_save_and_load(self, tmp_path):
+        """测试清单保存后可完整读回"""
+        manifest = build_manifest(
+            embed_model="BAAI/bge-small-zh-v1.5",
+            dimension=512,
+            normalize=True,
+            chunk_size=500,
+            chunk_overlap=100,
+            separators=["\n\n", "。"],
+            doc_count=2,
+            chunk_count=10,
+        )
+        save_manifest(str(tmp_path), manifest)
+
+        loaded = load_manifest(str(tmp_path))
+        assert loaded == manifest
+        assert loaded["embedding"]["model"] == "BAAI/bge-small-zh-v1.5"
+        assert loaded["chunking"]["chunk_overlap"] == 100
+
+    def test_keys_relative_to_data_dir(self, tmp_path, monkeypatch):
+        """测试清单以相对文档目录的路径为键，data、./data 和绝对路径的扫描结果互相一致"""
+        from pathlib import Path
+
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "data" / "sub").mkdir(parents=True)
+        for name in ["a.txt", "sub/b.md"]:
+            (tmp_path / "data" / name).write_text(f"{name} 内容", encoding="utf-8")
+
+        def scan(data_dir):
+            return sorted(p for p in Path(data_dir).rglob("*") if p.is_file())
+
+        manifest = FileManifest(root=Path("data"))
+        for p in scan("data"):
+            manifest.record(p, [], 1)
+        assert sorted(manifest.entries) == ["a.txt", "sub/b.md"]
+        assert manifest.entries["sub/b.md"]["source"] == str(Path("data") / "sub" / "b.md")
+        manifest.save(str(tmp_path))
+
+        for data_dir in ["./data", str(tmp_path / "data")]:
+            loaded = FileManifest.load(str(tmp_path), Path(data_dir))
+            assert loaded.diff(scan(data_dir)) == ([], [], [])
+
+    def test_migrate_legacy_keys(self, tmp_path):
+        """测试旧版以 str(路径) 为键的清单加载时换算为相对键，来源路径保持不变"""
+        data_dir = tmp_path / "data"
+        data_dir.mkdir()
+        p = data_dir / "a.txt"
+        p.write_text("内容", encoding="utf-8")
+        manifest = FileManifest()
+        manifest.record(p, ["chunk-0"], 1)
+        legacy = {str(p): {k: v for k, v in manifest.entries[str(p)].items() if k != "source"}}
+        FileManifest(legacy).save(str(tmp_path))
+
+        loaded = FileManifest.load(str(tmp_path), data_dir)
+        assert list(loaded.entries) == ["a.txt"]
+        assert loaded.diff([p]) == ([], [], [])
+        assert loaded.mtimes() == {str(p): p.stat().st_mtime}
+
+    def test_load_missing_manifest(self, tmp_path):
+        """测试清单不存在时返回 None"""
+        assert load_manifest(str(tmp_path)) is None
+
+
+class TestFileManifest:
+    """测试增量索引使用的文件清单"""
+
+    def test_diff_detects_changes(self, tmp_path):
+        """测试识别新增、修改、删除和仅修改时间变化的文件"""
+        files = {name: tmp_path / f"{name}.txt" for name in ["keep", "touch", "edit", "gone"]}
+        for name, p in files.items():
+            p.write_text(f"{name} 内容", encoding="utf-8")
+
+        manifest = FileManifest()
+        for i, p in enumerate(files.values()):
+            manifest.record(p, [f"chunk-{i}"], 1)
+        manifest.save(str(tmp_path))
+        manifest = FileManifest.load(str(tmp_path))
+
+        files["edit"].write_text("edit 新内容", encoding="utf-8")
+        files["touch"].write_text("touch 内容", encoding="utf-8")  # 内容不变，仅修改时间变化
+        files["gone"].unlink()
+        new_file = tmp_path / "new.txt"
+        new_file.write_text("新文件", encoding="utf-8")
+
+        current = [files["keep"], files["touch"], files["edit"], new_file]
+        added, changed, removed = manifest.diff(current)
+        assert added == [new_file]
+        assert changed == [files["edit"]]
+        assert removed == [str(files["gone"])]
+        assert manifest.chunk_ids(str(files["gone"])) == ["chunk-3"]
+
+    def test_load_missing_manifest(self, tmp_path):
+        """测试清单不存在时返回空清单"""
+        assert FileManifest.load(str(tmp_path)).entries == {}
+
+
+class TestDocLoader:
+    """测试并行文档加载与分割"""
+
+    def test_parallel_order_and_errors(self, tmp_path):
+        """测试多进程结果与顺序处理一致，且单个文件失败不影响其他文件"""
+        files = []
+        for i in range(6):
+            p = tmp_path / f"doc{i}.txt"
+            p.write_text("。".join(f"第{i}篇文档的第{j}句话" for j in range(50)), encoding="utf-8")
+            files.append(p)
+        broken = tmp_path / "broken.txt"
+        broken.write_bytes(b"\xff\xfe\x00invalid utf-8 \xff")
+        files.insert(3, broken)
+
+        args = (100, 20, ["。"])
+        sequential = list(iter_file_chunks(files, *args, workers=1))
+        parallel = list(iter_file_chunks(files, *args, workers=2, max_pending=2))
+
+        assert [r.path for r in parallel] == files
+        assert [[c.page_content for c in r.chunks] for r in parallel] == \
+            [[c.page_content for c in r.chunks] for r in sequential]
+        assert parallel[3].error and parallel[3].chunks == []
+        assert all(r.error is None and r.chunks for i, r in enumerate(parallel) if i != 3)
+
+
+class CountingEmbeddings(Embeddings):
+    """记录调用次数的假嵌入模型"""
+
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded += texts
+        return [[float(len(t)), 1.0] for t in texts]
+
+    def embed_query(self, text):
+        self.embedded.append(text)
+        return [float(len(text)), 2.0]
+
+
+class TestEmbeddingCache:
+    """测试嵌入向量缓存"""
+
+    def test_only_misses_are_embedded(self, tmp_path):
+        """测试只对未命中的文本调用模型，且缓存可持久化"""
+        model = CountingEmbeddings()
+        cache = EmbeddingCache("m", True, "documents", cache_dir=str(tmp_path))
+        embeddings = CachedEmbeddings(model, document_cache=cache)
+        assert embeddings.embed_documents(["知觅", "检索"]) == [[2.0, 1.0], [2.0, 1.0]]
+        assert embeddings.embed_documents(["知觅", "  检索 ", "向量索引"])[2] == [4.0, 1.0]
+        assert model.embedded == ["知觅", "检索", "向量索引"]
+        cache.close()
+
+        reloaded = EmbeddingCache("m", True, "documents", cache_dir=str(tmp_path))
+        assert len(reloaded) == 3
+        assert reloaded.get_many(["向量索引", "未缓存"]) == [[4.0, 1.0], None]
+        reloaded.close()
+        # 模型配置不同的缓存不会被复用
+        assert len(EmbeddingCache("m", False, "documents", cache_dir=str(tmp_path))) == 0
+
+    def test_size_bounded_eviction(self, tmp_path):
+        """测试超过上限时淘汰最久未使用的条目"""
+        cache = EmbeddingCache("m", True, "queries", cache_dir=str(tmp_path), max_entries=10)
+        cache.put_many([f"q{i}" for i in range(10)], [[float(i)] for i in range(10)])
+        cache.get_many(["q0"])
+        cache.put_many(["q10"], [[10.0]])
+        assert len(cache) == 10
+        assert cache.get_many(["q0", "q1", "q10"]) == [[0.0], None, [10.0]]
+
+    def test_flush_in_background(self, tmp_path, monkeypatch):
+        """测试超过落盘间隔后由后台线程落盘，写入缓存的调用方不写文件"""
+        import threading
+        import time
+
+        cache = EmbeddingCache("m", True, "queries", cache_dir=str(tmp_path), flush_interval=0.1)
+        flushed_by = []
+        flush = cache.flush
+
+        def recording_flush():
+            flushed_by.append(threading.current_thread())
+            flush()
+        monkeypatch.setattr(cache, "flush", recording_flush)
+
+        cache.put_many(["如何安装"], [[1.0, 0.0]])
+        time.sleep(0.3)
+        cache.put_many(["如何卸载"], [[0.0, 1.0]])
+        deadline = time.monotonic() + 2
+        while len(flushed_by) < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert len(flushed_by) >= 2
+        assert threading.current_thread() not in flushed_by
+        cache.close()
+
+        reloaded = EmbeddingCache("m", True, "queries", cache_dir=str(tmp_path))
+        assert reloaded.get_many(["如何安装", "如何卸载"]) == [[1.0, 0.0], [0.0, 1.0]]
+        reloaded.close()
+
+    def test_instances_do_not_share_files(self, tmp_path):
+        """测试同一缓存目录上同时存在的两个实例（如两个服务进程）各用独立存储，不会互相覆盖"""
+        first = EmbeddingCache("m", True, "queries", cache_dir=str(tmp_path))
+        second = EmbeddingCache("m", True, "queries", cache_dir=str(tmp_path))
+        assert first.store != second.store
+        first.put_many(["如何安装"], [[1.0, 0.0]])
+        second.put_many(["如何卸载"], [[0.0, 1.0]])
+        assert first.get_many(["如何安装", "如何卸载"]) == [[1.0, 0.0], None]
+        assert second.get_many(["如何安装", "如何卸载"]) == [None, [0.0, 1.0]]
+        first.close()
+        second.close()
+
+        # 重启后按顺序复用各自的存储，条目都还在
+        reopened = [EmbeddingCache("m", True, "queries", cache_dir=str(tmp_path)) for _ in range(2)]
+        assert reopened[0].get_many(["如何安装"]) == [[1.0, 0.0]]
+        assert reopened[1].get_many(["如何卸载"]) == [[0.0, 1.0]]
+        for cache in reopened:
+            cache.close()
+
+
+class TestAnnIndex:
+    """测试由平面索引派生的近似索引"""
+
+    @pytest.fixture
+    def flat_index(self):
+        vectors = np.random.default_rng(0).normal(size=(2000, 16)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        index = faiss.IndexFlatL2(16)
+        index.add(vectors)
+        return index
+
+    @pytest.mark.parametrize("index_type", ["ivf_flat", "hnsw", "ivf_sq8"])
+    def test_ordinals_match_flat_index(self, flat_index, index_type, tmp_path):
+        """测试近似索引的序号与平面索引一致，保存后可重新加载"""
+        ann_index = build_ann_index(flat_index, index_type)
+        save_ann_index(str(tmp_path), ann_index)
+        ann_index = load_ann_index(str(tmp_path))
+        # 访问全部聚类 / 足够大的候选列表时应与精确检索一致
+        set_search_params(ann_index, nprobe=10000, ef_search=512)
+
+        queries = flat_index.reconstruct_n(0, 50)
+        _, exact = flat_index.search(queries, 1)
+        _, approx = ann_index.search(queries, 1)
+        assert ann_index.ntotal == flat_index.ntotal
+        assert (approx[:, 0] == exact[:, 0]).mean() > 0.95
+
+    def test_flat_type_removes_ann_file(self, flat_index, tmp_path):
+        """测试选择 flat 时不构建近似索引并删除旧文件"""
+        save_ann_index(str(tmp_path), build_ann_index(flat_index, "ivf_flat"))
+        assert build_ann_index(flat_index, "flat") is None
+        save_ann_index(str(tmp_path), None)
+        assert load_ann_index(str(tmp_path)) is None
+
+
+class TestChunkStore:
+    """测试按序号存取的片段存储"""
+
+    def test_write_and_mmap_load(self, tmp_path):
+        """测试写入后以内存映射方式按序号读取"""
+        docs = [
+            Document(id=f"id-{i}", page_content=f"第{i}个片段，包含中文", metadata={"source": f"doc{i}.txt"})
+            for i in range(5)
+        ]
+        assert ChunkStore.write(str(tmp_path), docs) == 5
+
+        store = ChunkStore.load(str(tmp_path))
+        assert len(store) == 5
+        doc = store.get(3)
+        assert (doc.id, doc.page_content, doc.metadata) == ("id-3", "第3个片段，包含中文", {"source": "doc3.txt"})
+        assert ChunkStore.from_documents(docs).get(4).page_content == store.get(4).page_content
+
+    def test_empty_and_missing_store(self, tmp_path):
+        """测试空存储和文件不存在的情况"""
+        assert ChunkStore.load(str(tmp_path)) is None
+        ChunkStore.write(str(tmp_path), [])
+        assert len(ChunkStore.load(str(tmp_path))) == 0
+
+    def test_read_index_mmap(self, tmp_path):
+        """测试以只读内存映射方式读取的索引检索结果与原索引一致"""
+        vectors = np.random.default_rng(0).normal(size=(100, 8)).astype(np.float32)
+        index = faiss.IndexFlatL2(8)
+        index.add(vectors)
+        faiss.write_index(index, str(tmp_path / "index.faiss"))
+
+        mapped = read_index_mmap(tmp_path / "index.faiss")
+        assert (mapped.search(vectors[:10], 3)[1] == index.search(vectors[:10], 3)[1]).all()
+
+
+class TestMetadataIndex:
+    """测试按来源元数据过滤检索范围"""
+
+    @pytest.fixture
+    def metadata_index(self):
+        docs = [
+            Document(page_content="a", metadata={"source": "data/docs/manual/intro.md"}),
+            Document(page_content="b", metadata={"source": "data/docs/manual/intro.md"}),
+            Document(page_content="c", metadata={"source": "data/docs/guide.pdf", "page": 0}),
+            Document(page_content="d", metadata={"source": "data/notes/todo.txt"}),
+        ]
+        mtimes = {
+            "data/docs/manual/intro.md": MetadataFilter.parse(modified_after="2024-01-01").modified_after,
+            "data/docs/guide.pdf": MetadataFilter.parse(modified_after="2023-06-01").modified_after,
+        }
+        return MetadataIndex.build(docs, mtimes)
+
+    def test_filter_mask(self, metadata_index):
+        """测试路径前缀（按路径分段匹配）、文件类型和修改日期过滤"""
+        def mask(**kwargs):
+            return metadata_index.mask(MetadataFilter.parse(**kwargs)).tolist()
+
+        assert mask(path_prefix="docs/manual") == [True, True, False, False]
+        assert mask(path_prefix="data/docs") == [True, True, True, False]
+        assert mask(path_prefix="doc") == [False, False, False, False]
+        assert mask(file_type="PDF, .txt") == [False, False, True, True]
+        # 修改时间未知的来源不满足日期条件
+        assert mask(modified_after="2023-12-01") == [True, True, False, False]
+        assert mask(modified_before="2023-12-01") == [False, False, True, False]
+        assert MetadataFilter.parse().is_empty()
+        with pytest.raises(ValueError):
+            MetadataFilter.parse(modified_after="上周")
+
+    def test_save_and_load(self, metadata_index, tmp_path):
+        """测试保存后加载，过滤结果一致"""
+        metadata_index.save(str(tmp_path))
+        loaded = MetadataIndex.load(str(tmp_path))
+        assert loaded.doc_count == 4
+        for kwargs in [{"path_prefix": "manual"}, {"file_type": "txt"}, {"modified_after": "2023-01-01"}]:
+            metadata_filter = MetadataFilter.parse(**kwargs)
+            assert (loaded.mask(metadata_filter) == metadata_index.mask(metadata_filter)).all()
+        assert MetadataIndex.load(str(tmp_path / "missing")) is None
+
+    def test_lexical_search_with_mask(self, sample_texts):
+        """测试 BM25 和关键词检索只在范围内打分"""
+        mask = np.array([False, True, True, True])
+        bm25 = BM25Index.build(sample_texts)
+        assert [ordinal for ordinal, _ in bm25.search("知觅使用 FAISS", k=4, mask=mask)] == [2]
+        keyword_index = KeywordIndex.build(sample_texts)
+        hits = keyword_index.search(["知觅"], lambda ordinal: sample_texts[ordinal].lower(), mask=mask)
+        assert [ordinal for ordinal, _ in hits] == [2]
+
+    @pytest.mark.parametrize("index_type", ["flat", "ivf_flat", "hnsw"])
+    def test_filtered_vector_search(self, index_type):
+        """测试向量检索在遍历时过滤：范围很小时仍能取满 k 个，且结果与精确检索一致"""
+        vectors = np.random.default_rng(0).normal(size=(3000, 16)).astype(np.float32)
+        flat_index = faiss.IndexFlatL2(16)
+        flat_index.add(vectors)
+        index = build_ann_index(flat_index, index_type) or flat_index
+        set_search_params(index, nprobe=4, ef_search=32)
+        mask = np.zeros(3000, dtype=bool)
+        mask[::100] = True
+
+        params, bits = filtered_search_params(index, mask)
+        _, ordinals = index.search(vectors[:5], 10, params=params)
+        allowed = np.flatnonzero(mask)
+        exact = np.argsort(((vectors[:5, None, :] - vectors[None, allowed, :]) ** 2).sum(-1), axis=1)[:, :10]
+        assert mask[ordinals].all()
+        assert np.mean([len(set(row) & set(allowed[e])) / 10 for row, e in zip(ordinals, exact)]) > 0.9
+
+
+class TestCollections:
+    """测试集合与分片的目录布局"""
+
+    def test_shard_of_is_stable(self):
+        """测试分片归属只取决于相对路径，且分布在全部分片中"""
+        from zhimi.index import shard_of
+
+        paths = [f"dir{i % 3}/doc{i}.md" for i in range(100)]
+        shards = [shard_of(p, 4) for p in paths]
+        assert shards == [shard_of(p, 4) for p in paths]
+        assert set(shards) == {0, 1, 2, 3}
+
+    def test_discover_collections(self, tmp_path):
+        """测试只返回已构建的分片，旧版索引作为 default 集合"""
+        from zhimi.index import discover_collections, save_collection, shard_dir
+
+        root = str(tmp_path / "collections")
+        save_collection("kb", 3, root)
+        os.makedirs(shard_dir("kb", 0, root))
+        os.makedirs(shard_dir("kb", 2, root))
+        (tmp_path / "legacy").mkdir()
+
+        collections = discover_collections(root, str(tmp_path / "legacy"))
+        assert collections == {
+            "kb": [shard_dir("kb", 0, root), shard_dir("kb", 2, root)],
+            "default": [str(tmp_path / "legacy")],
+        }
+        assert discover_collections(str(tmp_path / "none"), str(tmp_path / "none")) == {}
+
+
+class TestIndexVersions:
+    """测试版本化索引目录的发布与清理"""
+
+    def test_publish_and_resolve(self, tmp_path):
+        """测试发布后解析到新版本，旧版布局的文件和超出保留数的旧版本被删除"""
+        from zhimi.index import current_version, new_version_dir, publish_version, resolve_index_dir
+
+        index_dir = str(tmp_path)
+        (tmp_path / "index.faiss").write_bytes(b"legacy")
+        assert resolve_index_dir(index_dir) == index_dir
+
+        versions = []
+        for _ in range(4):
+            versions.append(new_version_dir(index_dir))
+            publish_version(index_dir, versions[-1], keep=1)
+        assert resolve_index_dir(index_dir) == versions[-1]
+        assert current_version(index_dir) == os.path.basename(versions[-1])
+        assert not (tmp_path / "index.faiss").exists()
+        assert [os.path.exists(v) for v in versions] == [False, False, True, True]
+
+
+class BatchRecordingEmbeddings(Embeddings):
+    """记录每批向量化文本的确定性假嵌入，可设置在第几批时模拟中断"""
+
+    def __init__(self, fail_at=None):
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+
+        self.inner = DeterministicFakeEmbedding(size=8)
+        self.batches = []
+        self.fail_at = fail_at
+
+    def embed_documents(self, texts):
+        if self.fail_at is not None and len(self.batches) + 1 >= self.fail_at:
+            raise KeyboardInterrupt("模拟中断")
+        self.batches.append(list(texts))
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.inner.embed_query(text)
+
+    @property
+    def embedded(self):
+        return [text for batch in self.batches for text in batch]
+
+
+class TestIndexBuild:
+    """测试索引构建脚本的流式分批向量化与检查点续建"""
+
+    @pytest.fixture
+    def indexer(self, monkeypatch):
+        pytest.importorskip("langchain_huggingface")
+        import importlib.util
+        from pathlib import Path
+
+        path = Path(__file__).parent.parent / "scripts" / "index_local_docs.py"
+        spec = importlib.util.spec_from_file_location("index_local_docs", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        monkeypatch.setattr(module, "EMBED_BATCH_SIZE", 2)
+        monkeypatch.setattr(module, "CHECKPOINT_EVERY", 2)
+        return module
+
+    @pytest.fixture
+    def data_files(self, tmp_path):
+        data_dir = tmp_path / "data"
+        data_dir.mkdir()
+        for i in range(7):
+            (data_dir / f"doc{i}.txt").write_text(f"第 {i} 篇文档 知觅 检索", encoding="utf-8")
+        return sorted(data_dir.iterdir())
+
+    def sources(self, indexer, index_dir, embeddings):
+        from zhimi.index import resolve_index_dir
+
+        vs = indexer.FAISS.load_local(resolve_index_dir(index_dir), embeddings, allow_dangerous_deserialization=True)
+        return sorted(vs.docstore.search(doc_id).metadata["source"] for doc_id in vs.index_to_docstore_id.values())
+
+    def test_streaming_batches(self, indexer, data_files, tmp_path, monkeypatch):
+        """测试按批次向量化，构建完成后发布全部片段并删除检查点"""
+        embeddings = BatchRecordingEmbeddings()
+        monkeypatch.setattr(indexer, "create_embeddings", lambda: embeddings)
+        index_dir = str(tmp_path / "index")
+
+        stats = indexer.build_full(data_files, 1, "flat", index_dir=index_dir, data_dir=data_files[0].parent)
+        assert stats == {"docs": 7, "chunks": 7}
+        assert [len(batch) for batch in embeddings.batches] == [2, 2, 2, 1]
+        assert self.sources(indexer, index_dir, embeddings) == [str(p) for p in data_files]
+        assert not os.path.exists(index_dir + indexer.CHECKPOINT_SUFFIX)
+
+    def test_resume_from_checkpoint(self, indexer, data_files, tmp_path, monkeypatch):
+        """测试中断后从检查点继续：已提交的片段不再向量化，未登记到文件清单的片段被删除"""
+        index_dir = str(tmp_path / "index")
+        checkpoint_dir = index_dir + indexer.CHECKPOINT_SUFFIX
+        interrupted = BatchRecordingEmbeddings(fail_at=4)
+        monkeypatch.setattr(indexer, "create_embeddings", lambda: interrupted)
+        with pytest.raises(KeyboardInterrupt):
+            indexer.build_full(data_files, 1, "flat", index_dir=index_dir, data_dir=data_files[0].parent)
+        # 每个检查点只写入新增片段，写了一半的分段不会被提交
+        state = indexer.load_checkpoint_state(checkpoint_dir)
+        assert len(state["segments"]) == 3 and state["chunks"] == 6
+        segments_dir = os.path.join(checkpoint_dir, indexer.CHECKPOINT_SEGMENTS_DIR)
+        os.makedirs(os.path.join(segments_dir, "99999-partial.tmp"))
+
+        # 从文件清单中去掉 doc0，它的片段成为孤立片段
+        vs, file_manifest = indexer.load_checkpoint(checkpoint_dir, interrupted, data_files[0].parent)
+        file_manifest.remove(file_manifest.key(data_files[0]))
+        file_manifest.save(os.path.join(segments_dir, state["segments"][-1]))
+
+        embeddings = BatchRecordingEmbeddings()
+        monkeypatch.setattr(indexer, "create_embeddings", lambda: embeddings)
+        stats = indexer.build_full(data_files, 1, "flat", index_dir=index_dir, data_dir=data_files[0].parent)
+        assert stats == {"docs": 7, "chunks": 7}
+        assert sorted(embeddings.embedded) == sorted(p.read_text(encoding="utf-8") for p in data_files[::6])
+        assert self.sources(indexer, index_dir, embeddings) == [str(p) for p in data_files]
+        assert not os.path.exists(checkpoint_dir)
+
+    def test_unusable_checkpoint_rebuilds(self, indexer, data_files, tmp_path, monkeypatch):
+        """测试检查点损坏时从头构建"""
+        index_dir = str(tmp_path / "index")
+        checkpoint_dir = index_dir + indexer.CHECKPOINT_SUFFIX
+        os.makedirs(checkpoint_dir)
+        with open(os.path.join(checkpoint_dir, indexer.CHECKPOINT_STATE_FILE), "w", encoding="utf-8") as f:
+            json.dump({"segments": ["00000-missing"], "chunks": 3}, f)
+
+        embeddings = BatchRecordingEmbeddings()
+        monkeypatch.setattr(indexer, "create_embeddings", lambda: embeddings)
+        assert indexer.build_full(data_files, 1, "flat", index_dir=index_dir, data_dir=data_files[0].parent) == {"docs": 7, "chunks": 7}
+        assert len(embeddings.embedded) == 7
+
+    def test_no_resume(self, indexer, data_files, tmp_path, monkeypatch):
+        """测试 --no-resume 忽略已有检查点，全部文件重新向量化"""
+        index_dir = str(tmp_path / "index")
+        monkeypatch.setattr(indexer, "INDEX_PATH", index_dir)
+        monkeypatch.setattr(indexer, "create_embeddings", lambda: BatchRecordingEmbeddings(fail_at=3))
+        with pytest.raises(KeyboardInterrupt):
+            indexer.main(str(tmp_path / "data"), workers=1)
+        assert indexer.load_checkpoint_state(index_dir + indexer.CHECKPOINT_SUFFIX)["chunks"] == 4
+
+        embeddings = BatchRecordingEmbeddings()
+        monkeypatch.setattr(indexer, "create_embeddings", lambda: embeddings)
+        indexer.main(str(tmp_path / "data"), workers=1, resume=False)
+        assert len(embeddings.embedded) == 7
+        assert self.sources(indexer, index_dir, embeddings) == [str(p) for p in data_files]
+
+    def test_unchanged_incremental_keeps_version(self, indexer, data_files, tmp_path, monkeypatch):
+        """测试文档没有变化（只被 touch 过）时，增量更新不改写已发布的版本"""
+        from pathlib import Path
+        from zhimi.index import current_version, resolve_index_dir
+
+        embeddings = BatchRecordingEmbeddings()
+        monkeypatch.setattr(indexer, "create_embeddings", lambda: embeddings)
+        index_dir = str(tmp_path / "index")
+        data_dir = data_files[0].parent
+        indexer.build_full(data_files, 1, "flat", index_dir=index_dir, data_dir=data_dir)
+        version = current_version(index_dir)
+        manifest_path = Path(resolve_index_dir(index_dir)) / "files.json"
+        manifest_bytes = manifest_path.read_bytes()
+
+        stat = data_files[0].stat()
+        os.utime(data_files[0], (stat.st_atime, stat.st_mtime + 10))
+        stats = indexer.update_incremental(data_files, 1, "flat", index_dir=index_dir, data_dir=data_dir)
+        assert stats == {"docs": 7, "chunks": 7}
+        assert current_version(index_dir) == version
+        assert manifest_path.read_bytes() == manifest_bytes
+        assert len(embeddings.embedded) == 7
+
+    def test_incremental_independent_of_dir_spelling(self, indexer, data_files, tmp_path, monkeypatch):
+        """测试 --dir 写成 data、./data 或绝对路径时，增量更新都识别为没有变化"""
+        index_dir = str(tmp_path / "index")
+        monkeypatch.setattr(indexer, "INDEX_PATH", index_dir)
+        monkeypatch.chdir(tmp_path)
+        embeddings = BatchRecordingEmbeddings()
+        monkeypatch.setattr(indexer, "create_embeddings", lambda: embeddings)
+        indexer.main("data", workers=1)
+
+        for data_dir in ("./data", str(tmp_path / "data")):
+            indexer.main(data_dir, incremental=True, workers=1)
+        assert len(embeddings.embedded) == 7
+        assert self.sources(indexer, index_dir, embeddings) == [os.path.join("data", p.name) for p in data_files]
@@ -3,15 +3,19 @@ import sys
 from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from typing import List
+import asyncio
+import queue
+import threading
+from functools import lru_cache
+from typing import AsyncIterator, Iterator, List, NamedTuple, Optional
 from langchain_classic.agents import create_tool_calling_agent, AgentExecutor
-from langchain_core.runnables import RunnableWithMessageHistory
+from langchain_core.runnables import RunnableConfig, RunnablePassthrough, RunnableWithMessageHistory
 from langchain_core.chat_history import InMemoryChatMessageHistory, BaseChatMessageHistory
 from langchain_core.messages import BaseMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from zhimi.llm import get_llm
+from zhimi.llm import get_llm, llm_event_loop
 from zhimi.tools.search_tool import build_search_tool, build_simple_search_tool
-from zhimi.memory import UserMemory
+from zhimi.memory import MemoryExtractionWorker, UserMemory
 
 # 会话存储
 SESSION_STORE = {}
@@ -19,6 +23,27 @@ SESSION_STORE = {}
 HISTORY_WINDOW = 3
 # 用户记忆实例字典（支持多用户）
 _user_memory_store: dict = {}
+_user_memory_lock = threading.Lock()
+# 未在调用配置中指定 user_id / session_id 时使用的用户
+DEFAULT_USER_ID = "default_user"
+# 有用户记忆时附加在系统消息末尾的使用规则
+MEMORY_RULES = """### 5. 用户记忆使用规则
+- 在回答时，可以参考用户的偏好和背景信息
+- 根据用户的背景调整回答的详细程度和技术深度
+- 如果用户提到新的偏好或背景信息，可以自然地回应"""
+
+
+class AgentEvent(NamedTuple):
+    """Agent 流式输出事件
+
+    kind 取值：
+    - token：模型输出的文本片段（调用工具前的输出属于中间过程，收到 tool_start 时应丢弃）
+    - tool_start / tool_end：工具开始调用（content 为工具输入）/ 调用结束（content 为工具输出）
+    - output：最终回答全文（与 invoke 返回的 output 一致）
+    """
+    kind: str
+    content: str
+    name: str = ""
 
 class RecentWindowChatHistory(BaseChatMessageHistory):
     """包装聊天历史，只返回最近k轮对话"""
@@ -69,25 +94,42 @@ def get_recent_messages(history: InMemoryChatMessageHistory, k: int = 3) -> List
         return all_messages[-2 * k:]
     return all_messages
 
-def get_user_memory(user_id: str = "default_user") -> UserMemory:
+def get_user_memory(user_id: str = DEFAULT_USER_ID) -> UserMemory:
     """获取用户记忆实例（每个用户独立实例）"""
-    global _user_memory_store
-    if user_id not in _user_memory_store:
-        _user_memory_store[user_id] = UserMemory(user_id=user_id)
-    return _user_memory_store[user_id]
+    # 请求线程和后台提取线程可能同时获取同一用户的实例，加锁保证只创建一个
+    with _user_memory_lock:
+        if user_id not in _user_memory_store:
+            _user_memory_store[user_id] = UserMemory(user_id=user_id)
+        return _user_memory_store[user_id]
+
 
+def memory_prompt(user_id: str) -> str:
+    """用户记忆在系统消息中的部分（无记忆时为空；摘要由 UserMemory 缓存，记忆更新后自动失效）"""
+    memory_summary = get_user_memory(user_id).get_memory_summary()
+    if not memory_summary:
+        return ""
+    return "\n\n" + memory_summary + "\n\n" + MEMORY_RULES
+
+
+def _user_memory_from_config(inputs: dict, config: RunnableConfig) -> str:
+    """每次调用时按调用配置中的 user_id（未指定时为 session_id）取用户记忆"""
+    configurable = config.get("configurable", {})
+    user_id = configurable.get("user_id") or configurable.get("session_id") or DEFAULT_USER_ID
+    return memory_prompt(user_id)
+
+
+def load_agent():
+    """
+    构建带有对话历史的Agent
 
-def load_agent(user_id: str = "default_user"):
-    """加载带有记忆的Agent"""
+    用户记忆不写死在系统消息中，而是每次调用时作为提示词变量注入，
+    同一个 Agent 可供所有用户和会话共用，记忆更新后也无需重建。
+    """
     llm = get_llm()
     # 注册两个搜索工具：简单关键词检索和混合检索
     tools = [build_simple_search_tool(), build_search_tool()]
     
-    # 获取用户记忆
-    user_memory = get_user_memory(user_id)
-    memory_summary = user_memory.get_memory_summary()
-    
-    # 构建系统消息
+    # 构建系统消息（末尾的 {user_memory} 在每次调用时填入用户记忆）
     base_system_message = """你是一个名为「知觅」的智能助手，能使用工具来查询本地文档。
 
 ## 重要规则
@@ -124,11 +166,7 @@ def load_agent(user_id: str = "default_user"):
 - 如果工具返回"未找到相关信息"，如实告知用户
 - 保持回答的准确性和相关性"""
     
-    # 如果有用户记忆，添加到系统消息中
-    if memory_summary:
-        system_message = base_system_message + "\n\n" + memory_summary + "\n\n### 5. 用户记忆使用规则\n- 在回答时，可以参考用户的偏好和背景信息\n- 根据用户的背景调整回答的详细程度和技术深度\n- 如果用户提到新的偏好或背景信息，可以自然地回应"
-    else:
-        system_message = base_system_message
+    system_message = base_system_message + "{user_memory}"
     
     # 创建自定义提示模板
     prompt = ChatPromptTemplate.from_messages([
@@ -149,9 +187,12 @@ def load_agent(user_id: str = "default_user"):
         handle_parsing_errors=True
     )
     
+    # 每次调用时注入用户记忆
+    agent_with_memory = RunnablePassthrough.assign(user_memory=_user_memory_from_config) | agent_executor
+    
     # 添加记忆（get_session_history已自动限制为最近3轮）
     agent_with_history = RunnableWithMessageHistory(
-        agent_executor,  # 注意：这里传递的是agent_executor
+        agent_with_memory,  # 注意：这里传递的是带用户记忆的agent_executor
         get_session_history,
         input_messages_key="input",
         history_messages_key="chat_history",
@@ -160,6 +201,12 @@ def load_agent(user_id: str = "default_user"):
     return agent_with_history
 
 
+@lru_cache(maxsize=None)
+def get_agent():
+    """获取进程内共享的Agent（首次调用时构建）"""
+    return load_agent()
+
+
 def update_user_memory_from_conversation(user_id: str, messages: List[BaseMessage]) -> bool:
     """
     从对话中自动提取并更新用户记忆
@@ -172,4 +219,82 @@ def update_user_memory_from_conversation(user_id: str, messages: List[BaseMessag
         是否更新成功
     """
     user_memory = get_user_memory(user_id)
-    return user_memory.update_from_messages(messages)
\ No newline at end of file
+    return user_memory.update_from_messages(messages)
+
+
+@lru_cache(maxsize=None)
+def get_memory_worker() -> MemoryExtractionWorker:
+    """获取进程内共享的记忆提取后台线程"""
+    return MemoryExtractionWorker(get_user_memory)
+
+
+def submit_memory_update(user_id: str, messages: List[BaseMessage]) -> None:
+    """
+    在后台从对话中提取并更新用户记忆（立即返回，不增加当前回合的响应时间）
+
+    同一用户尚未执行的请求会被合并，并按 MEMORY_EXTRACT_INTERVAL 限流；
+    提取完成后记忆缓存失效，Agent 下次调用时注入新的记忆。
+    """
+    get_memory_worker().submit(user_id, messages)
+
+
+async def astream_agent(
+    agent, user_input: str, session_id: str, user_id: Optional[str] = None
+) -> AsyncIterator[AgentEvent]:
+    """
+    流式运行 Agent，逐个产出模型文本片段和工具调用进度
+
+    Args:
+        agent: get_agent / load_agent 返回的带历史的 Agent
+        user_input: 用户输入
+        session_id: 会话ID（对话历史与 invoke 一样在运行结束时写入）
+        user_id: 用户ID（注入该用户的记忆），为 None 时与会话ID相同
+    """
+    config = {"configurable": {"session_id": session_id, "user_id": user_id or session_id}}
+    async for event in agent.astream_events({"input": user_input}, config=config, version="v2"):
+        kind = event["event"]
+        if kind == "on_chat_model_stream":
+            # 决定调用工具的那一轮只有工具参数片段，content 为空
+            content = event["data"]["chunk"].content
+            if content and isinstance(content, str):
+                yield AgentEvent("token", content)
+        elif kind == "on_tool_start":
+            yield AgentEvent("tool_start", str(event["data"].get("input", "")), event["name"])
+        elif kind == "on_tool_end":
+            output = event["data"].get("output")
+            yield AgentEvent("tool_end", str(getattr(output, "content", output)), event["name"])
+        elif kind == "on_chain_end" and not event["parent_ids"]:
+            output = event["data"].get("output") or {}
+            yield AgentEvent("output", output.get("output", ""))
+
+
+def stream_agent(agent, user_input: str, session_id: str, user_id: Optional[str] = None) -> Iterator[AgentEvent]:
+    """
+    astream_agent 的同步版本（供 Streamlit 等同步界面逐个消费事件）
+
+    Agent 在 llm_event_loop() 上运行（与共享的异步 HTTP 客户端同一个事件循环，连接可以复用），
+    调用方提前停止迭代时 Agent 仍会运行结束并写入对话历史。
+
+    Raises:
+        Agent 运行时抛出的异常
+    """
+    events: queue.Queue = queue.Queue()
+    done = object()
+
+    async def produce():
+        try:
+            async for event in astream_agent(agent, user_input, session_id, user_id):
+                events.put(event)
+        except Exception as e:
+            events.put(e)
+        finally:
+            events.put(done)
+
+    asyncio.run_coroutine_threadsafe(produce(), llm_event_loop())
+    while True:
+        event = events.get()
+        if event is done:
+            return
+        if isinstance(event, Exception):
+            raise event
+        yield event
@@ -0,0 +1,77 @@
+"""知识库索引模块（索引构建脚本与检索工具共用的磁盘格式）"""
+from zhimi.index.keyword_index import KeywordIndex
+from zhimi.index.bm25_index import BM25Index
+from zhimi.index.tokenizer import DEFAULT_TOKENIZER, TOKENIZERS, Tokenizer, default_tokenizer, get_tokenizer
+from zhimi.index.file_manifest import FileManifest
+from zhimi.index.ann_index import (
+    ANN_TYPES,
+    ann_factory_string,
+    build_ann_index,
+    filtered_search_params,
+    load_ann_index,
+    read_index_mmap,
+    save_ann_index,
+    set_search_params,
+)
+from zhimi.index.chunk_store import ChunkStore
+from zhimi.index.metadata_index import MetadataFilter, MetadataIndex
+from zhimi.index.collections import (
+    COLLECTIONS_PATH,
+    discover_collections,
+    load_collection,
+    save_collection,
+    shard_dir,
+    shard_of,
+)
+from zhimi.index.versions import current_version, new_version_dir, publish_version, resolve_index_dir
+from zhimi.index.embedding_cache import CachedEmbeddings, EmbeddingCache, cached_embeddings, embed_queries
+from zhimi.index.doc_loader import SUPPORTED_SUFFIXES, FileChunks, iter_file_chunks
+from zhimi.index.manifest import (
+    DEFAULT_EMBED_MODEL,
+    build_manifest,
+    load_manifest,
+    save_manifest,
+)
+
+__all__ = [
+    "KeywordIndex",
+    "BM25Index",
+    "DEFAULT_TOKENIZER",
+    "TOKENIZERS",
+    "Tokenizer",
+    "default_tokenizer",
+    "get_tokenizer",
+    "FileManifest",
+    "ANN_TYPES",
+    "ann_factory_string",
+    "build_ann_index",
+    "filtered_search_params",
+    "load_ann_index",
+    "read_index_mmap",
+    "save_ann_index",
+    "set_search_params",
+    "ChunkStore",
+    "MetadataFilter",
+    "MetadataIndex",
+    "COLLECTIONS_PATH",
+    "discover_collections",
+    "load_collection",
+    "save_collection",
+    "shard_dir",
+    "shard_of",
+    "current_version",
+    "new_version_dir",
+    "publish_version",
+    "resolve_index_dir",
+    "EmbeddingCache",
+    "CachedEmbeddings",
+    "cached_embeddings",
+    "embed_queries",
+    "SUPPORTED_SUFFIXES",
+    "FileChunks",
+    "iter_file_chunks",
+    "DEFAULT_EMBED_MODEL",
+    "build_manifest",
+    "load_manifest",
+    "save_manifest",
+]
@@ -0,0 +1,160 @@
+"""向量索引模块（由精确的平面索引派生 IVF / HNSW / PQ 近似索引，以及只读内存映射加载）"""
+import math
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import faiss
+import numpy as np
+
+ANN_INDEX_FILE = "ann.faiss"
+# flat 表示不构建近似索引，查询直接使用精确的平面索引
+ANN_TYPES = ["flat", "ivf_flat", "hnsw", "ivf_pq", "ivf_sq8"]
+# 需要训练的索引类型
+TRAINED_TYPES = ["ivf_flat", "ivf_pq", "ivf_sq8"]
+# 每次从平面索引中取出的向量数，避免一次性复制全部向量
+ADD_BATCH_SIZE = 65536
+
+
+def default_nlist(n: int) -> int:
+    """IVF 聚类中心数：约 4√n，且保证每个中心至少有 39 个训练点"""
+    return max(1, min(int(4 * math.sqrt(n)), n // 39))
+
+
+def default_pq_m(dimension: int) -> int:
+    """PQ 子向量数：不超过维度的 1/4 且能整除维度（512 维时为 64，即每个向量 64 字节）"""
+    for m in range(min(64, max(1, dimension // 4)), 0, -1):
+        if dimension % m == 0:
+            return m
+    return 1
+
+
+def ann_factory_string(index_type: str, dimension: int, n: int, params: Dict[str, Any]) -> str:
+    """根据索引类型和参数生成 faiss.index_factory 描述串"""
+    nlist = params.get("nlist") or default_nlist(n)
+    if index_type == "ivf_flat":
+        return f"IVF{nlist},Flat"
+    if index_type == "ivf_sq8":
+        return f"IVF{nlist},SQ8"
+    if index_type == "ivf_pq":
+        return f"IVF{nlist},PQ{params.get('pq_m') or default_pq_m(dimension)}"
+    if index_type == "hnsw":
+        return f"HNSW{params.get('hnsw_m') or 32}"
+    raise ValueError(f"不支持的近似索引类型: {index_type}，可选: {', '.join(ANN_TYPES)}")
+
+
+def build_ann_index(
+    flat_index: faiss.Index,
+    index_type: str,
+    params: Optional[Dict[str, Any]] = None,
+    train_sample: int = 100000,
+    seed: int = 0,
+) -> Optional[faiss.Index]:
+    """
+    由平面索引构建近似索引
+
+    向量按原顺序加入，近似索引中的序号与平面索引一致，
+    因此可以直接复用原有的序号到文档 id 的映射。
+
+    Args:
+        flat_index: 精确的平面索引
+        index_type: 近似索引类型（见 ANN_TYPES）
+        params: 构建参数，可包含 nlist、pq_m、hnsw_m、ef_construction
+        train_sample: 训练样本数上限
+        seed: 训练样本的随机种子
+
+    Returns:
+        近似索引；index_type 为 flat 时返回 None
+    """
+    if index_type == "flat":
+        return None
+    params = params or {}
+    n, dimension = flat_index.ntotal, flat_index.d
+    index = faiss.index_factory(dimension, ann_factory_string(index_type, dimension, n, params), flat_index.metric_type)
+
+    if index_type == "hnsw":
+        index.hnsw.efConstruction = params.get("ef_construction") or 200
+    if index_type in TRAINED_TYPES:
+        rng = np.random.default_rng(seed)
+        sample_ids = np.sort(rng.choice(n, size=min(n, train_sample), replace=False))
+        index.train(np.vstack([flat_index.reconstruct(int(i)) for i in sample_ids]))
+
+    for start in range(0, n, ADD_BATCH_SIZE):
+        index.add(flat_index.reconstruct_n(start, min(ADD_BATCH_SIZE, n - start)))
+    return index
+
+
+def set_search_params(index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> None:
+    """
+    设置查询参数（对不适用的索引类型自动忽略）
+
+    Args:
+        index: FAISS 索引
+        nprobe: IVF 索引每次查询访问的聚类数，越大召回越高、越慢
+        ef_search: HNSW 索引查询时的候选列表长度，越大召回越高、越慢
+    """
+    if nprobe is not None:
+        try:
+            faiss.extract_index_ivf(index).nprobe = nprobe
+        except RuntimeError:
+            pass
+    if ef_search is not None and hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search
+
+
+def filtered_search_params(index: faiss.Index, mask: np.ndarray) -> Tuple[faiss.SearchParameters, np.ndarray]:
+    """
+    构建只在位图范围内检索的查询参数（过滤在索引遍历时进行，而非检索后再筛）
+
+    近似索引只访问一部分候选，范围越小，落在范围内的候选越少。
+    因此按范围占比放大 nprobe / efSearch，使范围内被访问的候选数与不过滤时大致相当。
+
+    Args:
+        index: FAISS 索引
+        mask: 长度为 index.ntotal 的布尔数组，True 表示可返回
+
+    Returns:
+        (查询参数, 位图字节数组)；位图由 FAISS 按指针引用，调用方需在检索完成前持有
+    """
+    bits = np.packbits(np.asarray(mask, dtype=bool), bitorder="little")
+    selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bits))
+    selectivity = max(float(np.count_nonzero(mask)) / max(len(mask), 1), 1e-6)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        nprobe = min(ivf.nlist, math.ceil(ivf.nprobe / selectivity))
+        return faiss.SearchParametersIVF(sel=selector, nprobe=nprobe), bits
+    if hasattr(index, "hnsw"):
+        ef_search = min(max(index.ntotal, 1), math.ceil(index.hnsw.efSearch / selectivity))
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=ef_search), bits
+    return faiss.SearchParameters(sel=selector), bits
+
+
+def save_ann_index(index_dir: str, index: Optional[faiss.Index]) -> None:
+    """保存近似索引，index 为 None 时删除旧的近似索引文件"""
+    path = Path(index_dir) / ANN_INDEX_FILE
+    if index is None:
+        path.unlink(missing_ok=True)
+        return
+    faiss.write_index(index, str(path))
+
+
+def read_index_mmap(path: Path) -> faiss.Index:
+    """
+    以只读内存映射方式读取 FAISS 索引
+
+    向量数据不复制到进程堆中，同一主机上的多个服务进程共享操作系统页缓存。
+    旧版 faiss 不支持对该索引类型做内存映射时退回普通读取。
+    """
+    # IO_FLAG_MMAP_IFC（faiss 1.9+）同时支持平面、HNSW 和 IVF 索引，更早的版本只能映射 IVF 倒排表
+    flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+    try:
+        return faiss.read_index(str(path), flags)
+    except RuntimeError:
+        return faiss.read_index(str(path))
+
+
+def load_ann_index(index_dir: str) -> Optional[faiss.Index]:
+    """以只读内存映射方式加载近似索引，不存在时返回 None"""
+    path = Path(index_dir) / ANN_INDEX_FILE
+    if not path.exists():
+        return None
+    return read_index_mmap(path)
@@ -0,0 +1,193 @@
+"""BM25 索引模块（统计量持久化，支持内存映射加载）"""
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from zhimi.index.postings import PostingsBuilder, save_postings, load_postings
+from zhimi.index.tokenizer import Tokenizer, default_tokenizer, get_tokenizer
+
+BM25_INDEX_NAME = "bm25"
+# 未记录分词器的旧版索引由 BM25Retriever 默认的空白切分构建
+LEGACY_TOKENIZER = "whitespace"
+
+
+class BM25Index:
+    """Okapi BM25 索引
+
+    打分公式与参数默认值和 rank_bm25.BM25Okapi（BM25Retriever 的实现）一致。
+    索引时预先计算文档频率、文档长度、词频倒排表和 IDF，持久化为 .npy 文件；
+    查询时只读取查询词对应的倒排区间，无需在内存中保留分词后的语料。
+    分词器名称保存在索引中，查询时自动使用构建时的分词器。
+    """
+
+    def __init__(self, terms: List[str], arrays, meta, tokenizer: Tokenizer):
+        self.terms = terms
+        self.vocab = {term: i for i, term in enumerate(terms)}
+        self.offsets = arrays["offsets"]
+        self.postings = arrays["postings"]
+        self.term_freqs = arrays["values"]
+        self.idf = arrays["idf"]
+        self.doc_lengths = arrays["doc_lengths"]
+        self.k1 = meta["k1"]
+        self.b = meta["b"]
+        self.epsilon = meta["epsilon"]
+        self.doc_count = meta["doc_count"]
+        self.avgdl = meta["avgdl"]
+        self.tokenizer = tokenizer
+
+    @classmethod
+    def build(
+        cls,
+        texts: Iterable[str],
+        tokenizer: Optional[Tokenizer] = None,
+        k1: float = 1.5,
+        b: float = 0.75,
+        epsilon: float = 0.25,
+    ) -> "BM25Index":
+        """
+        从文档文本构建索引
+
+        Args:
+            texts: 按文档序号排列的文本
+            tokenizer: 分词器，为 None 时使用配置的默认分词器
+            k1, b, epsilon: BM25 参数
+        """
+        tokenizer = tokenizer or default_tokenizer()
+        builder = PostingsBuilder(with_values=True)
+        doc_lengths = []
+        for ordinal, text in enumerate(texts):
+            tokens = tokenizer.tokenize(text)
+            term_freqs = Counter(tokens)
+            builder.add(ordinal, term_freqs.keys(), term_freqs.values())
+            doc_lengths.append(len(tokens))
+        terms, arrays = builder.finalize()
+
+        doc_count = len(doc_lengths)
+        doc_freqs = np.diff(arrays["offsets"])
+        idf = np.log(doc_count - doc_freqs + 0.5) - np.log(doc_freqs + 0.5)
+        if len(idf):
+            # 与 BM25Okapi 一致：负 IDF 替换为 epsilon * 平均 IDF
+            idf[idf < 0] = epsilon * idf.mean()
+        arrays["idf"] = idf
+        arrays["doc_lengths"] = np.asarray(doc_lengths, dtype=np.uint32)
+
+        meta = {
+            "k1": k1,
+            "b": b,
+            "epsilon": epsilon,
+            "doc_count": doc_count,
+            "avgdl": float(np.mean(doc_lengths)) if doc_lengths else 0.0,
+            "tokenizer": tokenizer.name,
+            "stopwords": tokenizer.stopwords_digest,
+        }
+        return cls(terms, arrays, meta, tokenizer)
+
+    def save(self, index_dir: str) -> None:
+        """保存到索引目录"""
+        save_postings(
+            Path(index_dir),
+            BM25_INDEX_NAME,
+            self.terms,
+            {
+                "offsets": self.offsets,
+                "postings": self.postings,
+                "values": self.term_freqs,
+                "idf": self.idf,
+                "doc_lengths": self.doc_lengths,
+            },
+            {
+                "k1": self.k1,
+                "b": self.b,
+                "epsilon": self.epsilon,
+                "doc_count": self.doc_count,
+                "avgdl": self.avgdl,
+                "tokenizer": self.tokenizer.name,
+                "stopwords": self.tokenizer.stopwords_digest,
+            },
+        )
+
+    @classmethod
+    def load(cls, index_dir: str) -> Optional["BM25Index"]:
+        """
+        从索引目录加载（数组内存映射，按需读入），不存在时返回 None
+
+        Raises:
+            ImportError: 构建时使用的分词器依赖未安装
+        """
+        loaded = load_postings(Path(index_dir), BM25_INDEX_NAME)
+        if loaded is None:
+            return None
+        terms, arrays, meta = loaded
+        tokenizer = get_tokenizer(meta.get("tokenizer", LEGACY_TOKENIZER))
+        if meta.get("stopwords", tokenizer.stopwords_digest) != tokenizer.stopwords_digest:
+            print("⚠️ BM25 索引构建时的停用词表与当前版本不同，建议重新运行索引脚本")
+        return cls(terms, arrays, meta, tokenizer)
+
+    def _term_scores(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """计算一个词项对其倒排表中各文档贡献的分数"""
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        docs = np.asarray(self.postings[start:end])
+        tf = np.asarray(self.term_freqs[start:end], dtype=np.float64)
+        norm = 1 - self.b + self.b * self.doc_lengths[docs] / self.avgdl
+        return docs, self.idf[term_id] * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+
+    def search(self, query: str, k: int = 2, mask: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        BM25 检索
+
+        Args:
+            query: 查询文本
+            k: 返回数量
+            mask: 检索范围位图（长度为文档数，True 表示参与打分），为 None 时不限范围
+
+        Returns:
+            [(文档序号, BM25 分数), ...]，按分数从高到低排列
+        """
+        return self.search_batch([query], k=k, mask=mask)[0]
+
+    def search_batch(
+        self, queries: List[str], k: int = 2, mask: Optional[np.ndarray] = None
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        批量 BM25 检索（多个查询共享的词项只计算一次）
+
+        Args:
+            queries: 查询文本列表
+            k: 每个查询的返回数量
+            mask: 检索范围位图，所有查询共用
+
+        Returns:
+            与 queries 一一对应的检索结果
+        """
+        if self.doc_count == 0:
+            return [[] for _ in queries]
+
+        term_scores = {}
+        results = []
+        for query in queries:
+            doc_parts, score_parts = [], []
+            for token in self.tokenizer(query):
+                term_id = self.vocab.get(token)
+                if term_id is None:
+                    continue
+                if term_id not in term_scores:
+                    docs, scores = self._term_scores(term_id)
+                    if mask is not None:
+                        # 范围外的文档不参与累加和排序
+                        keep = mask[docs]
+                        docs, scores = docs[keep], scores[keep]
+                    term_scores[term_id] = docs, scores
+                docs, scores = term_scores[term_id]
+                doc_parts.append(docs)
+                score_parts.append(scores)
+            if not doc_parts:
+                results.append([])
+                continue
+
+            ordinals, inverse = np.unique(np.concatenate(doc_parts), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(score_parts))
+            top = np.lexsort((ordinals, -scores))[:k]
+            results.append([(int(ordinals[i]), float(scores[i])) for i in top])
+        return results
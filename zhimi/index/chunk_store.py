@@ -0,0 +1,93 @@
+"""文档片段存储模块（按序号偏移索引，支持只读内存映射）"""
+import json
+import mmap
+import os
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+CHUNK_STORE_NAME = "chunks"
+
+
+class ChunkStore:
+    """按向量序号存取文档片段
+
+    片段依序号顺序以 UTF-8 JSON 记录拼接写入 chunks.bin，chunks_offsets.npy 记录每条记录的起止偏移。
+    查询端以只读内存映射方式打开两个文件，同一主机上的多个服务进程共享操作系统页缓存，
+    不再各自反序列化一份完整的 docstore。
+    """
+
+    def __init__(self, data, offsets: np.ndarray):
+        """
+        Args:
+            data: 全部记录拼接而成的字节数据（bytes 或 mmap）
+            offsets: 长度为 片段数 + 1 的偏移数组
+        """
+        self._data = data
+        self._offsets = offsets
+
+    @staticmethod
+    def _paths(index_dir: str) -> Tuple[Path, Path]:
+        return Path(index_dir) / f"{CHUNK_STORE_NAME}.bin", Path(index_dir) / f"{CHUNK_STORE_NAME}_offsets.npy"
+
+    @staticmethod
+    def _encode(doc: Document) -> bytes:
+        record = {"id": doc.id, "page_content": doc.page_content, "metadata": doc.metadata}
+        return json.dumps(record, ensure_ascii=False, default=str).encode("utf-8")
+
+    @classmethod
+    def write(cls, index_dir: str, docs: Iterable[Document]) -> int:
+        """
+        按序号顺序写入片段（先写临时文件再替换）
+
+        Returns:
+            写入的片段数
+        """
+        data_path, offsets_path = cls._paths(index_dir)
+        data_path.parent.mkdir(parents=True, exist_ok=True)
+        offsets = [0]
+        tmp_data_path = data_path.with_suffix(".bin.tmp")
+        with open(tmp_data_path, "wb") as f:
+            for doc in docs:
+                record = cls._encode(doc)
+                f.write(record)
+                offsets.append(offsets[-1] + len(record))
+        tmp_offsets_path = offsets_path.with_suffix(".npy.tmp")
+        with open(tmp_offsets_path, "wb") as f:
+            np.save(f, np.asarray(offsets, dtype=np.uint64))
+        os.replace(tmp_data_path, data_path)
+        os.replace(tmp_offsets_path, offsets_path)
+        return len(offsets) - 1
+
+    @classmethod
+    def load(cls, index_dir: str) -> Optional["ChunkStore"]:
+        """以只读内存映射方式加载，文件不存在时返回 None"""
+        data_path, offsets_path = cls._paths(index_dir)
+        if not (data_path.exists() and offsets_path.exists()):
+            return None
+        offsets = np.load(offsets_path, mmap_mode="r")
+        if data_path.stat().st_size == 0:
+            # 空文件无法建立内存映射
+            return cls(b"", offsets)
+        with open(data_path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(data, offsets)
+
+    @classmethod
+    def from_documents(cls, docs: Iterable[Document]) -> "ChunkStore":
+        """在内存中构建（用于缺少片段存储文件的旧版索引）"""
+        records = [cls._encode(doc) for doc in docs]
+        offsets = np.zeros(len(records) + 1, dtype=np.uint64)
+        np.cumsum([len(record) for record in records], out=offsets[1:])
+        return cls(b"".join(records), offsets)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def get(self, ordinal: int) -> Document:
+        """根据向量序号获取文档片段"""
+        start, end = int(self._offsets[ordinal]), int(self._offsets[ordinal + 1])
+        record = json.loads(self._data[start:end].decode("utf-8"))
+        return Document(id=record["id"], page_content=record["page_content"], metadata=record["metadata"])
@@ -0,0 +1,82 @@
+"""知识库集合模块（命名集合与分片的目录布局）"""
+import json
+import os
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# 命名集合的根目录：<根目录>/<集合名>/shard-000/ ...，每个分片是一份完整的索引目录
+COLLECTIONS_PATH = "memory/collections"
+COLLECTION_FILE = "collection.json"
+# 未指定集合时的旧版单一索引目录，查询端将其视为只有一个分片的 default 集合
+LEGACY_INDEX_PATH = "memory/faiss_index"
+DEFAULT_COLLECTION = "default"
+
+
+def shard_dir(name: str, shard: int, root: str = COLLECTIONS_PATH) -> str:
+    """分片索引目录"""
+    return str(Path(root) / name / f"shard-{shard:03d}")
+
+
+def shard_of(relative_path: str, shard_count: int) -> int:
+    """
+    文件所属的分片（按相对数据目录的路径哈希，与扫描顺序和数据目录位置无关）
+
+    Args:
+        relative_path: 相对数据目录的文件路径
+        shard_count: 分片数
+    """
+    return zlib.crc32(Path(relative_path).as_posix().encode("utf-8")) % shard_count
+
+
+def load_collection(name: str, root: str = COLLECTIONS_PATH) -> Optional[Dict]:
+    """加载集合描述（包含分片数），不存在或损坏时返回 None"""
+    path = Path(root) / name / COLLECTION_FILE
+    if not path.exists():
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (json.JSONDecodeError, IOError) as e:
+        print(f"⚠️ 加载集合描述失败: {e}")
+        return None
+
+
+def save_collection(name: str, shard_count: int, root: str = COLLECTIONS_PATH) -> None:
+    """保存集合描述（先写临时文件再替换）"""
+    path = Path(root) / name / COLLECTION_FILE
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"name": name, "shards": shard_count}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def discover_collections(
+    root: str = COLLECTIONS_PATH, legacy_index_path: str = LEGACY_INDEX_PATH, warn_missing: bool = True
+) -> Dict[str, List[str]]:
+    """
+    发现已构建的集合
+
+    Args:
+        root: 命名集合的根目录
+        legacy_index_path: 旧版单一索引目录
+        warn_missing: 集合缺少分片时是否输出提示（定期检查索引版本时关闭）
+
+    Returns:
+        {集合名: [分片索引目录]}，只包含已存在的分片；旧版单一索引目录作为 default 集合
+    """
+    collections: Dict[str, List[str]] = {}
+    if Path(root).is_dir():
+        for path in sorted(Path(root).iterdir()):
+            collection = load_collection(path.name, root)
+            if collection is None:
+                continue
+            shards = [shard_dir(path.name, i, root) for i in range(collection["shards"])]
+            missing = [shard for shard in shards if not Path(shard).exists()]
+            if missing and warn_missing:
+                print(f"⚠️ 集合 {path.name} 缺少 {len(missing)} 个分片，将只检索已构建的分片")
+            collections[path.name] = [shard for shard in shards if Path(shard).exists()]
+    if DEFAULT_COLLECTION not in collections and Path(legacy_index_path).exists():
+        collections[DEFAULT_COLLECTION] = [legacy_index_path]
+    return collections
@@ -0,0 +1,102 @@
+"""文档加载与分割模块（多进程流水线）"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional
+
+SUPPORTED_SUFFIXES = [".txt", ".pdf", ".md", ".markdown"]
+
+
+class FileChunks(NamedTuple):
+    """单个文件的加载与分割结果"""
+    path: Path
+    doc_count: int
+    chunks: list
+    error: Optional[str]
+
+
+def load_file(p: Path) -> list:
+    """加载单个文档文件"""
+    from langchain_community.document_loaders import TextLoader, PyPDFLoader, UnstructuredMarkdownLoader
+
+    if p.suffix == ".txt":
+        return TextLoader(str(p), encoding="utf-8").load()
+    elif p.suffix == ".pdf":
+        return PyPDFLoader(str(p)).load()
+    elif p.suffix in [".md", ".markdown"]:
+        return UnstructuredMarkdownLoader(str(p)).load()
+    return []
+
+
+def load_and_split_file(p: Path, chunk_size: int, chunk_overlap: int, separators: List[str]) -> FileChunks:
+    """
+    加载并分割单个文件（在工作进程中执行，异常作为结果返回而不是抛出）
+
+    Args:
+        p: 文件路径
+        chunk_size: 分块大小
+        chunk_overlap: 分块重叠长度
+        separators: 分块分隔符
+    """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    try:
+        raw_docs = load_file(p)
+    except Exception as e:
+        return FileChunks(p, 0, [], str(e))
+
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=separators,
+        # 记录片段在原文中的起始偏移，检索时据此合并相邻片段
+        add_start_index=True,
+    )
+    return FileChunks(p, len(raw_docs), splitter.split_documents(raw_docs), None)
+
+
+def iter_file_chunks(
+    files: List[Path],
+    chunk_size: int,
+    chunk_overlap: int,
+    separators: List[str],
+    workers: int = 1,
+    max_pending: Optional[int] = None,
+) -> Iterator[FileChunks]:
+    """
+    并行加载并分割文件，按输入顺序逐个产出结果
+
+    PDF/Markdown 解析是 CPU 密集型任务，使用进程池并行处理。
+    同时在途的任务数不超过 max_pending（默认 workers 的 4 倍），
+    消费端处理较慢时不会无限堆积已解析的结果。
+
+    Args:
+        files: 待处理文件（结果顺序与其一致）
+        chunk_size: 分块大小
+        chunk_overlap: 分块重叠长度
+        separators: 分块分隔符
+        workers: 工作进程数，1 表示在当前进程中顺序处理
+        max_pending: 最大在途任务数
+    """
+    if workers <= 1:
+        for p in files:
+            yield load_and_split_file(p, chunk_size, chunk_overlap, separators)
+        return
+
+    max_pending = max_pending or workers * 4
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        file_iter = iter(files)
+
+        def submit_next() -> None:
+            p = next(file_iter, None)
+            if p is not None:
+                pending.append(executor.submit(load_and_split_file, p, chunk_size, chunk_overlap, separators))
+
+        for _ in range(max_pending):
+            submit_next()
+        while pending:
+            # 按提交顺序取结果，保证输出顺序确定；每取走一个再补交一个
+            result = pending.popleft().result()
+            submit_next()
+            yield result
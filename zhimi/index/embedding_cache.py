@@ -0,0 +1,374 @@
+"""嵌入向量缓存模块（索引脚本与查询端共用）"""
+import atexit
+import hashlib
+import itertools
+import json
+import os
+import re
+import threading
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "memory/embedding_cache")
+# 每类缓存的最大条目数，设为 0 时禁用缓存
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", 200000))
+# 后台线程两次落盘之间的间隔（秒），进程退出时会再落盘一次
+EMBED_CACHE_FLUSH_INTERVAL = float(os.getenv("EMBED_CACHE_FLUSH_INTERVAL", 30))
+MIN_FLUSH_INTERVAL = 0.1
+INITIAL_CAPACITY = 1024
+# 缓存已满时一次淘汰的比例
+EVICT_RATIO = 0.1
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _try_lock(path: Path):
+    """尝试对文件加非阻塞排他锁，成功时返回打开的文件（关闭即释放，进程退出时由系统释放），被占用时返回 None"""
+    f = open(path, "a+b")
+    try:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+def normalize_text(text: str) -> str:
+    """规范化文本：合并连续空白并去除首尾空白"""
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+class EmbeddingCache:
+    """持久化的嵌入向量缓存
+
+    以 (模型, 规范化文本哈希) 为键。向量保存在 .npy 文件中并以内存映射方式读写，
+    键和最近使用时间另存为定长数组；条目数超过上限时淘汰最久未使用的条目。
+    不同用途（文档片段、查询）使用不同的 kind，各自独立存储。
+
+    缓存文件由一个实例独占（文件锁，进程退出时自动释放）：每个实例各自维护空位表，
+    多个进程（如多个 Web 服务进程）共用同一文件会互相覆盖向量。同一 kind 的文件已被占用时，
+    依次改用 <kind>-1、<kind>-2 … 的独立存储，重启后仍按此顺序复用各自的缓存。
+
+    写入只修改内存中的数组和向量映射，由后台线程每隔 flush_interval 秒落盘，查询路径上不写文件。
+    """
+
+    def __init__(
+        self,
+        model: str,
+        normalize: bool,
+        kind: str,
+        cache_dir: str = EMBED_CACHE_PATH,
+        max_entries: int = EMBED_CACHE_MAX_ENTRIES,
+        flush_interval: float = EMBED_CACHE_FLUSH_INTERVAL,
+    ):
+        """
+        初始化缓存（已有缓存文件时加载）
+
+        Args:
+            model: 嵌入模型名称
+            normalize: 是否归一化向量
+            kind: 缓存用途，如 "documents"、"queries"
+            cache_dir: 缓存根目录
+            max_entries: 最大条目数
+            flush_interval: 后台自动落盘的间隔（秒）
+        """
+        self.model = model
+        self.normalize = normalize
+        self.kind = kind
+        self.max_entries = max(1, max_entries)
+        self.flush_interval = max(MIN_FLUSH_INTERVAL, flush_interval)
+        self.dir = Path(cache_dir) / re.sub(r"[^\w.-]", "_", model)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.store, self._lock_file = self._claim_store()
+        self._lock = threading.Lock()
+        # 串行化落盘（后台线程、atexit 和 close 可能同时落盘）
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher = None
+        self._slots = {}
+        self._free = []
+        self._vectors = None
+        self._keys = None
+        self._ticks = None
+        self._tick = 0
+        self._dirty = False
+        self._load()
+
+    def _claim_store(self):
+        """独占一份存储，返回（存储名, 锁文件）"""
+        for n in itertools.count():
+            store = self.kind if n == 0 else f"{self.kind}-{n}"
+            lock_file = _try_lock(self.dir / f"{store}.lock")
+            if lock_file is not None:
+                return store, lock_file
+
+    def _path(self, suffix: str) -> Path:
+        return self.dir / f"{self.store}_{suffix}"
+
+    def _meta(self) -> dict:
+        return {"model": self.model, "normalize": self.normalize}
+
+    def _load(self) -> None:
+        """加载已有缓存，模型配置不一致或文件损坏时丢弃"""
+        meta_path = self._path("meta.json")
+        if not meta_path.exists():
+            return
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if {key: meta.get(key) for key in self._meta()} != self._meta():
+                return
+            self._vectors = np.load(self._path("vectors.npy"), mmap_mode="r+")
+            self._keys = np.load(self._path("keys.npy"))
+            self._ticks = np.load(self._path("ticks.npy"))
+            if not len(self._vectors) == len(self._keys) == len(self._ticks):
+                raise ValueError("缓存文件长度不一致")
+        except (json.JSONDecodeError, IOError, ValueError) as e:
+            print(f"⚠️ 加载嵌入缓存失败: {e}，将重新缓存")
+            self._vectors = self._keys = self._ticks = None
+            return
+
+        for slot, key in enumerate(self._keys):
+            if key:
+                self._slots[bytes(key)] = slot
+            else:
+                self._free.append(slot)
+        self._free.reverse()
+        self._tick = int(self._ticks.max(initial=0))
+
+    def _key(self, text: str) -> bytes:
+        return hashlib.sha256(f"{self.model}\0{normalize_text(text)}".encode("utf-8")).hexdigest().encode("ascii")
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def get_many(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """批量查询，未命中的位置为 None"""
+        with self._lock:
+            result = []
+            for text in texts:
+                slot = self._slots.get(self._key(text))
+                if slot is None:
+                    result.append(None)
+                    continue
+                self._tick += 1
+                self._ticks[slot] = self._tick
+                self._dirty = True
+                result.append(self._vectors[slot].tolist())
+            return result
+
+    def put_many(self, texts: List[str], vectors: List[List[float]]) -> None:
+        """批量写入（close 之后不再写入）"""
+        if not texts:
+            return
+        with self._lock:
+            if self._lock_file is None:
+                return
+            if self._vectors is None:
+                self._allocate(min(INITIAL_CAPACITY, self.max_entries), len(vectors[0]))
+            for text, vector in zip(texts, vectors):
+                key = self._key(text)
+                slot = self._slots.get(key)
+                if slot is None:
+                    slot = self._take_slot()
+                    self._slots[key] = slot
+                    self._keys[slot] = key
+                self._vectors[slot] = vector
+                self._tick += 1
+                self._ticks[slot] = self._tick
+            self._dirty = True
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_periodically, name="embed_cache_flush", daemon=True)
+                self._flusher.start()
+
+    def _flush_periodically(self) -> None:
+        """后台线程：每隔 flush_interval 秒落盘一次，直到 close"""
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ 嵌入缓存落盘失败: {e}")
+
+    def _take_slot(self) -> int:
+        """取一个空位，必要时扩容或淘汰最久未使用的条目"""
+        if not self._free:
+            capacity = len(self._keys)
+            if capacity < self.max_entries:
+                self._grow(min(capacity * 2, self.max_entries))
+            else:
+                self._evict(max(1, int(capacity * EVICT_RATIO)))
+        return self._free.pop()
+
+    def _evict(self, count: int) -> None:
+        """淘汰最久未使用的 count 个条目"""
+        for slot in np.argpartition(self._ticks, count - 1)[:count]:
+            del self._slots[bytes(self._keys[slot])]
+            self._keys[slot] = b""
+            self._ticks[slot] = 0
+            self._free.append(int(slot))
+
+    def _allocate(self, capacity: int, dimension: int) -> None:
+        """创建空的缓存文件"""
+        self._vectors = np.lib.format.open_memmap(
+            self._path("vectors.npy"), mode="w+", dtype=np.float32, shape=(capacity, dimension)
+        )
+        self._keys = np.zeros(capacity, dtype="S64")
+        self._ticks = np.zeros(capacity, dtype=np.int64)
+        self._free = list(range(capacity - 1, -1, -1))
+
+    def _grow(self, capacity: int) -> None:
+        """扩容到 capacity 个条目"""
+        old_capacity, dimension = self._vectors.shape
+        tmp_path = self._path("vectors.npy.tmp")
+        vectors = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(capacity, dimension))
+        vectors[:old_capacity] = self._vectors
+        vectors.flush()
+        # 先释放旧的内存映射，Windows 下才能替换文件
+        del vectors
+        self._vectors = None
+        os.replace(tmp_path, self._path("vectors.npy"))
+        self._vectors = np.load(self._path("vectors.npy"), mmap_mode="r+")
+        self._keys = np.concatenate([self._keys, np.zeros(capacity - old_capacity, dtype="S64")])
+        self._ticks = np.concatenate([self._ticks, np.zeros(capacity - old_capacity, dtype=np.int64)])
+        self._free = list(range(capacity - 1, old_capacity - 1, -1))
+
+    def flush(self) -> None:
+        """落盘：先写向量，再原子替换键、使用时间和元信息（键和使用时间取快照后在锁外写入，不阻塞查询）"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty or self._vectors is None:
+                    return
+                self._vectors.flush()
+                keys, ticks = self._keys.copy(), self._ticks.copy()
+                dimension = self._vectors.shape[1]
+                self._dirty = False
+            try:
+                for suffix, array in (("keys.npy", keys), ("ticks.npy", ticks)):
+                    tmp_path = self._path(suffix + ".tmp")
+                    with open(tmp_path, "wb") as f:
+                        np.save(f, array)
+                    os.replace(tmp_path, self._path(suffix))
+                tmp_path = self._path("meta.json.tmp")
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump({**self._meta(), "dimension": dimension}, f, ensure_ascii=False)
+                os.replace(tmp_path, self._path("meta.json"))
+            except Exception:
+                with self._lock:
+                    self._dirty = True
+                raise
+
+    def close(self) -> None:
+        """停止后台落盘线程，落盘并释放存储，之后其他实例可以使用这份存储"""
+        self._closed.set()
+        self.flush()
+        with self._lock:
+            self._slots, self._free = {}, []
+            self._vectors = self._keys = self._ticks = None
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+
+
+def embed_queries(embeddings: Embeddings, texts: List[str]) -> List[List[float]]:
+    """
+    批量向量化查询
+
+    BGE 等模型对查询添加检索指令，拼接指令后一次 embed_documents 调用即可批量编码，
+    结果与逐条 embed_query 相同；其他模型逐条调用 embed_query。
+    """
+    if isinstance(embeddings, CachedEmbeddings):
+        return embeddings.embed_queries(texts)
+    instruction = getattr(embeddings, "query_instruction", None)
+    if instruction is not None and not getattr(embeddings, "embed_instruction", ""):
+        return embeddings.embed_documents([instruction + text for text in texts])
+    return [embeddings.embed_query(text) for text in texts]
+
+
+def cached_embeddings(embeddings: Embeddings, model: str, normalize: bool, kind: str) -> Embeddings:
+    """
+    为嵌入模型加上缓存（EMBED_CACHE_MAX_ENTRIES 为 0 时原样返回）
+
+    Args:
+        embeddings: 底层嵌入模型
+        model: 嵌入模型名称
+        normalize: 是否归一化向量
+        kind: "documents" 缓存文档片段向量，"queries" 缓存查询向量
+    """
+    if EMBED_CACHE_MAX_ENTRIES <= 0:
+        return embeddings
+    cache = EmbeddingCache(model, normalize, kind)
+    if kind == "queries":
+        return CachedEmbeddings(embeddings, query_cache=cache)
+    return CachedEmbeddings(embeddings, document_cache=cache)
+
+
+class CachedEmbeddings(Embeddings):
+    """带缓存的嵌入模型包装
+
+    只对未命中缓存的文本调用底层模型，文档与查询分别使用独立的缓存
+    （部分模型对查询额外添加检索指令，两者向量不可互换）。
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        document_cache: Optional[EmbeddingCache] = None,
+        query_cache: Optional[EmbeddingCache] = None,
+    ):
+        self.embeddings = embeddings
+        self.document_cache = document_cache
+        self.query_cache = query_cache
+        for cache in (document_cache, query_cache):
+            if cache is not None:
+                atexit.register(cache.flush)
+
+    def flush(self) -> None:
+        """将缓存落盘"""
+        for cache in (self.document_cache, self.query_cache):
+            if cache is not None:
+                cache.flush()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.document_cache is None:
+            return self.embeddings.embed_documents(texts)
+        vectors = self.document_cache.get_many(texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            new_vectors = self.embeddings.embed_documents(missing_texts)
+            self.document_cache.put_many(missing_texts, new_vectors)
+            for i, vector in zip(missing, new_vectors):
+                vectors[i] = list(vector)
+        return vectors
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """批量向量化查询，只对未命中缓存的查询调用模型"""
+        if self.query_cache is None:
+            return embed_queries(self.embeddings, texts)
+        vectors = self.query_cache.get_many(texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            new_vectors = embed_queries(self.embeddings, missing_texts)
+            self.query_cache.put_many(missing_texts, new_vectors)
+            for i, vector in zip(missing, new_vectors):
+                vectors[i] = list(vector)
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.query_cache is None:
+            return self.embeddings.embed_query(text)
+        vector = self.query_cache.get_many([text])[0]
+        if vector is None:
+            vector = list(self.embeddings.embed_query(text))
+            self.query_cache.put_many([text], [vector])
+        return vector
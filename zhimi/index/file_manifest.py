@@ -0,0 +1,145 @@
+"""已索引文件清单模块（支持增量重建索引）"""
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+FILE_MANIFEST_FILE = "files.json"
+
+
+def file_sha256(path: Path) -> str:
+    """计算文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FileManifest:
+    """已索引文件清单
+
+    以文件相对文档目录的路径（POSIX 形式）为键，记录来源路径、内容哈希、修改时间、大小以及
+    该文件产生的文本片段 id；增量重建时据此判断文件的增删改，并定位需要从索引中删除的片段。
+    键与 --dir 的写法（data、./data 或绝对路径）无关；未指定文档目录时以文件路径本身为键。
+    """
+
+    def __init__(self, entries: Optional[Dict[str, Dict[str, Any]]] = None, root: Optional[Path] = None):
+        """
+        Args:
+            entries: 已有的清单条目
+            root: 文档目录，清单的键为相对该目录的路径
+        """
+        self.entries: Dict[str, Dict[str, Any]] = entries or {}
+        self.root = Path(root) if root is not None else None
+
+    @classmethod
+    def load(cls, index_dir: str, root: Optional[Path] = None) -> "FileManifest":
+        """从索引目录加载，不存在或损坏时返回空清单"""
+        path = Path(index_dir) / FILE_MANIFEST_FILE
+        if not path.exists():
+            return cls(root=root)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                manifest = cls(json.load(f), root)
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"⚠️ 加载文件清单失败: {e}，将视为全部新增")
+            return cls(root=root)
+        manifest._migrate_legacy_keys()
+        return manifest
+
+    def _migrate_legacy_keys(self) -> None:
+        """旧版清单以 str(路径) 为键且没有来源字段：改为相对文档目录的键，原来的键作为来源路径"""
+        if self.root is None:
+            return
+        root = self.root.resolve()
+        entries = {}
+        for key, entry in self.entries.items():
+            if "source" not in entry:
+                entry["source"] = key
+                try:
+                    key = Path(key).resolve().relative_to(root).as_posix()
+                except ValueError:
+                    pass  # 不在文档目录下的文件保留原键，diff 时视为已删除
+            entries[key] = entry
+        self.entries = entries
+
+    def key(self, path: Path) -> str:
+        """文件在清单中的键"""
+        if self.root is None:
+            return str(path)
+        return Path(path).relative_to(self.root).as_posix()
+
+    def save(self, index_dir: str) -> None:
+        """保存到索引目录（先写临时文件再替换）"""
+        path = Path(index_dir) / FILE_MANIFEST_FILE
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def diff(self, files: List[Path]) -> Tuple[List[Path], List[Path], List[str]]:
+        """
+        对比当前文件与清单
+
+        修改时间和大小均未变化的文件直接视为未变；否则计算内容哈希，
+        哈希一致（仅被 touch 过）时只刷新清单中的修改时间。
+
+        Args:
+            files: 当前扫描到的文件
+
+        Returns:
+            (新增文件, 内容变化的文件, 已删除文件的键)
+        """
+        added, changed = [], []
+        seen = set()
+        for p in files:
+            key = self.key(p)
+            seen.add(key)
+            entry = self.entries.get(key)
+            if entry is None:
+                added.append(p)
+                continue
+            stat = p.stat()
+            if entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+                continue
+            if file_sha256(p) == entry["sha256"]:
+                entry["mtime"] = stat.st_mtime
+                entry["size"] = stat.st_size
+            else:
+                changed.append(p)
+
+        removed = [key for key in self.entries if key not in seen]
+        return added, changed, removed
+
+    def record(self, path: Path, chunk_ids: List[str], doc_count: int) -> None:
+        """记录一个已索引文件"""
+        stat = path.stat()
+        self.entries[self.key(path)] = {
+            "source": str(path),
+            "sha256": file_sha256(path),
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "doc_count": doc_count,
+            "chunk_ids": chunk_ids,
+        }
+
+    def chunk_ids(self, key: str) -> List[str]:
+        """获取某个文件对应的片段 id"""
+        entry = self.entries.get(key)
+        return entry["chunk_ids"] if entry else []
+
+    def remove(self, key: str) -> None:
+        """从清单中移除一个文件"""
+        self.entries.pop(key, None)
+
+    def mtimes(self) -> Dict[str, float]:
+        """来源路径（与片段元数据中的 source 一致）到修改时间的映射"""
+        return {entry.get("source", key): entry["mtime"] for key, entry in self.entries.items()}
+
+    @property
+    def doc_count(self) -> int:
+        """已索引的原始文档数（PDF 按页计）"""
+        return sum(entry["doc_count"] for entry in self.entries.values())
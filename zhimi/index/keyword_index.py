@@ -0,0 +1,135 @@
+"""关键词倒排索引模块（字符 n-gram，适配无空格的中文文本）"""
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from zhimi.index.postings import PostingsBuilder, save_postings, load_postings
+
+KEYWORD_INDEX_NAME = "keyword"
+
+
+def _char_grams(text: str, ngram: int) -> set:
+    """提取文本中所有长度为 1..ngram 的字符片段"""
+    grams = set(text)
+    for n in range(2, ngram + 1):
+        grams.update(text[i:i + n] for i in range(len(text) - n + 1))
+    return grams
+
+
+class KeywordIndex:
+    """关键词倒排索引
+
+    对小写化后的文档文本建立字符 1..n-gram 倒排表。查询词通过其 n-gram
+    倒排表求交得到候选文档，长度超过 n 的查询词再回查原文确认子串命中，
+    因此命中语义与逐文档 ``term in content.lower()`` 完全一致。
+    """
+
+    def __init__(self, terms: List[str], offsets, postings, doc_count: int, ngram: int = 2):
+        self.terms = terms
+        self.vocab = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.postings = postings
+        self.doc_count = doc_count
+        self.ngram = ngram
+
+    @classmethod
+    def build(cls, texts: Iterable[str], ngram: int = 2) -> "KeywordIndex":
+        """
+        从文档文本构建索引
+
+        Args:
+            texts: 按文档序号排列的文本
+            ngram: 最大字符片段长度
+        """
+        builder = PostingsBuilder()
+        for ordinal, text in enumerate(texts):
+            builder.add(ordinal, _char_grams(text.lower(), ngram))
+        terms, arrays = builder.finalize()
+        return cls(terms, arrays["offsets"], arrays["postings"], builder.doc_count, ngram)
+
+    def save(self, index_dir: str) -> None:
+        """保存到索引目录（与 FAISS 文件放在一起）"""
+        save_postings(
+            Path(index_dir),
+            KEYWORD_INDEX_NAME,
+            self.terms,
+            {"offsets": self.offsets, "postings": self.postings},
+            {"ngram": self.ngram, "doc_count": self.doc_count},
+        )
+
+    @classmethod
+    def load(cls, index_dir: str) -> Optional["KeywordIndex"]:
+        """从索引目录加载，不存在时返回 None"""
+        loaded = load_postings(Path(index_dir), KEYWORD_INDEX_NAME)
+        if loaded is None:
+            return None
+        terms, arrays, meta = loaded
+        return cls(terms, arrays["offsets"], arrays["postings"], meta["doc_count"], meta["ngram"])
+
+    def _posting(self, gram: str) -> np.ndarray:
+        """获取单个片段的倒排表"""
+        term_id = self.vocab.get(gram)
+        if term_id is None:
+            return np.empty(0, dtype=np.uint32)
+        return self.postings[self.offsets[term_id]:self.offsets[term_id + 1]]
+
+    def match(self, term: str, get_text: Callable[[int], str], mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        查找包含查询词的文档
+
+        Args:
+            term: 小写化后的查询词
+            get_text: 根据文档序号获取原文的函数（用于长查询词的子串确认）
+            mask: 检索范围位图（长度为文档数，True 表示参与匹配），为 None 时不限范围
+
+        Returns:
+            命中的文档序号（递增）
+        """
+        if not term:
+            ordinals = np.arange(self.doc_count, dtype=np.uint32)
+            return ordinals[mask] if mask is not None else ordinals
+        if len(term) <= self.ngram:
+            posting = np.asarray(self._posting(term))
+            return posting[mask[posting]] if mask is not None else posting
+
+        grams = {term[i:i + self.ngram] for i in range(len(term) - self.ngram + 1)}
+        # 从最短的倒排表开始求交，尽快缩小候选集
+        lists = sorted((self._posting(g) for g in grams), key=len)
+        candidates = np.asarray(lists[0])
+        for posting in lists[1:]:
+            if len(candidates) == 0:
+                break
+            candidates = np.intersect1d(candidates, posting, assume_unique=True)
+        if mask is not None:
+            # 先按范围筛选，再读原文确认子串
+            candidates = candidates[mask[candidates]]
+
+        return np.array(
+            [o for o in candidates if term in get_text(int(o)).lower()],
+            dtype=np.uint32,
+        )
+
+    def search(
+        self, terms: List[str], get_text: Callable[[int], str], k: int = 3, mask: Optional[np.ndarray] = None
+    ) -> List[Tuple[int, int]]:
+        """
+        按命中关键词数量排序检索
+
+        Args:
+            terms: 小写化后的查询词列表
+            get_text: 根据文档序号获取原文的函数
+            k: 返回数量
+            mask: 检索范围位图，为 None 时不限范围
+
+        Returns:
+            [(文档序号, 命中关键词数), ...]，命中数相同按文档序号排列
+        """
+        matched = [self.match(term, get_text, mask) for term in terms]
+        matched = [m for m in matched if len(m)]
+        if not matched:
+            return []
+
+        ordinals, counts = np.unique(np.concatenate(matched), return_counts=True)
+        top = np.lexsort((ordinals, -counts))[:k]
+        return [(int(ordinals[i]), int(counts[i])) for i in top]
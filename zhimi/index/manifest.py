@@ -0,0 +1,84 @@
+"""索引清单模块（记录索引构建参数，保证查询端与索引端一致）"""
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_FORMAT_VERSION = 1
+# 未写入清单的旧版索引均由索引脚本使用该模型构建
+DEFAULT_EMBED_MODEL = "BAAI/bge-small-zh-v1.5"
+
+
+def build_manifest(
+    embed_model: str,
+    dimension: int,
+    normalize: bool,
+    chunk_size: int,
+    chunk_overlap: int,
+    separators: List[str],
+    doc_count: int,
+    chunk_count: int,
+    ann: Optional[Dict[str, Any]] = None,
+    tokenizer: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    构建索引清单
+
+    Args:
+        embed_model: 嵌入模型名称
+        dimension: 向量维度
+        normalize: 是否归一化向量
+        chunk_size: 分块大小
+        chunk_overlap: 分块重叠长度
+        separators: 分块分隔符
+        doc_count: 原始文档数量
+        chunk_count: 文本片段数量
+        ann: 近似索引类型及构建参数，为 None 时表示只有精确的平面索引
+        tokenizer: BM25 使用的分词器描述（名称、停用词表摘要）
+
+    Returns:
+        清单字典
+    """
+    return {
+        "format_version": MANIFEST_FORMAT_VERSION,
+        "built_at": datetime.now().isoformat(),
+        "embedding": {
+            "model": embed_model,
+            "dimension": dimension,
+            "normalize": normalize,
+        },
+        "chunking": {
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+            "separators": separators,
+        },
+        "ann": ann or {"type": "flat"},
+        "tokenizer": tokenizer,
+        "doc_count": doc_count,
+        "chunk_count": chunk_count,
+    }
+
+
+def save_manifest(index_dir: str, manifest: Dict[str, Any]) -> None:
+    """保存索引清单（先写临时文件再替换，避免读到半个文件）"""
+    path = Path(index_dir) / MANIFEST_FILE
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_manifest(index_dir: str) -> Optional[Dict[str, Any]]:
+    """加载索引清单，不存在或损坏时返回 None"""
+    path = Path(index_dir) / MANIFEST_FILE
+    if not path.exists():
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (json.JSONDecodeError, IOError) as e:
+        print(f"⚠️ 加载索引清单失败: {e}")
+        return None
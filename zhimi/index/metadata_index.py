@@ -0,0 +1,203 @@
+"""片段元数据索引模块（按来源路径、文件类型、修改日期过滤检索范围）"""
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path, PurePath
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+METADATA_INDEX_NAME = "metadata"
+# 缓存的过滤位图数量（同一范围的查询往往连续出现）
+MASK_CACHE_SIZE = 64
+
+
+class MetadataFilter(NamedTuple):
+    """检索范围过滤条件，各条件同时满足；均为 None 时不过滤
+
+    collections 选择检索的知识库集合，由集合注册表处理；其余条件作用于集合内的片段元数据。
+    """
+    path_prefix: Optional[str] = None
+    file_types: Optional[Tuple[str, ...]] = None
+    modified_after: Optional[float] = None
+    modified_before: Optional[float] = None
+    collections: Optional[Tuple[str, ...]] = None
+
+    @classmethod
+    def parse(
+        cls,
+        path_prefix: Optional[str] = None,
+        file_type: Optional[str] = None,
+        modified_after: Optional[str] = None,
+        modified_before: Optional[str] = None,
+        collection: Optional[str] = None,
+    ) -> "MetadataFilter":
+        """
+        从工具参数构建过滤条件
+
+        Args:
+            path_prefix: 路径前缀（目录或文件名，按路径分段匹配）
+            file_type: 逗号分隔的文件类型，如 "pdf,md"
+            modified_after: 修改日期下限（含），ISO 格式，如 "2024-01-01"
+            modified_before: 修改日期上限（不含），ISO 格式
+            collection: 逗号分隔的知识库集合名
+
+        Raises:
+            ValueError: 日期格式无效
+        """
+        file_types = None
+        if file_type:
+            file_types = tuple(sorted({t.strip().lower().lstrip(".") for t in file_type.split(",") if t.strip()})) or None
+        collections = None
+        if collection:
+            collections = tuple(sorted({name.strip() for name in collection.split(",") if name.strip()})) or None
+        return cls(
+            path_prefix=(path_prefix.strip() or None) if path_prefix else None,
+            file_types=file_types,
+            modified_after=datetime.fromisoformat(modified_after).timestamp() if modified_after else None,
+            modified_before=datetime.fromisoformat(modified_before).timestamp() if modified_before else None,
+            collections=collections,
+        )
+
+    def is_empty(self) -> bool:
+        return all(value is None for value in self)
+
+    def filters_metadata(self) -> bool:
+        """是否包含作用于片段元数据的条件（不计集合选择）"""
+        return not self._replace(collections=None).is_empty()
+
+
+def _path_parts(path: str) -> Tuple[str, ...]:
+    return tuple(part for part in PurePath(path.replace("\\", "/")).parts if part not in (".", "/"))
+
+
+def _matches_prefix(source_parts: Tuple[str, ...], prefix_parts: Tuple[str, ...]) -> bool:
+    """前缀的各段与来源路径中连续的若干段一致（允许省略数据目录等上层目录）"""
+    n = len(prefix_parts)
+    return any(source_parts[i:i + n] == prefix_parts for i in range(len(source_parts) - n + 1))
+
+
+class MetadataIndex:
+    """片段元数据索引
+
+    索引时记录每个来源文件的路径、类型和修改时间（metadata.json），以及每个片段所属的来源编号
+    （metadata_sources.npy，查询端内存映射）。过滤时先在来源粒度求值，再按来源编号展开成
+    片段位图，供向量检索和 BM25 在打分前限定范围。
+    """
+
+    def __init__(self, sources: List[Dict], chunk_sources: np.ndarray):
+        """
+        Args:
+            sources: 来源文件列表，每项包含 path、type、mtime
+            chunk_sources: 每个片段（按向量序号）所属的来源编号
+        """
+        self.sources = sources
+        self.chunk_sources = chunk_sources
+        self._source_parts = [_path_parts(source["path"]) for source in sources]
+        self._types = np.array([source["type"] for source in sources], dtype=object)
+        self._mtimes = np.array([source["mtime"] for source in sources], dtype=np.float64)
+        self._masks: "OrderedDict[MetadataFilter, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def doc_count(self) -> int:
+        return len(self.chunk_sources)
+
+    @staticmethod
+    def _paths(index_dir: str) -> Tuple[Path, Path]:
+        return Path(index_dir) / f"{METADATA_INDEX_NAME}.json", Path(index_dir) / f"{METADATA_INDEX_NAME}_sources.npy"
+
+    @classmethod
+    def build(cls, docs: Iterable[Document], mtimes: Optional[Dict[str, float]] = None) -> "MetadataIndex":
+        """
+        从按向量序号排列的片段构建
+
+        Args:
+            docs: 文档片段
+            mtimes: 来源路径到修改时间的映射（如文件清单中的记录），缺失时读取文件当前的修改时间
+        """
+        mtimes = mtimes or {}
+        source_ids: Dict[str, int] = {}
+        sources = []
+        chunk_sources = []
+        for doc in docs:
+            path = str(doc.metadata.get("source", ""))
+            if path not in source_ids:
+                mtime = mtimes.get(path)
+                if mtime is None:
+                    try:
+                        mtime = os.path.getmtime(path)
+                    except OSError:
+                        # 修改时间未知的来源不满足任何日期条件
+                        mtime = math.nan
+                source_ids[path] = len(sources)
+                sources.append({"path": path, "type": Path(path).suffix.lower().lstrip("."), "mtime": mtime})
+            chunk_sources.append(source_ids[path])
+        return cls(sources, np.asarray(chunk_sources, dtype=np.int32))
+
+    def save(self, index_dir: str) -> None:
+        """保存到索引目录（先写临时文件再替换）"""
+        meta_path, sources_path = self._paths(index_dir)
+        meta_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_sources_path = sources_path.with_suffix(".npy.tmp")
+        with open(tmp_sources_path, "wb") as f:
+            np.save(f, np.asarray(self.chunk_sources, dtype=np.int32))
+        tmp_meta_path = meta_path.with_suffix(".json.tmp")
+        with open(tmp_meta_path, "w", encoding="utf-8") as f:
+            # NaN 不是合法 JSON，未知修改时间写为 null
+            sources = [{**source, "mtime": None if math.isnan(source["mtime"]) else source["mtime"]} for source in self.sources]
+            json.dump({"sources": sources}, f, ensure_ascii=False)
+        os.replace(tmp_sources_path, sources_path)
+        os.replace(tmp_meta_path, meta_path)
+
+    @classmethod
+    def load(cls, index_dir: str) -> Optional["MetadataIndex"]:
+        """从索引目录加载（片段来源编号内存映射），不存在时返回 None"""
+        meta_path, sources_path = cls._paths(index_dir)
+        if not (meta_path.exists() and sources_path.exists()):
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            sources = json.load(f)["sources"]
+        for source in sources:
+            source["mtime"] = math.nan if source["mtime"] is None else source["mtime"]
+        return cls(sources, np.load(sources_path, mmap_mode="r"))
+
+    def _source_mask(self, metadata_filter: MetadataFilter) -> np.ndarray:
+        """在来源粒度求值过滤条件"""
+        mask = np.ones(len(self.sources), dtype=bool)
+        if metadata_filter.path_prefix:
+            prefix_parts = _path_parts(metadata_filter.path_prefix)
+            mask &= np.array([_matches_prefix(parts, prefix_parts) for parts in self._source_parts], dtype=bool)
+        if metadata_filter.file_types:
+            mask &= np.isin(self._types, list(metadata_filter.file_types))
+        with np.errstate(invalid="ignore"):
+            if metadata_filter.modified_after is not None:
+                mask &= self._mtimes >= metadata_filter.modified_after
+            if metadata_filter.modified_before is not None:
+                mask &= self._mtimes < metadata_filter.modified_before
+        return mask
+
+    def mask(self, metadata_filter: MetadataFilter) -> np.ndarray:
+        """
+        计算过滤位图
+
+        Returns:
+            长度为片段数的布尔数组，True 表示该片段在检索范围内
+        """
+        # 集合选择不影响集合内的位图
+        metadata_filter = metadata_filter._replace(collections=None)
+        with self._lock:
+            mask = self._masks.get(metadata_filter)
+            if mask is not None:
+                self._masks.move_to_end(metadata_filter)
+                return mask
+        mask = self._source_mask(metadata_filter)[np.asarray(self.chunk_sources)]
+        with self._lock:
+            self._masks[metadata_filter] = mask
+            while len(self._masks) > MASK_CACHE_SIZE:
+                self._masks.popitem(last=False)
+        return mask
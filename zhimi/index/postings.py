@@ -0,0 +1,111 @@
+"""倒排表构建与存储模块（CSR 紧凑格式）"""
+import json
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+class PostingsBuilder:
+    """倒排表构建器
+
+    逐个文档追加词项，最终按词项聚合成 CSR 格式：
+    offsets[i]:offsets[i+1] 即为第 i 个词项在 postings 中的区间，
+    区间内的文档序号（ordinal）严格递增。
+    可选地为每条倒排记录附带一个整数值（如词频）。
+    """
+
+    def __init__(self, with_values: bool = False):
+        self.with_values = with_values
+        self.vocab: Dict[str, int] = {}
+        self.doc_count = 0
+        self._term_ids = array("I")
+        self._doc_ids = array("I")
+        self._values = array("I")
+
+    def add(self, ordinal: int, terms: Iterable[str], values: Optional[Iterable[int]] = None) -> None:
+        """
+        添加一个文档的词项集合
+
+        Args:
+            ordinal: 文档序号（必须按递增顺序添加）
+            terms: 文档包含的词项（需已去重）
+            values: 与 terms 一一对应的整数值（仅 with_values=True 时使用）
+        """
+        vocab = self.vocab
+        term_ids = [vocab.setdefault(term, len(vocab)) for term in terms]
+        self._term_ids.extend(term_ids)
+        self._doc_ids.extend([ordinal] * len(term_ids))
+        if self.with_values:
+            self._values.extend(values)
+        self.doc_count = max(self.doc_count, ordinal + 1)
+
+    def finalize(self) -> Tuple[List[str], Dict[str, np.ndarray]]:
+        """
+        聚合为 CSR 格式
+
+        Returns:
+            (词项列表, {"offsets", "postings"[, "values"]} 数组字典)
+        """
+        terms = [""] * len(self.vocab)
+        for term, term_id in self.vocab.items():
+            terms[term_id] = term
+
+        term_ids = np.frombuffer(self._term_ids, dtype=np.uint32)
+        # 稳定排序保证同一词项下文档序号保持递增
+        order = np.argsort(term_ids, kind="stable")
+
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(terms)), out=offsets[1:])
+        arrays = {
+            "offsets": offsets,
+            "postings": np.frombuffer(self._doc_ids, dtype=np.uint32)[order],
+        }
+        if self.with_values:
+            arrays["values"] = np.frombuffer(self._values, dtype=np.uint32)[order]
+        return terms, arrays
+
+
+def save_postings(
+    index_dir: Path,
+    name: str,
+    terms: List[str],
+    arrays: Dict[str, np.ndarray],
+    meta: Dict,
+) -> None:
+    """
+    保存倒排表到索引目录
+
+    生成 {name}_vocab.json（词项与元信息）以及每个数组对应的 {name}_{key}.npy
+    """
+    index_dir = Path(index_dir)
+    index_dir.mkdir(parents=True, exist_ok=True)
+    for key, values in arrays.items():
+        np.save(index_dir / f"{name}_{key}.npy", values)
+    with open(index_dir / f"{name}_vocab.json", "w", encoding="utf-8") as f:
+        json.dump({**meta, "arrays": list(arrays), "terms": terms}, f, ensure_ascii=False)
+
+
+def load_postings(
+    index_dir: Path, name: str
+) -> Optional[Tuple[List[str], Dict[str, np.ndarray], Dict]]:
+    """
+    加载倒排表（数组以只读内存映射方式打开）
+
+    Returns:
+        (词项列表, 数组字典, 元信息)，文件不存在时返回 None
+    """
+    index_dir = Path(index_dir)
+    vocab_path = index_dir / f"{name}_vocab.json"
+    if not vocab_path.exists():
+        return None
+
+    with open(vocab_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    terms = meta.pop("terms")
+    arrays = {
+        key: np.load(index_dir / f"{name}_{key}.npy", mmap_mode="r")
+        for key in meta.pop("arrays")
+    }
+    return terms, arrays, meta
@@ -0,0 +1,134 @@
+"""分词模块（BM25 与关键词检索共用；分词器名称随索引保存，查询时使用同一分词器）"""
+import hashlib
+import os
+import re
+import threading
+from functools import lru_cache
+from typing import Callable, Dict, FrozenSet, Iterable, List, Tuple
+
+# bigram：中文按停用字切段后取相邻二字组合，英文数字按词；jieba：词典分词（需安装 jieba）；
+# whitespace：按空白切分，与旧版索引（BM25Retriever 默认分词）一致
+TOKENIZERS = ["bigram", "jieba", "whitespace"]
+DEFAULT_TOKENIZER = os.getenv("INDEX_TOKENIZER", "bigram")
+# 查询分词结果的缓存条数（同一查询在多个分片、多路检索中只分词一次）
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 10000))
+
+# 中文文本的切分点：几乎不出现在实词内部的虚词（避免产生“识的”“的检”这类跨词组合）
+STOP_CHARS = frozenset("的了和与及或吗呢吧啊")
+# 停用词：不作为词项（单字只在切分后单独成段时出现）
+STOPWORDS = STOP_CHARS | frozenset("是在而也就都把被让给对从向于以之其这那你我他她它们个么着过") | frozenset([
+    "一个", "一些", "我们", "你们", "他们", "她们", "它们", "这个", "那个", "这些", "那些", "什么", "怎么",
+    "如何", "为什么", "哪些", "可以", "因为", "所以", "但是", "如果", "以及", "还是", "或者", "然后", "已经",
+    "a", "an", "the", "of", "to", "in", "on", "for", "and", "or", "is", "are", "was", "were", "be",
+    "by", "with", "at", "as", "it", "this", "that", "from",
+])
+
+_CJK = "㐀-䶿一-鿿豈-﫿"
+_TOKEN_RE = re.compile(rf"[{_CJK}]+|[a-z0-9]+(?:[._+\-][a-z0-9]+)*")
+_STOP_SPLIT_RE = re.compile("[" + "".join(sorted(STOP_CHARS)) + "]+")
+_WORD_RE = re.compile(rf"[{_CJK}a-z0-9]")
+
+
+def _bigram_segment(text: str) -> Iterable[str]:
+    """中文连续段按停用字切开后取二字组合（单字段保留单字），英文数字按词"""
+    for match in _TOKEN_RE.finditer(text):
+        token = match.group()
+        if token.isascii():
+            yield token
+            continue
+        for segment in _STOP_SPLIT_RE.split(token):
+            if len(segment) == 1:
+                yield segment
+            else:
+                yield from (segment[i:i + 2] for i in range(len(segment) - 1))
+
+
+def _jieba_segment() -> Callable[[str], Iterable[str]]:
+    try:
+        import jieba
+    except ImportError:
+        raise ImportError("jieba 分词器需要安装 jieba（pip install jieba）")
+    jieba.setLogLevel(60)
+    # 搜索引擎模式：长词同时输出其中的短词，提高召回
+    return lambda text: (token for token in jieba.lcut_for_search(text) if _WORD_RE.search(token))
+
+
+class Tokenizer:
+    """分词器
+
+    索引时对每个片段调用 tokenize（结果写入 BM25 倒排表，查询时无需再对片段分词）；
+    查询时调用实例本身，结果按查询文本缓存。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        segment: Callable[[str], Iterable[str]],
+        stopwords: FrozenSet[str] = STOPWORDS,
+        lowercase: bool = True,
+        cache_size: int = TOKEN_CACHE_SIZE,
+    ):
+        self.name = name
+        self.segment = segment
+        self.stopwords = stopwords
+        self.lowercase = lowercase
+        self._cached = lru_cache(maxsize=cache_size)(self._tokenize)
+
+    @property
+    def stopwords_digest(self) -> str:
+        """停用词表摘要（记录在索引中，停用词表变化后可提示重建）"""
+        return hashlib.sha256("\n".join(sorted(self.stopwords)).encode("utf-8")).hexdigest()[:12]
+
+    def describe(self) -> Dict:
+        """写入索引清单的分词器描述"""
+        return {"name": self.name, "stopwords": self.stopwords_digest}
+
+    def _tokenize(self, text: str) -> Tuple[str, ...]:
+        if self.lowercase:
+            text = text.lower()
+        return tuple(token for token in self.segment(text) if token not in self.stopwords)
+
+    def tokenize(self, text: str) -> List[str]:
+        """分词（不经过缓存，供索引时逐片段调用）"""
+        return list(self._tokenize(text))
+
+    def __call__(self, text: str) -> List[str]:
+        """分词（按文本缓存，供查询时调用）"""
+        return list(self._cached(text))
+
+
+_tokenizers: Dict[str, Tokenizer] = {}
+_tokenizers_lock = threading.Lock()
+
+
+def get_tokenizer(name: str = DEFAULT_TOKENIZER) -> Tokenizer:
+    """
+    获取分词器（同名分词器共享一个实例和查询缓存）
+
+    Raises:
+        ValueError: 不支持的分词器名称
+        ImportError: 分词器依赖未安装
+    """
+    with _tokenizers_lock:
+        tokenizer = _tokenizers.get(name)
+        if tokenizer is None:
+            if name == "bigram":
+                tokenizer = Tokenizer(name, _bigram_segment)
+            elif name == "jieba":
+                tokenizer = Tokenizer(name, _jieba_segment())
+            elif name == "whitespace":
+                tokenizer = Tokenizer(name, str.split, stopwords=frozenset(), lowercase=False)
+            else:
+                raise ValueError(f"不支持的分词器: {name}，可选: {', '.join(TOKENIZERS)}")
+            _tokenizers[name] = tokenizer
+        return tokenizer
+
+
+@lru_cache(maxsize=None)
+def default_tokenizer() -> Tokenizer:
+    """配置的默认分词器，依赖未安装时退回 bigram（只提示一次）"""
+    try:
+        return get_tokenizer(DEFAULT_TOKENIZER)
+    except ImportError as e:
+        print(f"⚠️ {e}，改用 bigram 分词")
+        return get_tokenizer("bigram")
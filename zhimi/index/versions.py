@@ -0,0 +1,70 @@
+"""索引版本模块（版本化索引目录与原子发布）"""
+import os
+import shutil
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+# 布局：<索引目录>/versions/<版本号>/ 存放一次构建的全部索引文件，<索引目录>/CURRENT 记录当前版本号
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+# 发布新版本后保留的旧版本数（仍在旧版本上执行的查询可以正常结束）
+KEEP_VERSIONS = int(os.getenv("INDEX_KEEP_VERSIONS", 2))
+
+
+def current_version(index_dir: str) -> Optional[str]:
+    """当前发布的版本号，未使用版本化布局时返回 None"""
+    try:
+        return (Path(index_dir) / CURRENT_FILE).read_text(encoding="utf-8").strip() or None
+    except OSError:
+        return None
+
+
+def resolve_index_dir(index_dir: str) -> str:
+    """
+    解析实际读取的索引目录
+
+    Returns:
+        当前版本的目录；未使用版本化布局（旧版索引直接存放在索引目录下）时返回 index_dir 本身
+    """
+    version = current_version(index_dir)
+    if version is None:
+        return str(index_dir)
+    return str(Path(index_dir) / VERSIONS_DIR / version)
+
+
+def new_version_dir(index_dir: str) -> str:
+    """创建一个新的版本目录（版本号按构建时间排序）"""
+    version = f"{datetime.now():%Y%m%d-%H%M%S-%f}-{uuid.uuid4().hex[:8]}"
+    path = Path(index_dir) / VERSIONS_DIR / version
+    path.mkdir(parents=True)
+    return str(path)
+
+
+def publish_version(index_dir: str, version_dir: str, keep: int = KEEP_VERSIONS) -> None:
+    """
+    原子发布版本：先写临时文件再替换 CURRENT，读取方要么看到旧版本、要么看到新版本
+
+    发布后删除索引目录下旧版布局遗留的索引文件，以及超出保留数的旧版本。
+    已打开的文件在 POSIX 系统上删除后仍可读取，正在执行的查询不受影响。
+
+    Args:
+        index_dir: 索引目录
+        version_dir: new_version_dir 创建并已写完全部文件的版本目录
+        keep: 保留的旧版本数
+    """
+    version = Path(version_dir).name
+    tmp_path = Path(index_dir) / f"{CURRENT_FILE}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, Path(index_dir) / CURRENT_FILE)
+
+    for path in Path(index_dir).iterdir():
+        if path.is_file() and path.name != CURRENT_FILE:
+            path.unlink(missing_ok=True)
+    old_versions = sorted(p for p in (Path(index_dir) / VERSIONS_DIR).iterdir() if p.name != version)
+    for path in old_versions[:max(len(old_versions) - keep, 0)]:
+        shutil.rmtree(path, ignore_errors=True)
@@ -1,29 +1,117 @@
 # zhimi/llm.py
+import asyncio
 import os
+import threading
+from functools import lru_cache
+from typing import Dict, Tuple
+
+import httpx
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 from langchain_core.language_models.chat_models import BaseChatModel
 
+from zhimi.models import DEFAULT_MODEL
+
 load_dotenv()
 
-# 默认使用硅基流动上的 Qwen2.5-7B-Instruct
-DEFAULT_MODEL = "Qwen2.5-7B-Instruct"
 SILICONFLOW_BASE_URL = "https://api.siliconflow.cn/v1"
+DEFAULT_TEMPERATURE = 0.2
+# HTTP 连接池（进程内所有 LLM 客户端共用）：最大连接数、最多保留的空闲长连接数及空闲保留时间（秒）
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 20))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", 10))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", 60))
+# 单次请求超时（秒）
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))
+
+# LLM 客户端注册表：按（模型, 温度, 接口地址）共享实例
+_llm_clients: Dict[Tuple[str, float, str], ChatOpenAI] = {}
+_llm_clients_lock = threading.Lock()
+
+
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+    )
+
+
+@lru_cache(maxsize=None)
+def get_http_client() -> httpx.Client:
+    """进程内共享的同步 HTTP 客户端（连接复用，避免重复 TLS 握手）"""
+    return httpx.Client(limits=_http_limits(), timeout=LLM_TIMEOUT)
+
+
+class LoopLocalAsyncClient(httpx.AsyncClient):
+    """
+    按事件循环分别持有连接池的异步 HTTP 客户端
+
+    httpx 的异步连接绑定在创建它的事件循环上，跨循环复用会报 "Event loop is closed"。
+    请求按当前运行的事件循环转发给各自的内部客户端：llm_event_loop() 上的调用长期复用同一个连接池，
+    调用方自己的事件循环（如多次 asyncio.run 调用 astream_agent / ainvoke）也各用各的连接。
+    自身只负责构造请求，不建立连接池（传输层为空实现，也不按环境变量创建代理传输）。
+    """
+
+    def __init__(self, **kwargs):
+        # 基类只需要构造请求时使用的超时设置
+        base_kwargs = {"timeout": kwargs["timeout"]} if "timeout" in kwargs else {}
+        super().__init__(transport=httpx.AsyncBaseTransport(), trust_env=False, **base_kwargs)
+        self._client_kwargs = kwargs
+        self._loop_clients: Dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+        self._loop_clients_lock = threading.Lock()
 
+    def _loop_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        with self._loop_clients_lock:
+            # 已关闭的事件循环上的连接不能再用，直接丢弃
+            for closed in [other for other in self._loop_clients if other.is_closed()]:
+                del self._loop_clients[closed]
+            client = self._loop_clients.get(loop)
+            if client is None:
+                client = self._loop_clients[loop] = httpx.AsyncClient(**self._client_kwargs)
+            return client
 
-def get_llm(model_name: str = None) -> BaseChatModel:
+    async def send(self, request: httpx.Request, **kwargs) -> httpx.Response:
+        return await self._loop_client().send(request, **kwargs)
+
+    async def aclose(self) -> None:
+        """关闭当前事件循环上的连接"""
+        with self._loop_clients_lock:
+            client = self._loop_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+@lru_cache(maxsize=None)
+def get_async_http_client() -> httpx.AsyncClient:
+    """进程内共享的异步 HTTP 客户端（每个事件循环各自复用连接）"""
+    return LoopLocalAsyncClient(limits=_http_limits(), timeout=LLM_TIMEOUT)
+
+
+@lru_cache(maxsize=None)
+def llm_event_loop() -> asyncio.AbstractEventLoop:
+    """进程内常驻的事件循环（在后台线程中运行），同步代码通过 asyncio.run_coroutine_threadsafe 提交异步调用"""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="llm_event_loop", daemon=True).start()
+    return loop
+
+
+def get_llm(model_name: str = None, temperature: float = DEFAULT_TEMPERATURE, base_url: str = None) -> BaseChatModel:
     """获取LLM实例（使用硅基流动 OpenAI 兼容接口）
-    
+
     Args:
         model_name: 可选，自定义模型名称；不传则优先用环境变量 LLM_MODEL，其次用默认模型
-    
+        temperature: 采样温度
+        base_url: 可选，接口地址；不传则优先用环境变量 LLM_BASE_URL，其次用硅基流动地址
+
     Returns:
         BaseChatModel: LangChain ChatModel 实例（ChatOpenAI 封装的硅基流动模型）
-    
+
     Note:
         - 需要配置 SILICONFLOW_API_KEY 环境变量
         - 默认模型：Qwen/Qwen2.5-7B-Instruct（硅基流动免费模型）
         - 硅基流动控制台：https://cloud.siliconflow.cn/
+        - 相同（模型, 温度, 接口地址）返回同一个实例，所有实例共用同一个 HTTP 连接池
     """
     api_key = os.getenv("SILICONFLOW_API_KEY")
     if not api_key:
@@ -31,16 +119,25 @@ def get_llm(model_name: str = None) -> BaseChatModel:
             "未找到 SILICONFLOW_API_KEY，请在 .env 文件中配置。\n"
             "硅基流动控制台：https://cloud.siliconflow.cn/"
         )
-    
+
     # 确定模型名称：参数 > 环境变量 > 默认值
     if model_name:
         selected_model = model_name
     else:
         selected_model = os.getenv("LLM_MODEL", DEFAULT_MODEL)
-    
-    return ChatOpenAI(
-        model=selected_model,
-        api_key=api_key,
-        base_url=SILICONFLOW_BASE_URL,
-        temperature=0.2,
-    )
\ No newline at end of file
+    base_url = base_url or os.getenv("LLM_BASE_URL", SILICONFLOW_BASE_URL)
+
+    key = (selected_model, float(temperature), base_url)
+    with _llm_clients_lock:
+        llm = _llm_clients.get(key)
+        if llm is None:
+            llm = ChatOpenAI(
+                model=selected_model,
+                api_key=api_key,
+                base_url=base_url,
+                temperature=temperature,
+                http_client=get_http_client(),
+                http_async_client=get_async_http_client(),
+            )
+            _llm_clients[key] = llm
+        return llm
@@ -2,6 +2,7 @@
 from zhimi.memory.user_memory import UserMemory
 from zhimi.memory.memory_storage import UserMemoryStorage
 from zhimi.memory.memory_extractor import MemoryExtractor
+from zhimi.memory.memory_worker import MemoryExtractionWorker
 
-__all__ = ["UserMemory", "UserMemoryStorage", "MemoryExtractor"]
+__all__ = ["UserMemory", "UserMemoryStorage", "MemoryExtractor", "MemoryExtractionWorker"]
 
@@ -1,10 +1,14 @@
 """用户记忆存储模块"""
 import json
 import os
+import threading
 from pathlib import Path
 from typing import Dict, Any, Optional
 from datetime import datetime
 
+# 所有用户的记忆保存在同一个文件中，读-改-写需要串行（后台提取线程与界面线程可能同时写入）
+_write_lock = threading.RLock()
+
 
 class UserMemoryStorage:
     """用户记忆存储类（JSON文件存储）"""
@@ -56,6 +60,10 @@ class UserMemoryStorage:
         Returns:
             是否保存成功
         """
+        with _write_lock:
+            return self._save_memory(user_id, memory)
+    
+    def _save_memory(self, user_id: str, memory: Dict[str, Any]) -> bool:
         try:
             # 加载所有用户数据
             all_data = {}
@@ -72,9 +80,11 @@ class UserMemoryStorage:
             # 更新该用户的记忆
             all_data[user_id] = memory
             
-            # 保存到文件
-            with open(self.storage_path, "w", encoding="utf-8") as f:
+            # 先写临时文件再替换，读取方不会读到写了一半的文件
+            tmp_path = self.storage_path.with_name(self.storage_path.name + ".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
                 json.dump(all_data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.storage_path)
             
             return True
         except IOError as e:
@@ -92,12 +102,13 @@ class UserMemoryStorage:
         Returns:
             是否更新成功
         """
-        current_memory = self.load_memory(user_id)
-        
-        # 深度合并更新
-        self._deep_merge(current_memory, memory_updates)
-        
-        return self.save_memory(user_id, current_memory)
+        with _write_lock:
+            current_memory = self.load_memory(user_id)
+            
+            # 深度合并更新
+            self._deep_merge(current_memory, memory_updates)
+            
+            return self.save_memory(user_id, current_memory)
     
     def _deep_merge(self, base: Dict, updates: Dict) -> None:
         """深度合并字典"""
@@ -0,0 +1,90 @@
+"""用户记忆后台提取模块（记忆提取不占用对话回合的响应时间）"""
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from zhimi.memory.user_memory import UserMemory
+
+# 同一用户两次提取之间的最短间隔（秒），间隔内提交的请求合并到下一次提取
+MEMORY_EXTRACT_INTERVAL = float(os.getenv("MEMORY_EXTRACT_INTERVAL", 30))
+
+
+class MemoryExtractionWorker:
+    """
+    记忆提取后台线程
+
+    - 合并：同一用户尚未执行的提取请求只保留最新的一份对话
+    - 限流：同一用户两次提取至少间隔 interval 秒
+    - 单线程依次执行，提取结果通过 UserMemory 写回存储并使其缓存失效
+    """
+
+    def __init__(self, get_memory: Callable[[str], UserMemory], interval: float = MEMORY_EXTRACT_INTERVAL):
+        """
+        Args:
+            get_memory: 按用户ID获取 UserMemory 实例
+            interval: 同一用户两次提取之间的最短间隔（秒）
+        """
+        self.get_memory = get_memory
+        self.interval = interval
+        self._pending: Dict[str, List[Any]] = {}
+        self._last_run: Dict[str, float] = {}
+        self._running: Optional[str] = None
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, user_id: str, messages: List[Any]) -> None:
+        """提交一次提取请求（立即返回；覆盖该用户尚未执行的请求）"""
+        with self._condition:
+            self._pending[user_id] = list(messages)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="memory_extraction", daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+
+    def pending(self) -> List[str]:
+        """尚未执行提取的用户"""
+        with self._condition:
+            return list(self._pending)
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待全部请求执行完毕（供测试和退出前调用；限流等待期间也会一直阻塞）
+
+        Returns:
+            超时前是否已全部执行完毕
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending and self._running is None, timeout)
+
+    def _next_due(self) -> Optional[Tuple[str, float]]:
+        """返回（最早可以执行的用户, 需要等待的秒数）"""
+        now = time.monotonic()
+        due = [
+            (self._last_run.get(user_id, float("-inf")) + self.interval - now, user_id)
+            for user_id in self._pending
+        ]
+        if not due:
+            return None
+        wait, user_id = min(due)
+        return user_id, max(wait, 0.0)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                next_due = self._next_due()
+                while next_due is None or next_due[1] > 0:
+                    self._condition.wait(None if next_due is None else next_due[1])
+                    next_due = self._next_due()
+                user_id = next_due[0]
+                messages = self._pending.pop(user_id)
+                self._running = user_id
+                self._last_run[user_id] = time.monotonic()
+            try:
+                self.get_memory(user_id).update_from_messages(messages)
+            except Exception as e:
+                print(f"⚠️ 用户 {user_id} 的记忆提取失败: {e}")
+            finally:
+                with self._condition:
+                    self._running = None
+                    self._condition.notify_all()
@@ -1,4 +1,5 @@
 """用户记忆管理模块"""
+import threading
 from typing import Dict, Any, List, Optional
 from zhimi.memory.memory_storage import UserMemoryStorage
 from zhimi.memory.memory_extractor import MemoryExtractor
@@ -19,15 +20,36 @@ class UserMemory:
         self.storage = UserMemoryStorage(storage_path)
         self.extractor = MemoryExtractor()
         self._memory_cache: Optional[Dict[str, Any]] = None
+        # 记忆摘要缓存（Agent 每次调用都会读取，与 _memory_cache 同时失效）
+        self._summary_cache: Optional[str] = None
+        # 缓存代数：每次失效加一。读取方在锁外加载或格式化，写回缓存前检查代数未变，
+        # 后台提取线程在此期间使缓存失效时丢弃这份可能过期的结果
+        self._generation = 0
+        self._cache_lock = threading.Lock()
     
     def load(self) -> Dict[str, Any]:
         """加载用户记忆"""
-        if self._memory_cache is None:
-            self._memory_cache = self.storage.load_memory(self.user_id)
-        return self._memory_cache
+        with self._cache_lock:
+            memory, generation = self._memory_cache, self._generation
+        if memory is None:
+            memory = self.storage.load_memory(self.user_id)
+            with self._cache_lock:
+                if self._generation == generation:
+                    self._memory_cache = memory
+        return memory
+    
+    def invalidate(self) -> None:
+        """清除缓存，下次读取时重新加载记忆"""
+        with self._cache_lock:
+            self._generation += 1
+            self._memory_cache = None
+            self._summary_cache = None
     
     def save(self) -> bool:
         """保存用户记忆"""
+        with self._cache_lock:
+            self._generation += 1
+            self._summary_cache = None
         if self._memory_cache is not None:
             success = self.storage.save_memory(self.user_id, self._memory_cache)
             if success:
@@ -95,7 +117,7 @@ class UserMemory:
         memory = self.load()
         success = self.storage.update_memory(self.user_id, memory_updates)
         if success:
-            self._memory_cache = None  # 清除缓存，下次加载最新数据
+            self.invalidate()  # 清除缓存，下次加载最新数据
         return success
     
     def get_memory_summary(self) -> str:
@@ -105,7 +127,17 @@ class UserMemory:
         Returns:
             格式化的记忆摘要文本
         """
-        memory = self.load()
+        with self._cache_lock:
+            summary, generation = self._summary_cache, self._generation
+        if summary is None:
+            summary = self._format_summary(self.load())
+            with self._cache_lock:
+                if self._generation == generation:
+                    self._summary_cache = summary
+        return summary
+    
+    def _format_summary(self, memory: Dict[str, Any]) -> str:
+        """将记忆格式化为摘要文本"""
         
         summary_parts = []
         
@@ -155,7 +187,7 @@ class UserMemory:
         """清空用户记忆"""
         success = self.storage.clear_memory(self.user_id)
         if success:
-            self._memory_cache = None
+            self.invalidate()
         return success
     
     def get_all(self) -> Dict[str, Any]:
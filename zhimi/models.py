@@ -0,0 +1,4 @@
+"""模型名称常量（不依赖 LLM 客户端，检索模块可直接引用）"""
+
+# 默认使用硅基流动上的 Qwen2.5-7B-Instruct（硅基流动的模型名与 Hugging Face 仓库名一致）
+DEFAULT_MODEL = "Qwen/Qwen2.5-7B-Instruct"
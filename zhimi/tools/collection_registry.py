@@ -0,0 +1,249 @@
+"""集合注册表模块（多集合、多分片知识库的并行检索与结果合并）"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+from zhimi.index.collections import COLLECTIONS_PATH, LEGACY_INDEX_PATH, discover_collections
+from zhimi.index.versions import resolve_index_dir
+from zhimi.tools.retriever_registry import RetrieverRegistry
+
+# 并行检索各分片的线程数
+SHARD_FANOUT_WORKERS = int(os.getenv("SHARD_FANOUT_WORKERS", 8))
+# 检查索引新版本的最小间隔（秒），设为 0 关闭热切换
+INDEX_RELOAD_INTERVAL = float(os.getenv("INDEX_RELOAD_INTERVAL", 5.0))
+
+# 片段键：(分片注册表, 分片内的向量序号)；注册表绑定索引版本，切换版本后旧结果仍按旧版本取片段
+ShardKey = Tuple[RetrieverRegistry, int]
+# 分片布局：[(集合名, 当前版本的索引目录)]
+Layout = List[Tuple[str, str]]
+
+
+class CollectionRegistry:
+    """集合注册表
+
+    知识库由若干命名集合组成，每个集合分为若干独立构建、独立加载的分片（各自是一份完整的
+    FAISS / BM25 索引目录，由一个 RetrieverRegistry 管理）。查询并行发往所选集合的全部分片，
+    各分片返回前 k 个结果后合并成全局前 k 个：向量检索按距离合并（结果与单一索引一致），
+    BM25 和关键词检索按分数合并。
+
+    索引重建后发布新版本（见 zhimi.index.versions），检索时每隔 reload_interval 秒检查一次，
+    发现新版本后在后台线程加载并预热，完成后整体替换分片列表；替换前已开始的查询继续使用旧版本。
+
+    与 RetrieverRegistry 提供相同的检索接口，片段键为 (分片注册表, 向量序号)。
+    """
+
+    def __init__(
+        self,
+        root: str = COLLECTIONS_PATH,
+        legacy_index_path: str = LEGACY_INDEX_PATH,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        fanout_workers: int = SHARD_FANOUT_WORKERS,
+        reload_interval: float = INDEX_RELOAD_INTERVAL,
+    ):
+        """
+        Args:
+            root: 命名集合的根目录
+            legacy_index_path: 旧版单一索引目录（视为 default 集合）
+            nprobe: IVF 近似索引每次查询访问的聚类数
+            ef_search: HNSW 近似索引查询时的候选列表长度
+            fanout_workers: 并行检索各分片的线程数
+            reload_interval: 检查索引新版本的最小间隔（秒），为 0 时不自动切换
+        """
+        self.root = root
+        self.legacy_index_path = legacy_index_path
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._shards: List[Tuple[str, RetrieverRegistry]] = []
+        self._layout_seen: Layout = []
+        self._executor = ThreadPoolExecutor(max_workers=fanout_workers, thread_name_prefix="shard_search")
+        self._last_check = time.monotonic()
+        self._reloading = False
+
+    def _layout(self, warn_missing: bool = False) -> Layout:
+        """扫描当前发布的分片布局"""
+        return [
+            (name, resolve_index_dir(path))
+            for name, paths in discover_collections(self.root, self.legacy_index_path, warn_missing).items()
+            for path in paths
+        ]
+
+    def refresh(self, warm: bool = False) -> List[Tuple[str, RetrieverRegistry]]:
+        """
+        重新发现集合与分片并整体替换分片列表（版本未变的分片保留，不重复加载）
+
+        Args:
+            warm: 替换前是否预加载新版本的分片（后台切换时使用，切换后的首个查询无需等待加载）
+        """
+        from zhimi.index import load_manifest
+        with self._refresh_lock:
+            loaded = {registry.index_path: registry for _, registry in self._shards}
+            shards = []
+            embedding = None
+            layout = self._layout(warn_missing=True)
+            for name, path in layout:
+                manifest = load_manifest(path) or {}
+                shard_embedding = manifest.get("embedding", {}).get("model")
+                # 各分片共用同一次查询向量化，嵌入模型必须一致
+                if embedding is not None and shard_embedding not in (None, embedding):
+                    print(f"⚠️ 分片 {path} 的嵌入模型 {shard_embedding} 与其他分片（{embedding}）不一致，已跳过")
+                    continue
+                embedding = embedding or shard_embedding
+                registry = loaded.get(path) or RetrieverRegistry(path, nprobe=self.nprobe, ef_search=self.ef_search)
+                shards.append((name, registry))
+            if warm:
+                for _, registry in shards:
+                    if registry.index_path not in loaded:
+                        registry.warmup()
+            with self._lock:
+                self._shards = shards
+                self._layout_seen = layout
+                self._last_check = time.monotonic()
+            return shards
+
+    def _reload(self) -> None:
+        """后台加载新版本并切换"""
+        try:
+            self.refresh(warm=True)
+            print("🔄 已切换到新的索引版本")
+        except Exception as e:
+            # 新版本加载失败时继续使用旧版本，下次检查时重试
+            print(f"⚠️ 加载新的索引版本失败，继续使用当前版本: {e}")
+        finally:
+            self._reloading = False
+
+    def check_for_update(self) -> bool:
+        """
+        检查是否发布了新的索引版本（或增删了集合、分片），有则在后台加载并切换
+
+        Returns:
+            是否开始了后台切换
+        """
+        with self._lock:
+            if self._reloading:
+                return False
+            self._last_check = time.monotonic()
+            seen = self._layout_seen
+        if self._layout() == seen:
+            return False
+        with self._lock:
+            if self._reloading:
+                return False
+            self._reloading = True
+        threading.Thread(target=self._reload, name="index_reload", daemon=True).start()
+        return True
+
+    def shards(self) -> List[Tuple[str, RetrieverRegistry]]:
+        """全部分片 [(集合名, 注册表)]，尚未发现任何分片时同步扫描，否则按间隔检查新版本"""
+        if not self._shards:
+            return self.refresh()
+        if self.reload_interval > 0 and time.monotonic() - self._last_check >= self.reload_interval:
+            self.check_for_update()
+        return self._shards
+
+    def collections(self) -> List[str]:
+        """已构建的集合名"""
+        return sorted({name for name, _ in self.shards()})
+
+    def _select(self, metadata_filter=None) -> List[RetrieverRegistry]:
+        """过滤条件选中的分片（未指定集合时为全部分片），同一查询始终使用这一份快照"""
+        names = metadata_filter.collections if metadata_filter is not None else None
+        return [registry for name, registry in self.shards() if names is None or name in names]
+
+    def _fan_out(self, selected: List[RetrieverRegistry], search: Callable[[RetrieverRegistry], list]) -> List[list]:
+        """在选中的分片上并行执行检索，返回与 selected 一一对应的结果"""
+        if len(selected) == 1:
+            return [search(selected[0])]
+        return list(self._executor.map(search, selected))
+
+    @staticmethod
+    def _merge(selected: List[RetrieverRegistry], per_shard: List[list], k: int, descending: bool) -> list:
+        """合并各分片的结果，片段键换成 (分片注册表, 向量序号)，取全局前 k 个"""
+        hits = [
+            (position, ordinal, score)
+            for position, results in enumerate(per_shard) for ordinal, score in results
+        ]
+        hits.sort(key=lambda hit: (-hit[2] if descending else hit[2], hit[0], hit[1]))
+        return [((selected[position], ordinal), score) for position, ordinal, score in hits[:k]]
+
+    def is_available(self) -> bool:
+        """是否存在已构建的分片"""
+        return bool(self.shards())
+
+    def index_version(self) -> Tuple:
+        """索引版本：各分片清单文件修改时间的组合，任一分片重建都会改变"""
+        return tuple(registry.index_version() for _, registry in self.shards())
+
+    def get_embeddings(self):
+        """获取嵌入模型（各分片一致，由第一个分片加载）"""
+        return self.shards()[0][1].get_embeddings()
+
+    def set_search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> None:
+        """调整全部分片近似索引的查询参数"""
+        self.nprobe = nprobe if nprobe is not None else self.nprobe
+        self.ef_search = ef_search if ef_search is not None else self.ef_search
+        for _, registry in self.shards():
+            registry.set_search_params(nprobe, ef_search)
+
+    def get_document(self, key: ShardKey):
+        """根据片段键获取文档片段（从产生该结果的索引版本读取）"""
+        registry, ordinal = key
+        return registry.get_document(ordinal)
+
+    def doc_count(self) -> int:
+        """全部分片的文档片段总数"""
+        return sum(registry.doc_count() for _, registry in self.shards())
+
+    def vector_search(self, query: str, k: int, metadata_filter=None) -> List[Tuple[ShardKey, float]]:
+        """向量检索，返回 [(片段键, L2 距离)]，按距离从小到大排列"""
+        return self.vector_search_batch([query], k, metadata_filter)[0]
+
+    def vector_search_batch(
+        self, queries: List[str], k: int, metadata_filter=None, vectors=None
+    ) -> List[List[Tuple[ShardKey, float]]]:
+        """批量向量检索：查询只向量化一次，各分片并行检索后按距离合并"""
+        from zhimi.index import embed_queries
+        selected = self._select(metadata_filter)
+        if not queries or not selected:
+            return [[] for _ in queries]
+        if vectors is None:
+            vectors = embed_queries(self.get_embeddings(), queries)
+        per_shard = self._fan_out(selected, lambda registry: registry.vector_search_batch(queries, k, metadata_filter, vectors))
+        return [self._merge(selected, [results[q] for results in per_shard], k, descending=False) for q in range(len(queries))]
+
+    def bm25_search(self, query: str, k: int, metadata_filter=None) -> List[Tuple[ShardKey, float]]:
+        """BM25 检索，返回 [(片段键, BM25 分数)]，按分数从高到低排列"""
+        return self.bm25_search_batch([query], k, metadata_filter)[0]
+
+    def bm25_search_batch(self, queries: List[str], k: int, metadata_filter=None) -> List[List[Tuple[ShardKey, float]]]:
+        """批量 BM25 检索：各分片并行打分后按分数合并（IDF 按分片统计，分片间分数近似可比）"""
+        selected = self._select(metadata_filter)
+        if not queries or not selected:
+            return [[] for _ in queries]
+        per_shard = self._fan_out(selected, lambda registry: registry.bm25_search_batch(queries, k, metadata_filter))
+        return [self._merge(selected, [results[q] for results in per_shard], k, descending=True) for q in range(len(queries))]
+
+    def keyword_search(self, terms: List[str], k: int, metadata_filter=None) -> List[Tuple[ShardKey, int]]:
+        """关键词检索：各分片并行匹配后按命中关键词数合并"""
+        selected = self._select(metadata_filter)
+        if not selected:
+            return []
+        per_shard = self._fan_out(selected, lambda registry: registry.keyword_search(terms, k, metadata_filter))
+        return self._merge(selected, per_shard, k, descending=True)
+
+    def warmup(self) -> bool:
+        """
+        并行预加载全部分片（供服务启动时调用）
+
+        Returns:
+            是否存在可用的分片
+        """
+        shards = self.refresh()
+        if not shards:
+            return False
+        return any(self._fan_out([registry for _, registry in shards], lambda registry: registry.warmup()))
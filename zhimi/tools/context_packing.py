@@ -0,0 +1,237 @@
+"""上下文打包模块（按 token 预算合并、去重叠、截断检索结果）"""
+import os
+import re
+import threading
+from functools import lru_cache
+from typing import Callable, List, NamedTuple, Optional
+
+from langchain_core.documents import Document
+
+from zhimi.models import DEFAULT_MODEL
+
+
+def _hf_repo_id(model: str) -> str:
+    """把省略了组织名的 Qwen 模型名（如 Qwen2.5-7B-Instruct）补全为 Hugging Face 仓库名"""
+    if "/" not in model and model.lower().startswith("qwen"):
+        return f"Qwen/{model}"
+    return model
+
+
+# 检索工具输出的 token 预算，0 表示不限制
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1500))
+# 计数所用的分词器（Hugging Face 仓库名），默认与对话模型（LLM_MODEL）一致
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER") or _hf_repo_id(os.getenv("LLM_MODEL", DEFAULT_MODEL))
+# 加载分词器的最长等待时间（秒），超时后按字符估算
+CONTEXT_TOKENIZER_TIMEOUT = float(os.getenv("CONTEXT_TOKENIZER_TIMEOUT", 10))
+# 剩余预算少于该值时不再放入截断的片段
+MIN_TRUNCATED_TOKENS = 32
+# 没有 start_index 时，按文本判断相邻片段重叠的最短长度（索引脚本的分块重叠为 100 字符）
+MIN_TEXT_OVERLAP = 20
+MAX_TEXT_OVERLAP = 200
+
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def _load_with_timeout(load: Callable[[], Callable[[str], int]], timeout: float) -> Callable[[str], int]:
+    """在后台线程中加载，超时或失败时抛出异常（超时的加载线程继续在后台运行，结果不再使用）"""
+    result, errors = [], []
+
+    def run():
+        try:
+            result.append(load())
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run, name="tokenizer_load", daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if errors:
+        raise errors[0]
+    if not result:
+        raise TimeoutError(f"加载超时（>{timeout}秒）")
+    return result[0]
+
+
+def _load_hf_tokenizer() -> Callable[[str], int]:
+    from transformers import AutoTokenizer
+    # 只读取本地缓存，不从 Hub 下载（下载没有超时，会阻塞检索）
+    tokenizer = AutoTokenizer.from_pretrained(CONTEXT_TOKENIZER, local_files_only=True)
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def _load_tiktoken() -> Callable[[str], int]:
+    import tiktoken
+    # Qwen 的词表在 cl100k_base 基础上扩充而来，计数接近；首次使用需要下载词表文件
+    encoding = tiktoken.get_encoding("cl100k_base")
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+def _load_tokenizer() -> Callable[[str], int]:
+    """依次尝试对话模型的分词器（本地缓存）、tiktoken（限时加载），都不可用时按字符估算"""
+    for load in (_load_hf_tokenizer, _load_tiktoken):
+        try:
+            return _load_with_timeout(load, CONTEXT_TOKENIZER_TIMEOUT)
+        except Exception:
+            pass
+    print("⚠️ 未找到可用的分词器，按字符数估算 token 数")
+    return _estimate_tokens
+
+
+def _estimate_tokens(text: str) -> int:
+    """粗略估算：中文字符每字 1 个 token，其余字符约 4 个一个 token"""
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _get_tokenizer() -> Callable[[str], int]:
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                _tokenizer = _load_tokenizer()
+    return _tokenizer
+
+
+def warmup_tokenizer() -> None:
+    """预加载计数用的分词器（供服务启动时调用，避免首次检索时加载）"""
+    _get_tokenizer()
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """统计文本的 token 数（同一片段在多次检索中反复出现，结果带缓存）"""
+    return _get_tokenizer()(text)
+
+
+class ScoredChunk(NamedTuple):
+    """带相关度分数的检索结果（打包后可能由同一来源的多个相邻片段合并而成）"""
+    document: Document
+    score: float
+
+
+def _position(doc: Document):
+    """片段在原文中的位置：(来源, 页码, 起始偏移)，没有 start_index 时起始偏移为 None"""
+    return doc.metadata.get("source"), doc.metadata.get("page"), doc.metadata.get("start_index")
+
+
+def _overlap(left: str, right: str) -> int:
+    """left 的结尾与 right 的开头重叠的字符数（没有足够长的重叠时返回 0）"""
+    for length in range(min(len(left), len(right), MAX_TEXT_OVERLAP), MIN_TEXT_OVERLAP - 1, -1):
+        if left.endswith(right[:length]):
+            return length
+    return 0
+
+
+def _try_merge(left: Document, right: Document) -> Optional[Document]:
+    """left 与 right 来自同一来源且在原文中相邻或重叠时合并（去掉重叠部分），否则返回 None"""
+    source, page, left_start = _position(left)
+    right_source, right_page, right_start = _position(right)
+    if source is None or (source, page) != (right_source, right_page):
+        return None
+    if left_start is not None and right_start is not None:
+        if right_start < left_start:
+            return None
+        overlap = left_start + len(left.page_content) - right_start
+        if overlap < 0 or overlap > len(right.page_content):
+            return None
+    else:
+        overlap = _overlap(left.page_content, right.page_content)
+        if overlap == 0:
+            return None
+    return Document(
+        id=left.id,
+        page_content=left.page_content + right.page_content[overlap:],
+        metadata=left.metadata,
+    )
+
+
+def merge_adjacent(chunks: List[ScoredChunk]) -> List[ScoredChunk]:
+    """
+    合并同一来源中相邻或重叠的片段
+
+    合并后的块取其中最高的分数，位置取其中排名最靠前的片段。
+
+    Args:
+        chunks: 按相关度从高到低排列的片段
+
+    Returns:
+        按相关度从高到低排列的块
+    """
+    blocks = [(rank, chunk) for rank, chunk in enumerate(chunks)]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(blocks)):
+            for j in range(len(blocks)):
+                if i == j:
+                    continue
+                document = _try_merge(blocks[i][1].document, blocks[j][1].document)
+                if document is None:
+                    continue
+                rank = min(blocks[i][0], blocks[j][0])
+                score = max(blocks[i][1].score, blocks[j][1].score)
+                blocks = [block for k, block in enumerate(blocks) if k not in (i, j)]
+                blocks.append((rank, ScoredChunk(document, score)))
+                merged = True
+                break
+            if merged:
+                break
+    return [chunk for _, chunk in sorted(blocks, key=lambda block: block[0])]
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """截断文本使其不超过 max_tokens 个 token（按字符二分查找）"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[:middle] + "…") <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low] + "…" if low else ""
+
+
+def pack_chunks(
+    chunks: List[ScoredChunk],
+    token_budget: Optional[int] = None,
+    overhead: Callable[[int, ScoredChunk], int] = lambda position, chunk: 0,
+) -> List[ScoredChunk]:
+    """
+    在 token 预算内打包检索结果
+
+    先合并同一来源的相邻片段（去掉分块重叠），再按相关度依次放入；
+    放不下的第一个块截断到剩余预算，之后的块全部丢弃。
+
+    Args:
+        chunks: 按相关度从高到低排列的片段
+        token_budget: token 预算，默认 CONTEXT_TOKEN_BUDGET，0 表示不限制
+        overhead: 每个块在输出中的额外 token 数（标题、分隔符等），参数为 (序号, 块)，序号从 1 开始
+
+    Returns:
+        放入预算的块，按相关度从高到低排列
+    """
+    token_budget = CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+    blocks = merge_adjacent(chunks)
+    if token_budget <= 0:
+        return blocks
+
+    packed = []
+    remaining = token_budget
+    for block in blocks:
+        cost = overhead(len(packed) + 1, block)
+        tokens = count_tokens(block.document.page_content)
+        if cost + tokens <= remaining:
+            packed.append(block)
+            remaining -= cost + tokens
+            continue
+        if remaining - cost >= MIN_TRUNCATED_TOKENS:
+            text = truncate_to_tokens(block.document.page_content, remaining - cost)
+            document = Document(id=block.document.id, page_content=text, metadata=block.document.metadata)
+            packed.append(ScoredChunk(document, block.score))
+        break
+    return packed
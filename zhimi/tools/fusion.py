@@ -0,0 +1,37 @@
+"""检索结果融合模块（倒数排名融合 RRF）"""
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+# RRF 平滑常数：越大越削弱排名靠前结果的优势，60 为论文与常见实现的默认值
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[Hashable]],
+    weights: Optional[Sequence[float]] = None,
+    rrf_k: int = RRF_K,
+) -> List[Tuple[Hashable, float]]:
+    """
+    倒数排名融合
+
+    每路检索结果中排名为 r 的条目得分 weight / (rrf_k + r)，同一条目在各路中的得分相加。
+    只依赖排名，不需要把向量距离和 BM25 分数归一化到同一尺度。
+
+    Args:
+        rankings: 各路检索结果的条目键（如片段 id），按相关度从高到低排列
+        weights: 各路检索的权重，默认均为 1
+        rrf_k: 平滑常数
+
+    Returns:
+        [(条目键, 融合分数)]，按分数从高到低排列，同分时先出现的在前
+    """
+    weights = weights or [1.0] * len(rankings)
+    scores: Dict[Hashable, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        seen = set()
+        for rank, key in enumerate(ranking, 1):
+            # 同一路中重复出现的条目只计首次排名
+            if key in seen:
+                continue
+            seen.add(key)
+            scores[key] = scores.get(key, 0.0) + weight / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
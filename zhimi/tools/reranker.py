@@ -0,0 +1,174 @@
+"""交叉编码器重排序模块（可选，CPU 运行，带分数缓存和延迟预算）"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, List, Optional, Sequence, Tuple
+
+from zhimi.index.embedding_cache import normalize_text
+
+# 重排序模型，如 BAAI/bge-reranker-base；为空时不启用重排序
+RERANK_MODEL = os.getenv("RERANK_MODEL", "")
+# 送入重排序的融合候选数
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", 20))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", 16))
+# 缓存的 (查询, 片段) 分数条数
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", 10000))
+# 单次重排序的延迟预算（毫秒），预计超出时跳过重排序
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", 800))
+# 每对 (查询, 片段) 耗时估计的平滑系数
+LATENCY_SMOOTHING = 0.2
+# 预计超出预算而跳过重排序期间，每隔多少秒用一小批候选重新测量耗时（偶发的慢批次不会永久关闭重排序）
+RERANK_PROBE_INTERVAL = float(os.getenv("RERANK_PROBE_INTERVAL", 30))
+
+
+class CrossEncoderReranker:
+    """交叉编码器重排序器
+
+    对 (查询, 片段) 逐对打分，分数按 (查询哈希, 片段 id) 缓存并按最近最少使用淘汰。
+    根据历史批次估计每对的耗时，预计超出延迟预算时直接跳过，由调用方使用融合排序；
+    跳过期间每隔 probe_interval 秒只对预算内的少量候选打分，以最新测量值替换耗时估计，
+    模型恢复正常速度后重排序随之恢复。模型尚未加载时在后台线程加载，本次同样跳过，不阻塞当前轮对话。
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        batch_size: int = RERANK_BATCH_SIZE,
+        cache_size: int = RERANK_CACHE_SIZE,
+        budget_ms: float = RERANK_BUDGET_MS,
+        probe_interval: float = RERANK_PROBE_INTERVAL,
+    ):
+        """
+        Args:
+            model_name: 交叉编码器模型名称
+            batch_size: 每批打分的片段数
+            cache_size: 分数缓存条数上限
+            budget_ms: 单次重排序的延迟预算（毫秒）
+            probe_interval: 超出预算而跳过期间重新测量耗时的间隔（秒）
+        """
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.budget_ms = budget_ms
+        self.probe_interval = probe_interval
+        self._model = None
+        self._loading = False
+        self._failed = False
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[Tuple[str, Hashable], float]" = OrderedDict()
+        self._seconds_per_pair: Optional[float] = None
+        self._predicted = False
+        # 最近一次测量耗时的时刻（time.monotonic()）
+        self._last_measured = float("-inf")
+
+    def _load_model(self) -> None:
+        try:
+            from sentence_transformers import CrossEncoder
+            self._model = CrossEncoder(self.model_name, device="cpu", max_length=512)
+            print(f"✅ 重排序模型已加载: {self.model_name}")
+        except Exception as e:
+            # 加载失败后不再重试，检索退回融合排序
+            self._failed = True
+            print(f"⚠️ 重排序模型加载失败: {e}，将使用融合排序")
+        finally:
+            self._loading = False
+
+    def warmup(self) -> None:
+        """在当前线程加载模型（供服务启动时调用）"""
+        with self._lock:
+            if self._model is not None or self._loading or self._failed:
+                return
+            self._loading = True
+        self._load_model()
+
+    def is_ready(self) -> bool:
+        """模型已加载时返回 True，否则在后台开始加载并返回 False"""
+        if self._model is not None:
+            return True
+        with self._lock:
+            if not (self._loading or self._failed):
+                self._loading = True
+                threading.Thread(target=self._load_model, daemon=True).start()
+        return False
+
+    def is_loading(self) -> bool:
+        """模型尚未就绪且未加载失败（rerank 返回 None 属于暂时降级）"""
+        return self._model is None and not self._failed
+
+    def _cache_get(self, key) -> Optional[float]:
+        with self._lock:
+            score = self._cache.get(key)
+            if score is not None:
+                self._cache.move_to_end(key)
+            return score
+
+    def _cache_put(self, key, score: float) -> None:
+        with self._lock:
+            self._cache[key] = score
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _score(self, query: str, query_hash: str, candidates, indices: List[int], scores: List, smoothing: float) -> float:
+        """对 indices 指定的候选打分（写入 scores 和缓存），更新每对耗时估计，返回耗时（秒）"""
+        batch_time = time.monotonic()
+        batch_scores = self._model.predict([(query, candidates[i][1]) for i in indices], batch_size=self.batch_size)
+        elapsed = time.monotonic() - batch_time
+        per_pair = elapsed / len(indices)
+        if self._predicted:
+            # 首次推理包含初始化开销，不计入耗时估计
+            self._seconds_per_pair = per_pair if self._seconds_per_pair is None else \
+                (1 - smoothing) * self._seconds_per_pair + smoothing * per_pair
+            self._last_measured = time.monotonic()
+        self._predicted = True
+        for i, score in zip(indices, batch_scores):
+            scores[i] = float(score)
+            self._cache_put((query_hash, candidates[i][0]), scores[i])
+        return elapsed
+
+    def rerank(self, query: str, candidates: Sequence[Tuple[Hashable, str]]) -> Optional[List[float]]:
+        """
+        为候选片段打分
+
+        Args:
+            query: 查询文本
+            candidates: [(片段 id, 片段文本)]
+
+        Returns:
+            与 candidates 一一对应的分数（越大越相关）；模型未就绪、加载失败或预计超出延迟预算时返回 None，
+            可用 is_loading() 区分暂时降级（模型仍在加载）
+        """
+        if not candidates or not self.is_ready():
+            return None
+
+        query_hash = hashlib.sha256(normalize_text(query).encode("utf-8")).hexdigest()
+        scores = [self._cache_get((query_hash, chunk_id)) for chunk_id, _ in candidates]
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if not missing:
+            return scores
+
+        budget = self.budget_ms / 1000
+        if self._seconds_per_pair is not None and len(missing) * self._seconds_per_pair > budget:
+            print(f"⚠️ 重排序预计耗时超出预算（{self.budget_ms:.0f}ms），本次使用融合排序")
+            if time.monotonic() - self._last_measured >= self.probe_interval:
+                # 只对预算内能完成的少量候选打分，测量值直接替换估计（分数留在缓存中）
+                probe = missing[:max(1, min(self.batch_size, int(budget / self._seconds_per_pair)))]
+                self._score(query, query_hash, candidates, probe, scores, smoothing=1.0)
+            return None
+
+        start_time = time.monotonic()
+        for batch_start in range(0, len(missing), self.batch_size):
+            batch = missing[batch_start:batch_start + self.batch_size]
+            self._score(query, query_hash, candidates, batch, scores, LATENCY_SMOOTHING)
+            if time.monotonic() - start_time > budget and batch_start + self.batch_size < len(missing):
+                # 已打分的结果留在缓存中，下次相同查询可直接使用
+                print(f"⚠️ 重排序超出预算（{self.budget_ms:.0f}ms），本次使用融合排序")
+                return None
+        return scores
+
+
+def build_reranker() -> Optional[CrossEncoderReranker]:
+    """按配置创建重排序器，未配置 RERANK_MODEL 时返回 None"""
+    return CrossEncoderReranker(RERANK_MODEL) if RERANK_MODEL else None
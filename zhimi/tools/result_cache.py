@@ -0,0 +1,145 @@
+"""检索结果缓存模块（精确匹配 + 语义相似匹配，带过期时间与容量上限）"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from zhimi.index.embedding_cache import normalize_text
+
+# 缓存的检索结果条数，0 表示不启用结果缓存
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 1024))
+# 结果缓存的过期时间（秒）
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", 600))
+# 语义匹配的余弦相似度阈值，大于 1 时只做精确匹配
+RESULT_CACHE_SIMILARITY = float(os.getenv("RESULT_CACHE_SIMILARITY", 0.95))
+
+
+class _Entry(NamedTuple):
+    value: str
+    vector: Optional[np.ndarray]
+    expires_at: float
+
+
+class ResultCache:
+    """检索结果缓存
+
+    第一层按 (命名空间, 规范化查询) 精确匹配；未命中时若提供了查询向量，
+    在同一命名空间内找余弦相似度最高的已缓存查询，超过阈值即复用其结果。
+    条目超过过期时间后失效，超过容量时按最近最少使用淘汰；
+    索引版本（由调用方传入，如清单文件的修改时间）变化时清空全部条目。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = RESULT_CACHE_SIZE,
+        ttl: float = RESULT_CACHE_TTL,
+        similarity_threshold: float = RESULT_CACHE_SIMILARITY,
+    ):
+        """
+        Args:
+            max_entries: 缓存条数上限，0 表示不缓存
+            ttl: 过期时间（秒）
+            similarity_threshold: 语义匹配的余弦相似度阈值
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[tuple, _Entry]" = OrderedDict()
+        self._version = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def _unit(vector: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _sync_version(self, version: Hashable) -> None:
+        """索引版本变化时清空缓存（调用方持有锁）"""
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+    def _find_similar(self, namespace: str, vector: np.ndarray, now: float) -> Optional[tuple]:
+        """在同一命名空间内查找相似度最高且超过阈值的条目键（调用方持有锁）"""
+        keys = [
+            key for key, entry in self._entries.items()
+            if key[0] == namespace and entry.vector is not None and entry.expires_at > now
+        ]
+        if not keys:
+            return None
+        similarities = np.stack([self._entries[key].vector for key in keys]) @ vector
+        best = int(np.argmax(similarities))
+        return keys[best] if similarities[best] >= self.similarity_threshold else None
+
+    def get(
+        self,
+        namespace: str,
+        query: str,
+        version: Hashable,
+        vector: Optional[Sequence[float]] = None,
+    ) -> Optional[str]:
+        """
+        查找缓存结果
+
+        Args:
+            namespace: 命名空间（如工具名），不同命名空间的结果互不复用
+            query: 查询文本
+            version: 当前索引版本
+            vector: 查询向量，为 None 时只做精确匹配
+
+        Returns:
+            缓存的结果，未命中时返回 None
+        """
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        key = (namespace, normalize_text(query))
+        with self._lock:
+            self._sync_version(version)
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= now:
+                del self._entries[key]
+                entry = None
+            if entry is None and vector is not None and self.similarity_threshold <= 1:
+                key = self._find_similar(namespace, self._unit(vector), now)
+                entry = self._entries[key] if key is not None else None
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry.value
+
+    def put(
+        self,
+        namespace: str,
+        query: str,
+        value: str,
+        version: Hashable,
+        vector: Optional[Sequence[float]] = None,
+    ) -> None:
+        """写入检索结果（vector 为 None 的条目只参与精确匹配）"""
+        if not self.enabled:
+            return
+        entry = _Entry(value, self._unit(vector) if vector is not None else None, time.monotonic() + self.ttl)
+        with self._lock:
+            self._sync_version(version)
+            key = (namespace, normalize_text(query))
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,311 @@
+"""检索器注册表模块（延迟加载嵌入模型与知识库索引）"""
+import os
+import pickle
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+INDEX_PATH = "memory/faiss_index"
+
+# 按 (模型名, 是否归一化) 共享的嵌入模型：多个分片、新旧索引版本只加载一次
+_shared_embeddings = {}
+_shared_embeddings_lock = threading.Lock()
+
+
+def register_embeddings(model: str, normalize: bool, embeddings) -> None:
+    """
+    注册查询端嵌入模型，清单中记录该模型名的索引直接使用它（如基准测试的哈希嵌入）
+
+    Args:
+        model: 清单中记录的嵌入模型名
+        normalize: 是否归一化向量
+        embeddings: langchain Embeddings 对象
+    """
+    with _shared_embeddings_lock:
+        _shared_embeddings[(model, normalize)] = embeddings
+
+
+def _load_embeddings(model: str, normalize: bool):
+    """加载（或复用已加载的）查询端嵌入模型，查询向量带缓存"""
+    with _shared_embeddings_lock:
+        embeddings = _shared_embeddings.get((model, normalize))
+        if embeddings is None:
+            from langchain_community.embeddings import HuggingFaceBgeEmbeddings
+            from zhimi.index import cached_embeddings
+            embeddings = HuggingFaceBgeEmbeddings(
+                model_name=model,
+                model_kwargs={"device": "cpu"},
+                encode_kwargs={"normalize_embeddings": normalize}
+            )
+            # 重复查询直接命中缓存，无需再次编码
+            embeddings = cached_embeddings(embeddings, model, normalize, "queries")
+            _shared_embeddings[(model, normalize)] = embeddings
+        return embeddings
+
+
+class RetrieverRegistry:
+    """检索器注册表
+
+    嵌入模型、FAISS 索引、文档片段存储、关键词倒排索引和 BM25 索引均在首次使用时加载，
+    导入模块本身不触发任何重量级加载。加载过程加锁，多线程并发访问时只加载一次。
+    向量和片段均以只读内存映射方式打开，多个服务进程共享同一份页缓存。
+
+    索引目录使用版本化布局时，注册表绑定创建时的当前版本；新版本由集合注册表另建注册表后切换。
+    """
+
+    def __init__(self, index_path: str = INDEX_PATH, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        """
+        初始化注册表
+
+        Args:
+            index_path: 索引目录（版本化布局时解析为当前版本的目录）
+            nprobe: IVF 近似索引每次查询访问的聚类数
+            ef_search: HNSW 近似索引查询时的候选列表长度
+        """
+        from zhimi.index import resolve_index_dir
+        self.index_path = resolve_index_dir(index_path)
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self._lock = threading.RLock()
+        self._manifest = None
+        self._embeddings = None
+        self._index = None
+        self._chunk_store = None
+        self._keyword_index = None
+        self._bm25 = None
+        self._metadata_index = None
+
+    def _get_or_load(self, attr: str, loader):
+        """双重检查加锁的延迟加载"""
+        value = getattr(self, attr)
+        if value is None:
+            with self._lock:
+                value = getattr(self, attr)
+                if value is None:
+                    value = loader()
+                    setattr(self, attr, value)
+        return value
+
+    def is_available(self) -> bool:
+        """本地知识库索引是否存在"""
+        return Path(self.index_path).exists()
+
+    def index_version(self) -> Optional[int]:
+        """索引版本：清单文件的修改时间（纳秒），每次重建索引都会改变；没有清单时返回 None"""
+        from zhimi.index.manifest import MANIFEST_FILE
+        try:
+            return os.stat(Path(self.index_path) / MANIFEST_FILE).st_mtime_ns
+        except OSError:
+            return None
+
+    def get_manifest(self) -> dict:
+        """获取索引清单（旧版索引没有清单时按索引脚本的历史默认参数补全）"""
+        def load():
+            from zhimi.index import DEFAULT_EMBED_MODEL, load_manifest
+            manifest = load_manifest(self.index_path)
+            if manifest is None:
+                print(f"⚠️ 索引缺少清单文件，按默认嵌入模型 {DEFAULT_EMBED_MODEL} 查询（建议重新运行索引脚本）")
+                manifest = {"embedding": {"model": DEFAULT_EMBED_MODEL, "normalize": True}}
+            return manifest
+        return self._get_or_load("_manifest", load)
+
+    def get_embeddings(self):
+        """获取嵌入模型（与清单中记录的构建模型严格一致，同一模型在各注册表间共享）"""
+        def load():
+            embedding = self.get_manifest()["embedding"]
+            return _load_embeddings(embedding["model"], embedding["normalize"])
+        return self._get_or_load("_embeddings", load)
+
+    def get_index(self):
+        """获取 FAISS 索引（清单指定了近似索引时优先使用），索引不存在时返回 None"""
+        if not self.is_available():
+            return None
+
+        def load():
+            from zhimi.index import load_ann_index, read_index_mmap, set_search_params
+            ann_type = self.get_manifest().get("ann", {}).get("type", "flat")
+            index = load_ann_index(self.index_path) if ann_type != "flat" else None
+            if index is None:
+                index = read_index_mmap(Path(self.index_path) / "index.faiss")
+            set_search_params(index, nprobe=self.nprobe, ef_search=self.ef_search)
+            dimension = self.get_manifest()["embedding"].get("dimension")
+            if dimension is not None and dimension != index.d:
+                raise ValueError(
+                    f"索引向量维度 {index.d} 与清单记录的 {dimension} 不一致，请重新构建索引"
+                )
+            return index
+        return self._get_or_load("_index", load)
+
+    def get_chunk_store(self):
+        """获取文档片段存储（旧版索引缺少片段存储文件时从 index.pkl 读入内存）"""
+        def load():
+            from zhimi.index import ChunkStore
+            store = ChunkStore.load(self.index_path)
+            if store is None:
+                print("⚠️ 未找到片段存储文件，正在从 index.pkl 加载（建议重新运行索引脚本）")
+                with open(Path(self.index_path) / "index.pkl", "rb") as f:
+                    docstore, index_to_docstore_id = pickle.load(f)
+                store = ChunkStore.from_documents(
+                    docstore.search(index_to_docstore_id[i]) for i in range(len(index_to_docstore_id))
+                )
+            return store
+        return self._get_or_load("_chunk_store", load)
+
+    def set_search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> None:
+        """调整近似索引的查询参数（立即作用于已加载的索引）"""
+        from zhimi.index import set_search_params
+        with self._lock:
+            self.nprobe = nprobe if nprobe is not None else self.nprobe
+            self.ef_search = ef_search if ef_search is not None else self.ef_search
+            if self._index is not None:
+                set_search_params(self._index, nprobe=self.nprobe, ef_search=self.ef_search)
+
+    def vector_search(self, query: str, k: int, metadata_filter=None) -> List[Tuple[int, float]]:
+        """
+        向量检索
+
+        Args:
+            query: 查询文本
+            k: 返回结果数
+            metadata_filter: 检索范围过滤条件（MetadataFilter），为 None 时不限范围
+
+        Returns:
+            [(向量序号, L2 距离)]，按距离从小到大排列
+        """
+        return self.vector_search_batch([query], k, metadata_filter)[0]
+
+    def vector_search_batch(
+        self, queries: List[str], k: int, metadata_filter=None, vectors=None
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        批量向量检索：一次批量向量化，一次 FAISS 检索
+
+        Args:
+            queries: 查询文本列表
+            k: 每个查询的返回结果数
+            metadata_filter: 检索范围过滤条件，所有查询共用；过滤在 FAISS 遍历索引时进行
+            vectors: 已计算好的查询向量（多个分片共用同一次向量化），为 None 时在此计算
+
+        Returns:
+            与 queries 一一对应的 [(向量序号, L2 距离)]
+        """
+        import numpy as np
+        from zhimi.index import embed_queries, filtered_search_params
+        if not queries:
+            return []
+        mask = self.filter_mask(metadata_filter)
+        if mask is not None and not mask.any():
+            return [[] for _ in queries]
+        index = self.get_index()
+        if vectors is None:
+            vectors = embed_queries(self.get_embeddings(), queries)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if mask is None:
+            distances, ordinals = index.search(vectors, k)
+        else:
+            params, bits = filtered_search_params(index, mask)
+            distances, ordinals = index.search(vectors, k, params=params)
+            del bits
+        return [
+            [(int(i), float(d)) for i, d in zip(row_ordinals, row_distances) if i != -1]
+            for row_ordinals, row_distances in zip(ordinals, distances)
+        ]
+
+    def get_document(self, ordinal: int):
+        """根据向量序号获取文档片段"""
+        return self.get_chunk_store().get(ordinal)
+
+    def doc_count(self) -> int:
+        """知识库中的文档片段数量"""
+        return len(self.get_chunk_store())
+
+    def _iter_texts(self):
+        """按向量序号遍历文档片段文本"""
+        return (self.get_document(i).page_content for i in range(self.doc_count()))
+
+    def get_keyword_index(self):
+        """获取关键词倒排索引（旧版索引缺少倒排文件时在内存中构建一次）"""
+        def load():
+            from zhimi.index import KeywordIndex
+            index = KeywordIndex.load(self.index_path)
+            if index is None or index.doc_count != self.doc_count():
+                print("⚠️ 未找到可用的关键词倒排索引，正在内存中构建（建议重新运行索引脚本）")
+                index = KeywordIndex.build(self._iter_texts())
+            return index
+        return self._get_or_load("_keyword_index", load)
+
+    def get_bm25(self):
+        """获取 BM25 索引
+
+        BM25 统计量由索引脚本预先持久化，数组以内存映射方式按需读入，查询使用构建时的分词器；
+        旧版索引缺少 BM25 文件（或构建时的分词器不可用）时在内存中构建一次。
+        """
+        def load():
+            from zhimi.index import BM25Index
+            try:
+                index = BM25Index.load(self.index_path)
+            except ImportError as e:
+                print(f"⚠️ {e}")
+                index = None
+            if index is None or index.doc_count != self.doc_count():
+                print("⚠️ 未找到可用的 BM25 索引，正在内存中构建（建议重新运行索引脚本）")
+                index = BM25Index.build(self._iter_texts())
+            return index
+        return self._get_or_load("_bm25", load)
+
+    def bm25_search(self, query: str, k: int, metadata_filter=None) -> List[Tuple[int, float]]:
+        """BM25 检索，返回 [(向量序号, BM25 分数)]，按分数从高到低排列"""
+        return self.get_bm25().search(query, k=k, mask=self.filter_mask(metadata_filter))
+
+    def bm25_search_batch(self, queries: List[str], k: int, metadata_filter=None) -> List[List[Tuple[int, float]]]:
+        """批量 BM25 检索，返回与 queries 一一对应的结果"""
+        return self.get_bm25().search_batch(queries, k=k, mask=self.filter_mask(metadata_filter))
+
+    def keyword_search(self, terms: List[str], k: int, metadata_filter=None) -> List[Tuple[int, int]]:
+        """关键词检索，返回 [(向量序号, 命中关键词数)]，按命中数从高到低排列"""
+        return self.get_keyword_index().search(
+            terms, lambda ordinal: self.get_document(ordinal).page_content, k=k,
+            mask=self.filter_mask(metadata_filter),
+        )
+
+    def get_metadata_index(self):
+        """获取片段元数据索引（旧版索引缺少元数据文件时从片段存储构建一次）"""
+        def load():
+            from zhimi.index import FileManifest, MetadataIndex
+            index = MetadataIndex.load(self.index_path)
+            if index is None or index.doc_count != self.doc_count():
+                print("⚠️ 未找到可用的元数据索引，正在内存中构建（建议重新运行索引脚本）")
+                mtimes = FileManifest.load(self.index_path).mtimes()
+                index = MetadataIndex.build((self.get_document(i) for i in range(self.doc_count())), mtimes)
+            return index
+        return self._get_or_load("_metadata_index", load)
+
+    def filter_mask(self, metadata_filter):
+        """
+        计算过滤条件对应的检索范围位图
+
+        Args:
+            metadata_filter: MetadataFilter 过滤条件
+
+        Returns:
+            长度为片段数的布尔数组；过滤条件为空时返回 None（不限范围）
+        """
+        if metadata_filter is None or not metadata_filter.filters_metadata():
+            return None
+        return self.get_metadata_index().mask(metadata_filter)
+
+    def warmup(self) -> bool:
+        """
+        预加载嵌入模型和全部索引（供服务启动时调用）
+
+        Returns:
+            本地知识库是否可用
+        """
+        if self.get_index() is None:
+            return False
+        self.get_embeddings()
+        self.get_chunk_store()
+        self.get_keyword_index()
+        self.get_bm25()
+        self.get_metadata_index()
+        return True
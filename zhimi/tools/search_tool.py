@@ -1,116 +1,562 @@
-from pathlib import Path
-from langchain_core.tools import Tool
-from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceBgeEmbeddings
-from langchain_community.retrievers import BM25Retriever
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Hashable, List, NamedTuple, Optional, Tuple
+from langchain_core.tools import StructuredTool
 from pydantic import BaseModel, Field
+from zhimi.index import MetadataFilter, default_tokenizer
+from zhimi.tools.context_packing import ScoredChunk, count_tokens, pack_chunks, warmup_tokenizer
+from zhimi.tools.fusion import RRF_K, reciprocal_rank_fusion
+from zhimi.tools.reranker import RERANK_CANDIDATES, build_reranker
+from zhimi.tools.result_cache import ResultCache
+from zhimi.tools.collection_registry import CollectionRegistry
 
-INDEX_PATH = "memory/faiss_index"
-EMBED_MODEL = "BAAI/bge-large-zh-v1.5"
-
-embeddings = HuggingFaceBgeEmbeddings(
-    model_name=EMBED_MODEL,
-    encode_kwargs={"normalize_embeddings": True}
-)
-
-def load_retrievers():
-    if not Path(INDEX_PATH).exists():
-        return None, None
-    faiss = FAISS.load_local(
-        INDEX_PATH,
-        embeddings,
-        allow_dangerous_deserialization=True
-    )
-    bm25 = BM25Retriever.from_documents(list(faiss.docstore._dict.values()))
-    bm25.k = 2
-    return faiss, bm25
+# 近似索引（IVF / HNSW）的查询参数：值越大召回越高、速度越慢，可用 scripts/ann_recall_report.py 评估
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", 16))
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", 64))
+
+# 混合检索：每路检索取前 HYBRID_CANDIDATE_K 个候选，RRF 融合后返回前 HYBRID_TOP_K 个
+HYBRID_CANDIDATE_K = int(os.getenv("HYBRID_CANDIDATE_K", 20))
+HYBRID_TOP_K = int(os.getenv("HYBRID_TOP_K", 4))
+HYBRID_VECTOR_WEIGHT = float(os.getenv("HYBRID_VECTOR_WEIGHT", 1.0))
+HYBRID_BM25_WEIGHT = float(os.getenv("HYBRID_BM25_WEIGHT", 1.0))
+# 两路检索并发执行，各自超时（秒）后放弃该路，只用另一路的结果
+HYBRID_VECTOR_TIMEOUT = float(os.getenv("HYBRID_VECTOR_TIMEOUT", 5.0))
+HYBRID_BM25_TIMEOUT = float(os.getenv("HYBRID_BM25_TIMEOUT", 2.0))
+# 每路检索同时执行的请求数上限：超时的检索不会被中断，仍占用线程池线程直到结束，
+# 达到上限时新请求跳过该路（只用另一路的结果），避免慢检索逐渐占满线程池
+HYBRID_BRANCH_CONCURRENCY = int(os.getenv("HYBRID_BRANCH_CONCURRENCY", 3))
+
+# 工具输出中检索结果之间的分隔符
+RESULT_SEPARATOR = "\n\n---\n\n"
+
+# 嵌入模型与各集合分片的索引均由注册表在首次检索时加载，导入本模块不产生加载开销
+registry = CollectionRegistry(nprobe=FAISS_NPROBE, ef_search=FAISS_EF_SEARCH)
+
+# 可选的交叉编码器重排序（配置 RERANK_MODEL 后启用）
+reranker = build_reranker()
+
+# 工具输出缓存：重复或语义相近的问题直接返回上次结果，索引重建后自动失效
+result_cache = ResultCache()
+
+# 混合检索各路检索使用的线程池（faiss 与 numpy 计算时释放 GIL，可真正并行）
+_branch_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hybrid_search")
+# 各路检索正在执行（包括已超时但尚未结束）的请求数
+_branch_slots = {
+    name: threading.BoundedSemaphore(HYBRID_BRANCH_CONCURRENCY) for name in ("向量检索", "BM25 检索")
+}
+
+def warmup() -> bool:
+    """预加载嵌入模型、知识库索引、重排序模型和计数用的分词器（供服务启动时调用）"""
+    available = registry.warmup()
+    if available:
+        warmup_tokenizer()
+        if reranker is not None:
+            reranker.warmup()
+    return available
+
+def _semantic_cache_enabled() -> bool:
+    return result_cache.enabled and result_cache.similarity_threshold <= 1
+
+class QueryVector(NamedTuple):
+    """语义缓存查找时计算的查询向量，向量检索分支直接复用，不再重复向量化"""
+    # 向量化超时或向量检索名额已满时为 None（本次跳过语义缓存和向量检索）
+    vector: Optional[List[float]]
+    # 向量检索分支的截止时刻（time.monotonic()），从开始向量化时起算
+    deadline: float
+
+def _embed_query(query: str) -> List[float]:
+    return registry.get_embeddings().embed_query(query)
+
+def _embed_for_cache(query: str) -> QueryVector:
+    """在向量检索分支的名额和超时内向量化查询（冷启动加载嵌入模型也不会无限阻塞）"""
+    deadline = time.monotonic() + HYBRID_VECTOR_TIMEOUT
+    if not _acquire_branch("向量检索"):
+        return QueryVector(None, deadline)
+    future = _branch_executor.submit(_release_after("向量检索", lambda: _embed_query(query)))
+    try:
+        return QueryVector(future.result(timeout=HYBRID_VECTOR_TIMEOUT), deadline)
+    except FutureTimeoutError:
+        print(f"⚠️ 查询向量化超时（>{HYBRID_VECTOR_TIMEOUT}秒），本次跳过语义缓存和向量检索")
+        return QueryVector(None, deadline)
+
+async def _aembed_for_cache(query: str) -> QueryVector:
+    """_embed_for_cache 的异步版本"""
+    deadline = time.monotonic() + HYBRID_VECTOR_TIMEOUT
+    if not _acquire_branch("向量检索"):
+        return QueryVector(None, deadline)
+    future = asyncio.wrap_future(_branch_executor.submit(_release_after("向量检索", lambda: _embed_query(query))))
+    try:
+        return QueryVector(await asyncio.wait_for(asyncio.shield(future), HYBRID_VECTOR_TIMEOUT), deadline)
+    except asyncio.TimeoutError:
+        print(f"⚠️ 查询向量化超时（>{HYBRID_VECTOR_TIMEOUT}秒），本次跳过语义缓存和向量检索")
+        return QueryVector(None, deadline)
+
+def _cache_steps(namespace: str, query: str, semantic: bool):
+    """
+    结果缓存的查找与写入流程（同步与异步入口共用）
+
+    需要耗时计算时产出步骤名，由入口执行后 send 回结果：
+    - "embed"：查询向量化（受向量检索的超时限制），send 回 QueryVector
+    - "search"：检索（复用已计算的查询向量），send 回 (工具输出, 结果是否完整)
+    流程结束时以 StopIteration.value 返回工具输出。不完整的结果（某路检索超时或被跳过、
+    重排序暂未生效）只返回不缓存，避免系统恢复后仍以降级结果回答相同或相近的问题。
+    """
+    version = registry.index_version()
+    result = result_cache.get(namespace, query, version)
+    if result is not None:
+        return result
+    vector = None
+    if semantic and _semantic_cache_enabled():
+        vector = (yield "embed").vector
+        if vector is not None:
+            result = result_cache.get(namespace, query, version, vector)
+            if result is not None:
+                return result
+    result, complete = yield "search"
+    if complete:
+        result_cache.put(namespace, query, result, version, vector)
+    return result
+
+def _cached(namespace: str, query: str, search, semantic: bool = False) -> str:
+    """
+    先查结果缓存，未命中再检索，结果完整时写入缓存
+
+    Args:
+        namespace: 缓存命名空间（工具名）
+        query: 查询文本
+        search: 检索函数，输入 (查询文本, QueryVector 或 None) 返回 (工具输出, 结果是否完整)
+        semantic: 是否启用语义匹配（需要查询向量，查询向量本身也有缓存）
+    """
+    steps = _cache_steps(namespace, query, semantic)
+    value = query_vector = None
+    try:
+        while True:
+            step = steps.send(value)
+            if step == "embed":
+                value = query_vector = _embed_for_cache(query)
+            else:
+                value = search(query, query_vector)
+    except StopIteration as stop:
+        return stop.value
+
+async def _acached(namespace: str, query: str, asearch, semantic: bool = False) -> str:
+    """_cached 的异步版本：查询向量化在线程池中执行，asearch 为异步检索函数"""
+    steps = _cache_steps(namespace, query, semantic)
+    value = query_vector = None
+    try:
+        while True:
+            step = steps.send(value)
+            if step == "embed":
+                value = query_vector = await _aembed_for_cache(query)
+            else:
+                value = await asearch(query, query_vector)
+    except StopIteration as stop:
+        return stop.value
 
-faiss, bm25 = load_retrievers()
+def _cache_namespace(tool_name: str, metadata_filter: MetadataFilter) -> str:
+    """不同检索范围的结果分开缓存"""
+    return tool_name if metadata_filter.is_empty() else f"{tool_name}:{tuple(metadata_filter)}"
 
-def simple_keyword_search(query: str) -> str:
+def simple_keyword_search(
+    query: str,
+    path_prefix: Optional[str] = None,
+    file_type: Optional[str] = None,
+    modified_after: Optional[str] = None,
+    modified_before: Optional[str] = None,
+    collection: Optional[str] = None,
+) -> str:
     """对本地文档进行简单的关键词匹配检索
     
     适用于明确的术语、名称、具体关键词查询。
-    通过文本匹配查找包含查询关键词的文档片段。
+    通过文本匹配查找包含查询关键词的文档片段，可按知识库集合、路径前缀、文件类型、修改日期限定范围。
     """
-    if faiss is None:
+    if not registry.is_available():
         return "⚠️ 本地知识库尚未构建，请先构建索引。"
     
-    # 从FAISS索引中提取所有文档
-    all_docs = list(faiss.docstore._dict.values())
+    try:
+        metadata_filter = MetadataFilter.parse(path_prefix, file_type, modified_after, modified_before, collection)
+    except ValueError as e:
+        return f"⚠️ 过滤条件无效: {e}"
+    
+    # 关键词检索结果取决于字面用词，只做精确匹配缓存
+    return _cached(
+        _cache_namespace("simple_keyword_search", metadata_filter), query,
+        lambda q, query_vector: (_keyword_search(q, metadata_filter), True),
+    )
+
+def keyword_retrieve(query: str, k: int = 3, metadata_filter: Optional[MetadataFilter] = None) -> List[ScoredChunk]:
+    """
+    关键词匹配检索，返回按匹配关键词数量排序的前 k 个片段（不经过缓存）
+
+    Args:
+        query: 查询文本，由索引分词器（INDEX_TOKENIZER）切分为关键词
+        k: 返回结果数
+        metadata_filter: 检索范围过滤条件
+    """
+    # 提取查询关键词：空格分隔的完整词（更精确）加上分词结果（中文按 bigram 或词典分词，去除停用词），
+    # 命中的关键词越多排名越靠前
+    words = [word for word in query.lower().split() if len(word) > 1]
+    query_terms = list(dict.fromkeys(words + default_tokenizer()(query)))
+    
+    # 如果查询全部是停用词，直接使用整个查询
+    if not query_terms:
+        query_terms = [query.lower().strip()]
     
-    if not all_docs:
+    # 通过倒排索引查找候选文档，按匹配关键词数量排序
+    hits = registry.keyword_search(query_terms, k=k, metadata_filter=metadata_filter)
+    return [ScoredChunk(registry.get_document(key), score) for key, score in hits]
+
+def _keyword_search(query: str, metadata_filter: Optional[MetadataFilter] = None) -> str:
+    """关键词匹配检索并打包成工具输出（不经过缓存）"""
+    if registry.doc_count() == 0:
         return "未找到相关本地信息。"
     
-    # 提取查询关键词（简单分词，去除常见停用词）
-    query_lower = query.lower()
-    query_terms = [term for term in query_lower.split() if len(term) > 1]
+    top_chunks = keyword_retrieve(query, k=3, metadata_filter=metadata_filter)
     
-    # 如果查询词太短，直接使用整个查询
-    if not query_terms:
-        query_terms = [query_lower]
-    
-    # 对每个文档进行关键词匹配
-    matched_docs = []
-    for doc in all_docs:
-        content_lower = doc.page_content.lower()
-        # 计算匹配的关键词数量
-        match_count = sum(1 for term in query_terms if term in content_lower)
-        if match_count > 0:
-            matched_docs.append((match_count, doc))
-    
-    # 按匹配数量排序，取前3个
-    matched_docs.sort(key=lambda x: x[0], reverse=True)
-    top_docs = [doc for _, doc in matched_docs[:3]]
-    
-    if not top_docs:
+    if not top_chunks:
         return "未找到包含相关关键词的本地信息。"
     
-    # 返回匹配的文档内容
-    results = [doc.page_content for doc in top_docs]
-    return "\n\n---\n\n".join(results)
+    # 返回匹配的文档内容（按 token 预算打包）
+    separator_tokens = count_tokens(RESULT_SEPARATOR)
+    packed = pack_chunks(top_chunks, overhead=lambda position, chunk: separator_tokens if position > 1 else 0)
+    return RESULT_SEPARATOR.join(chunk.document.page_content for chunk in packed)
+
+class Retrieval(NamedTuple):
+    """混合检索结果"""
+    chunks: List[ScoredChunk]
+    # 各路检索都按时完成，且启用的重排序不是因模型仍在加载而跳过（不完整的结果不写入结果缓存）
+    complete: bool
+
+# 检索结果：[(片段键, 分数)]，片段键为向量序号（多分片时为 (分片注册表, 向量序号)）
+Hits = List[Tuple[Hashable, float]]
+
+def _vector_branch(
+    query: str, k: int, metadata_filter: Optional[MetadataFilter] = None, vector: Optional[List[float]] = None
+) -> Hits:
+    """向量检索分支：查询向量化（已有查询向量时跳过）+ FAISS 检索"""
+    if vector is None:
+        return registry.vector_search(query, k=k, metadata_filter=metadata_filter)
+    return registry.vector_search_batch([query], k, metadata_filter, vectors=[vector])[0]
+
+def _bm25_branch(query: str, k: int, metadata_filter: Optional[MetadataFilter] = None) -> Hits:
+    """关键词检索分支：BM25 打分"""
+    return registry.bm25_search(query, k=k, metadata_filter=metadata_filter)
+
+def _branches(
+    query: str,
+    candidate_k: int,
+    metadata_filter: Optional[MetadataFilter] = None,
+    query_vector: Optional[QueryVector] = None,
+):
+    """
+    混合检索的各路检索：(名称, 检索函数, 超时秒数)，检索函数为 None 表示该路本次跳过
+
+    Args:
+        query_vector: 语义缓存查找时已计算的查询向量，向量检索复用它并只用截止时刻前剩余的时间
+    """
+    if query_vector is None:
+        vector_branch = ("向量检索", lambda: _vector_branch(query, candidate_k, metadata_filter), HYBRID_VECTOR_TIMEOUT)
+    else:
+        vector_search = None
+        if query_vector.vector is not None:
+            vector_search = lambda: _vector_branch(query, candidate_k, metadata_filter, vector=query_vector.vector)
+        vector_branch = ("向量检索", vector_search, max(0.0, query_vector.deadline - time.monotonic()))
+    return [
+        vector_branch,
+        ("BM25 检索", lambda: _bm25_branch(query, candidate_k, metadata_filter), HYBRID_BM25_TIMEOUT),
+    ]
+
+def _acquire_branch(name: str) -> bool:
+    """占用该路检索的一个执行名额，已满时返回 False（该路本次跳过）"""
+    if _branch_slots[name].acquire(blocking=False):
+        return True
+    print(f"⚠️ {name}正在执行的请求已达上限（{HYBRID_BRANCH_CONCURRENCY}），本次只返回其他检索的结果")
+    return False
+
+def _release_after(name: str, search):
+    """包装检索函数：检索真正结束（而非调用方超时放弃）时才归还执行名额"""
+    # 归还给占用时的同一个信号量（名额表可能在检索执行期间被替换，如测试中）
+    slots = _branch_slots[name]
+
+    def run():
+        try:
+            return search()
+        finally:
+            slots.release()
+    return run
+
+def _fuse(query: str, branch_hits: List[Optional[Hits]], k: int) -> Retrieval:
+    """
+    按片段 id 融合去重（旧版索引片段没有 id 时以片段键代替）
+
+    启用重排序时先取前 RERANK_CANDIDATES 个融合结果，由交叉编码器重新打分后取前 k 个；
+    重排序不可用或超出延迟预算时直接使用融合排序。
+
+    Args:
+        branch_hits: 各路检索结果，超时或被跳过的一路为 None
+
+    Returns:
+        检索结果；某一路缺失或重排序模型仍在加载时标记为不完整
+    """
+    complete = all(hits is not None for hits in branch_hits)
+    docs = {}
+    rankings = []
+    for hits in branch_hits:
+        hits = hits or []
+        ranking = []
+        for key, _ in hits:
+            doc = registry.get_document(key)
+            chunk_id = doc.id or key
+            docs[chunk_id] = doc
+            ranking.append(chunk_id)
+        rankings.append(ranking)
+    
+    fused = reciprocal_rank_fusion(rankings, weights=[HYBRID_VECTOR_WEIGHT, HYBRID_BM25_WEIGHT], rrf_k=RRF_K)
+    if reranker is not None and fused:
+        pool = fused[:max(k, RERANK_CANDIDATES)]
+        scores = reranker.rerank(query, [(chunk_id, docs[chunk_id].page_content) for chunk_id, _ in pool])
+        if scores is not None:
+            fused = sorted(zip((chunk_id for chunk_id, _ in pool), scores), key=lambda item: -item[1])
+        elif reranker.is_loading():
+            # 只有模型仍在加载属于暂时降级；加载失败或超出延迟预算时融合排序就是常态结果
+            complete = False
+    return Retrieval([ScoredChunk(docs[chunk_id], score) for chunk_id, score in fused[:k]], complete)
+
+def _hybrid_retrieve(
+    query: str,
+    k: Optional[int] = None,
+    candidate_k: Optional[int] = None,
+    metadata_filter: Optional[MetadataFilter] = None,
+    query_vector: Optional[QueryVector] = None,
+) -> Retrieval:
+    """hybrid_retrieve 的实现，同时返回结果是否完整（query_vector 见 _branches）"""
+    k = k or HYBRID_TOP_K
+    candidate_k = max(candidate_k or HYBRID_CANDIDATE_K, k)
+    
+    start_time = time.monotonic()
+    branches = _branches(query, candidate_k, metadata_filter, query_vector)
+    futures = [
+        _branch_executor.submit(_release_after(name, search)) if search is not None and _acquire_branch(name) else None
+        for name, search, _ in branches
+    ]
+    branch_hits = []
+    for (name, _, timeout), future in zip(branches, futures):
+        if future is None:
+            branch_hits.append(None)
+            continue
+        try:
+            # 超时从提交时刻起算，各路独立计时
+            branch_hits.append(future.result(timeout=max(0.0, start_time + timeout - time.monotonic())))
+        except FutureTimeoutError:
+            print(f"⚠️ {name}超时（>{timeout}秒），本次只返回其他检索的结果")
+            branch_hits.append(None)
+    return _fuse(query, branch_hits, k)
+
+def hybrid_retrieve(
+    query: str,
+    k: Optional[int] = None,
+    candidate_k: Optional[int] = None,
+    metadata_filter: Optional[MetadataFilter] = None,
+) -> List[ScoredChunk]:
+    """
+    混合检索：向量检索与 BM25 检索并发各取候选，按倒数排名融合（RRF）后返回前 k 个
+
+    某一路超时后不再等待，只用已完成的检索结果融合。
+    指定过滤条件时，两路检索都只在范围内的片段上打分（而非检索后再筛），范围再小也能取满候选。
+
+    Args:
+        query: 查询文本
+        k: 返回结果数，默认 HYBRID_TOP_K
+        candidate_k: 每路检索的候选数，默认 HYBRID_CANDIDATE_K
+        metadata_filter: 检索范围过滤条件
+
+    Returns:
+        按融合分数从高到低排列的结果（按片段 id 去重）
+    """
+    return _hybrid_retrieve(query, k, candidate_k, metadata_filter).chunks
+
+async def _ahybrid_retrieve(
+    query: str,
+    k: Optional[int] = None,
+    candidate_k: Optional[int] = None,
+    metadata_filter: Optional[MetadataFilter] = None,
+    query_vector: Optional[QueryVector] = None,
+) -> Retrieval:
+    """ahybrid_retrieve 的实现，同时返回结果是否完整"""
+    k = k or HYBRID_TOP_K
+    candidate_k = max(candidate_k or HYBRID_CANDIDATE_K, k)
+    
+    loop = asyncio.get_running_loop()
+    branches = _branches(query, candidate_k, metadata_filter, query_vector)
+    
+    async def run(name, search, timeout):
+        if search is None or not _acquire_branch(name):
+            return None
+        # shield：超时只放弃等待，不取消线程池中排队的任务（取消后任务不再执行，名额无法归还）
+        future = asyncio.wrap_future(_branch_executor.submit(_release_after(name, search)))
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            print(f"⚠️ {name}超时（>{timeout}秒），本次只返回其他检索的结果")
+            return None
+    
+    branch_hits = await asyncio.gather(*(run(*branch) for branch in branches))
+    return await loop.run_in_executor(_branch_executor, _fuse, query, list(branch_hits), k)
+
+async def ahybrid_retrieve(
+    query: str,
+    k: Optional[int] = None,
+    candidate_k: Optional[int] = None,
+    metadata_filter: Optional[MetadataFilter] = None,
+) -> List[ScoredChunk]:
+    """hybrid_retrieve 的异步版本，检索在线程池中执行，不阻塞事件循环"""
+    return (await _ahybrid_retrieve(query, k, candidate_k, metadata_filter)).chunks
+
+def hybrid_retrieve_batch(
+    queries: List[str],
+    k: Optional[int] = None,
+    candidate_k: Optional[int] = None,
+    metadata_filter: Optional[MetadataFilter] = None,
+) -> List[List[ScoredChunk]]:
+    """
+    批量混合检索（供离线评估和需要拆分子查询的 Agent 使用）
+
+    全部查询一次批量向量化、一次 FAISS 检索，BM25 批量打分，两路并发执行，
+    再逐个查询做 RRF 融合。批量调用不设超时。
+
+    Args:
+        queries: 查询文本列表
+        k: 每个查询的返回结果数，默认 HYBRID_TOP_K
+        candidate_k: 每路检索的候选数，默认 HYBRID_CANDIDATE_K
+        metadata_filter: 检索范围过滤条件，所有查询共用
+
+    Returns:
+        与 queries 一一对应的检索结果
+    """
+    k = k or HYBRID_TOP_K
+    candidate_k = max(candidate_k or HYBRID_CANDIDATE_K, k)
+    
+    vector_future = _branch_executor.submit(registry.vector_search_batch, queries, candidate_k, metadata_filter)
+    bm25_future = _branch_executor.submit(registry.bm25_search_batch, queries, candidate_k, metadata_filter)
+    return [
+        _fuse(query, [vector_hits, bm25_hits], k).chunks
+        for query, vector_hits, bm25_hits in zip(queries, vector_future.result(), bm25_future.result())
+    ]
 
-def hybrid_search(query: str) -> str:
+def _result_header(position: int, result: ScoredChunk) -> str:
+    source = result.document.metadata.get("source", "未知来源")
+    return f"[{position}] 相关度: {result.score:.4f} | 来源: {source}\n"
+
+def format_results(results: List[ScoredChunk], token_budget: Optional[int] = None) -> str:
+    """
+    将检索结果格式化为工具输出（含相关度分数和来源）
+
+    同一来源的相邻片段合并并去掉分块重叠，总长度控制在 token 预算内（标题和分隔符也计入）。
+
+    Args:
+        results: 按相关度从高到低排列的检索结果
+        token_budget: token 预算，默认 CONTEXT_TOKEN_BUDGET，0 表示不限制
+    """
+    separator_tokens = count_tokens(RESULT_SEPARATOR)
+    packed = pack_chunks(
+        results,
+        token_budget,
+        overhead=lambda position, result: count_tokens(_result_header(position, result))
+        + (separator_tokens if position > 1 else 0),
+    )
+    return RESULT_SEPARATOR.join(
+        _result_header(i, result) + result.document.page_content for i, result in enumerate(packed, 1)
+    )
+
+def hybrid_search(
+    query: str,
+    path_prefix: Optional[str] = None,
+    file_type: Optional[str] = None,
+    modified_after: Optional[str] = None,
+    modified_before: Optional[str] = None,
+    collection: Optional[str] = None,
+) -> str:
     """使用向量检索和关键词检索的混合方法
     
     适用于需要理解语义、上下文、概念的问题。
-    结合FAISS向量相似度检索和BM25关键词检索，提供更准确的搜索结果。
+    结合FAISS向量相似度检索和BM25关键词检索，按倒数排名融合后返回得分最高的片段。
+    可按知识库集合、路径前缀、文件类型、修改日期限定检索范围。
     """
-    if faiss is None or bm25 is None:
+    if not registry.is_available():
         return "⚠️ 本地知识库尚未构建，请先构建索引。"
     
-    # FAISS向量检索
-    faiss_docs = faiss.similarity_search(query, k=2)
+    try:
+        metadata_filter = MetadataFilter.parse(path_prefix, file_type, modified_after, modified_before, collection)
+    except ValueError as e:
+        return f"⚠️ 过滤条件无效: {e}"
+    
+    def search(q: str, query_vector: Optional[QueryVector]):
+        retrieval = _hybrid_retrieve(q, metadata_filter=metadata_filter, query_vector=query_vector)
+        return format_results(retrieval.chunks) or "未找到相关本地信息。", retrieval.complete
+    
+    return _cached(_cache_namespace("hybrid_search", metadata_filter), query, search, semantic=True)
+
+def hybrid_search_batch(queries: List[str], metadata_filter: Optional[MetadataFilter] = None) -> List[str]:
+    """批量混合检索，返回与 queries 一一对应的工具输出文本"""
+    if not registry.is_available():
+        return ["⚠️ 本地知识库尚未构建，请先构建索引。" for _ in queries]
+    
+    return [
+        format_results(results) or "未找到相关本地信息。"
+        for results in hybrid_retrieve_batch(queries, metadata_filter=metadata_filter)
+    ]
+
+async def ahybrid_search(
+    query: str,
+    path_prefix: Optional[str] = None,
+    file_type: Optional[str] = None,
+    modified_after: Optional[str] = None,
+    modified_before: Optional[str] = None,
+    collection: Optional[str] = None,
+) -> str:
+    """hybrid_search 的异步版本（供 Agent 异步调用）"""
+    if not registry.is_available():
+        return "⚠️ 本地知识库尚未构建，请先构建索引。"
     
-    # BM25关键词检索（使用invoke方法，兼容新版本API）
     try:
-        bm25_docs = bm25.invoke(query) if hasattr(bm25, 'invoke') else bm25.get_relevant_documents(query)
-    except AttributeError:
-        # 如果都没有，尝试直接调用
-        bm25_docs = []
+        metadata_filter = MetadataFilter.parse(path_prefix, file_type, modified_after, modified_before, collection)
+    except ValueError as e:
+        return f"⚠️ 过滤条件无效: {e}"
     
-    docs = faiss_docs + (bm25_docs if isinstance(bm25_docs, list) else [])
-    uniq = {d.page_content: d for d in docs}
-    return "\n\n---\n\n".join(uniq.keys()) or "未找到相关本地信息。"
+    async def asearch(q: str, query_vector: Optional[QueryVector]):
+        retrieval = await _ahybrid_retrieve(q, metadata_filter=metadata_filter, query_vector=query_vector)
+        # 打包需要计数 token（可能加载分词器），在线程池中执行，不阻塞事件循环
+        output = await asyncio.get_running_loop().run_in_executor(_branch_executor, format_results, retrieval.chunks)
+        return output or "未找到相关本地信息。", retrieval.complete
+    
+    return await _acached(_cache_namespace("hybrid_search", metadata_filter), query, asearch, semantic=True)
 
 class SearchInput(BaseModel):
     query: str = Field(description="用户问题或查询关键词")
+    path_prefix: Optional[str] = Field(default=None, description="可选，只检索该目录或文件下的文档，如 'docs/manual' 或 'guide.pdf'")
+    file_type: Optional[str] = Field(default=None, description="可选，只检索这些文件类型，逗号分隔，如 'pdf,md'")
+    modified_after: Optional[str] = Field(default=None, description="可选，只检索在该日期及之后修改的文档，格式 YYYY-MM-DD")
+    modified_before: Optional[str] = Field(default=None, description="可选，只检索在该日期之前修改的文档，格式 YYYY-MM-DD")
+    collection: Optional[str] = Field(default=None, description="可选，只检索这些知识库集合，逗号分隔，如 'hr,engineering'；不填时检索全部集合")
 
 def build_simple_search_tool():
     """构建简单关键词检索工具"""
-    return Tool.from_function(
+    return StructuredTool.from_function(
         func=simple_keyword_search,
         name="simple_keyword_search",
-        description="简单关键词检索工具。适用于明确的术语、名称、具体关键词查询。当用户询问具体的名称、术语、关键词时使用此工具。例如：'知觅是什么'、'如何安装'、'配置文件位置'等。",
+        description="简单关键词检索工具。适用于明确的术语、名称、具体关键词查询。当用户询问具体的名称、术语、关键词时使用此工具。例如：'知觅是什么'、'如何安装'、'配置文件位置'等。用户限定了文档范围（某个目录、文件类型或时间段）时，通过可选参数缩小检索范围。",
         args_schema=SearchInput,
     )
 
 def build_search_tool():
     """构建混合检索工具"""
-    return Tool.from_function(
+    return StructuredTool.from_function(
         func=hybrid_search,
+        coroutine=ahybrid_search,
         name="hybrid_search",
-        description="混合检索工具（向量检索+关键词检索）。适用于需要理解语义、上下文、概念的问题。当用户询问需要理解含义、上下文关系、概念解释的问题时使用此工具。例如：'解释一下工作原理'、'它们之间的关系是什么'、'这个概念如何应用'等。",
+        description="混合检索工具（向量检索+关键词检索）。适用于需要理解语义、上下文、概念的问题。当用户询问需要理解含义、上下文关系、概念解释的问题时使用此工具。例如：'解释一下工作原理'、'它们之间的关系是什么'、'这个概念如何应用'等。用户限定了文档范围（某个目录、文件类型或时间段）时，通过可选参数缩小检索范围。",
         args_schema=SearchInput,
     )
-
@@ -14,16 +14,19 @@ os.chdir(project_root)
 from dotenv import load_dotenv
 load_dotenv()
 
+import threading
 import streamlit as st
 from audio_recorder_streamlit import audio_recorder
 from zhimi.agent import (
-    load_agent, 
+    get_agent,
+    stream_agent,
     SESSION_STORE, 
     HISTORY_WINDOW,
     get_user_memory,
-    update_user_memory_from_conversation
+    submit_memory_update
 )
 from zhimi.asr import transcribe_audio, ASRError
+from zhimi.tools.search_tool import warmup as warmup_retrievers
 
 st.set_page_config(page_title="知觅 Agent", page_icon="🌿")
 st.title("🌿 知觅 – Qwen + 本地知识库")
@@ -41,24 +44,54 @@ def process_user_input(prompt: str, session_id: str):
     st.session_state.messages.append({"role": "user", "content": prompt})
     st.chat_message("user").write(prompt)
     
-    # 调用Agent
-    with st.spinner("正在思考中..."):
+    # 流式调用Agent：工具调用进度显示在状态框中，最终回答逐字显示
+    error = None
+    with st.chat_message("assistant"):
+        status = st.status("正在思考中...", expanded=False)
+        placeholder = st.empty()
         try:
-            response = st.session_state.agent.invoke(
-                {"input": prompt},
-                config={"configurable": {"session_id": session_id}}
-            )
-            assistant_response = response.get("output", "抱歉，我无法回答这个问题。")
-            
-            # 添加助手回复到历史
-            st.session_state.messages.append({"role": "assistant", "content": assistant_response})
-            st.chat_message("assistant").write(assistant_response)
-            
-            # 自动更新用户记忆（从对话历史中提取）
-            update_memory_if_needed(session_id)
-            
+            assistant_response = stream_response(prompt, session_id, status, placeholder)
         except Exception as e:
-            handle_agent_error(e)
+            status.update(label="❌ 出错了", state="error")
+            placeholder.empty()
+            error = e
+    if error is not None:
+        handle_agent_error(error)
+        return
+    
+    # 添加助手回复到历史
+    st.session_state.messages.append({"role": "assistant", "content": assistant_response})
+    
+    # 自动更新用户记忆（从对话历史中提取）
+    update_memory_if_needed(session_id)
+
+
+def stream_response(prompt: str, session_id: str, status, placeholder) -> str:
+    """逐个渲染 Agent 流式事件，返回最终回答"""
+    answer = ""
+    tool_calls = 0
+    for event in stream_agent(st.session_state.agent, prompt, session_id):
+        if event.kind == "token":
+            answer += event.content
+            placeholder.markdown(answer + "▌")
+        elif event.kind == "tool_start":
+            # 调用工具前模型输出的文字属于中间过程，不作为回答显示
+            answer = ""
+            placeholder.empty()
+            tool_calls += 1
+            status.update(label=f"🔍 正在调用 {event.name}...", state="running")
+            status.write(f"🔍 **{event.name}**：{event.content}")
+        elif event.kind == "tool_end":
+            status.write(f"✅ **{event.name}** 返回 {len(event.content)} 字")
+            status.update(label="正在生成回答...")
+        elif event.kind == "output":
+            answer = event.content or answer
+    
+    answer = answer or "抱歉，我无法回答这个问题。"
+    placeholder.markdown(answer)
+    label = f"✅ 已完成（调用工具 {tool_calls} 次）" if tool_calls else "✅ 已完成"
+    status.update(label=label, state="complete")
+    return answer
 
 
 def process_audio_input(audio_data: bytes, session_id: str, audio_format: str):
@@ -97,15 +130,8 @@ def update_memory_if_needed(session_id: str):
             # 只在对话轮数达到一定数量时更新（避免频繁调用LLM）
             # 每2轮对话（4条消息）更新一次记忆
             if len(full_history.messages) % 4 == 0:
-                try:
-                    # 异步更新记忆（不阻塞UI）
-                    memory_updated = update_user_memory_from_conversation(session_id, full_history.messages)
-                    if memory_updated:
-                        # 重新加载Agent以更新系统提示词中的记忆
-                        st.session_state.agent = load_agent(session_id)
-                except Exception as e:
-                    # 记忆更新失败不影响对话，静默处理
-                    pass
+                # 在后台线程中提取记忆（不阻塞UI），完成后 Agent 下次调用时自动注入新的记忆
+                submit_memory_update(session_id, full_history.messages)
 
 
 def handle_agent_error(e: Exception):
@@ -210,8 +236,11 @@ for message in st.session_state.messages:
 
 # 加载Agent（延迟加载，避免重复初始化）
 if "agent" not in st.session_state:
+    # 后台预加载嵌入模型和知识库索引，不阻塞页面渲染（重复调用时直接返回）
+    threading.Thread(target=warmup_retrievers, daemon=True).start()
     with st.spinner("正在初始化Agent..."):
-        st.session_state.agent = load_agent(SESSION_ID)
+        # 进程内共享同一个 Agent，用户记忆在每次调用时注入
+        st.session_state.agent = get_agent()
 
 # 输入方式选择
 input_tab1, input_tab2 = st.tabs(["📝 文本输入", "🎤 语音输入"])